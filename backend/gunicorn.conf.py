@@ -0,0 +1,24 @@
+"""
+Gunicorn settings for render.yaml (gunicorn also picks this file up from the working directory).
+
+Workers share Prometheus metrics through files in PROMETHEUS_MULTIPROC_DIR, see the METRICS
+section of server.py. The variable has to be set before prometheus_client is imported, which
+the forked workers inherit from here.
+"""
+import os
+import shutil
+
+multiproc_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/firmanager-metrics")
+
+from prometheus_client import multiprocess  # noqa: E402 (reads the variable on import)
+
+
+def on_starting(server):
+    # Files from the previous run would be added to this run's counters
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir)
+
+
+def child_exit(server, worker):
+    # Drops the dead worker's live gauges; its counters and histograms stay in the totals
+    multiprocess.mark_process_dead(worker.pid)
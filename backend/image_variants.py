@@ -0,0 +1,90 @@
+"""
+Identifies uploaded product images by their content and renders their resized and WebP variants.
+
+Runs in the server's process pool, so it is kept apart from server.py: a worker only has to
+import this module and Pillow, not the whole application.
+
+    <digest>.<ext>             original as uploaded
+    <digest>.webp              original re-encoded as WebP
+    <digest>-<size>.<ext>      resized to fit <size> px, same format as the original
+    <digest>-<size>.webp       resized, WebP
+"""
+from pathlib import Path
+
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+# Pillow format name -> stored extension
+FORMATS = {"JPEG": "jpg", "PNG": "png", "GIF": "gif", "WEBP": "webp"}
+# Leading bytes of each format, checked instead when Pillow isn't installed
+SIGNATURES = [(b"\xff\xd8\xff", "jpg"), (b"\x89PNG\r\n\x1a\n", "png"), (b"GIF87a", "gif"), (b"GIF89a", "gif")]
+
+
+def variant_name(digest, size, fmt):
+    """File name of one variant; size "original" is the full-size image"""
+    return f"{digest}.{fmt}" if size == "original" else f"{digest}-{size}.{fmt}"
+
+
+def identify(source):
+    """Extension for the image in `source` judged by its content, or None when it isn't a JPEG,
+    PNG, GIF or WebP that decodes. Without Pillow only the file signature is checked."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return sniff(source)
+    try:
+        with Image.open(source) as image:
+            fmt = image.format
+            image.load()
+    except Exception:  # Truncated, corrupt or oversized files fail in many different ways
+        return None
+    return FORMATS.get(fmt)
+
+
+def sniff(source):
+    with open(source, "rb") as handle:
+        header = handle.read(12)
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    for signature, ext in SIGNATURES:
+        if header.startswith(signature):
+            return ext
+    return None
+
+
+def render_variants(source, sizes):
+    """Write every variant of `source` that doesn't exist yet. `sizes` maps a size name to the
+    longest edge in pixels. Returns the file names written."""
+    from PIL import Image, ImageOps
+
+    source = Path(source)
+    digest, ext = source.stem, source.suffix.lstrip(".")
+    written = []
+    with Image.open(source) as original:
+        original = ImageOps.exif_transpose(original)
+        targets = [("original", None, "webp")] + [
+            (size, edge, fmt) for size, edge in sizes.items() for fmt in (ext, "webp")
+        ]
+        for size, edge, fmt in targets:
+            path = source.with_name(variant_name(digest, size, fmt))
+            if path.exists():
+                continue
+            image = original.copy()
+            if edge:
+                image.thumbnail((edge, edge), Image.LANCZOS)
+            # Write under a temporary name so a request never sees half an image
+            partial = path.with_name(f".{path.name}.partial")
+            save(image, partial, fmt)
+            partial.replace(path)
+            written.append(path.name)
+    return written
+
+
+def save(image, path, fmt):
+    if fmt == "webp":
+        image.save(path, "WEBP", quality=WEBP_QUALITY, method=4)
+    elif fmt == "jpg":
+        image.convert("RGB").save(path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    elif fmt == "gif":
+        image.save(path, "GIF")
+    else:
+        image.save(path, "PNG", optimize=True)
@@ -1,11 +1,17 @@
 """
 Seed script for ServiceManager application with Norwegian test data
 Multi-tenancy version: Creates two organizations (VMP and Biovac)
+
+    python seed_data.py                  # small demo data set
+    python seed_data.py --scale 100      # per organization: 100k customers, 1M work orders over 5 years
 """
+import argparse
 import asyncio
+import bisect
 import sys
 import os
-from datetime import datetime, timedelta
+import time
+from datetime import date, datetime, timedelta, timezone
 import random
 
 # Add parent directory to path
@@ -40,14 +46,285 @@ NORWEGIAN_STREETS = ["Storgata", "Kirkegata", "Skole", "Høyveien", "Strand", "H
 COMPANY_TYPES = ["AS", "Barnehage", "Skole", "Sykehjem", "Borettslag", "Bedrift", "Kontor"]
 PRODUCT_CATEGORIES = ["Brannsikkerhet", "Ventilasjon", "Varme", "Kjøling", "Sanitær"]
 
-async def seed_database():
+# Volume data: regions weighted roughly by population, each with a few postnr cluster centers
+# (center, poststed, kommune). Customers are spread around the centers, so postnr ranges cluster.
+POSTNR_REGIONS = [
+    (24, [(150, "Oslo", "Oslo"), (484, "Oslo", "Oslo"), (661, "Oslo", "Oslo"), (1170, "Oslo", "Oslo")]),
+    (13, [(1336, "Sandvika", "Bærum"), (1403, "Langhus", "Nordre Follo"), (2000, "Lillestrøm", "Lillestrøm"),
+          (1601, "Fredrikstad", "Fredrikstad"), (1701, "Sarpsborg", "Sarpsborg")]),
+    (7, [(2317, "Hamar", "Hamar"), (2609, "Lillehammer", "Lillehammer"), (2815, "Gjøvik", "Gjøvik")]),
+    (9, [(3001, "Drammen", "Drammen"), (3117, "Tønsberg", "Tønsberg"), (3256, "Larvik", "Larvik"), (3715, "Skien", "Skien")]),
+    (14, [(4001, "Stavanger", "Stavanger"), (4302, "Sandnes", "Sandnes"), (4601, "Kristiansand", "Kristiansand"),
+          (5527, "Haugesund", "Haugesund")]),
+    (13, [(5003, "Bergen", "Bergen"), (5089, "Bergen", "Bergen"), (6003, "Ålesund", "Ålesund"), (6413, "Molde", "Molde")]),
+    (9, [(7010, "Trondheim", "Trondheim"), (7042, "Trondheim", "Trondheim"), (7500, "Stjørdal", "Stjørdal")]),
+    (5, [(8006, "Bodø", "Bodø"), (8514, "Narvik", "Narvik"), (8602, "Mo i Rana", "Rana")]),
+    (6, [(9008, "Tromsø", "Tromsø"), (9405, "Harstad", "Harstad"), (9601, "Hammerfest", "Hammerfest")]),
+]
+# Service weeks avoid the summer holiday (weeks 28-31), Easter and Christmas
+SERVICE_WEEK_WEIGHTS = [
+    0.3 if week in (1, 52) else 0.15 if 28 <= week <= 31 else 0.6 if week in (14, 15) else 1.0
+    for week in range(1, 53)
+]
+ORDER_TYPES = (["service", "extra", "montering"], [70, 20, 10])
+PAST_STATUSES = (["fullført", "avbrutt", "planlagt"], [93, 4, 3])
+SERVICE_INTERVALS = (["Årlig", "Halvårlig", "Kvartalsvis"], [75, 20, 5])
+CUSTOMERS_PER_TECHNICIAN = 400
+# Work orders are booked up to about three months ahead
+FUTURE_HORIZON_DAYS = 90
+
+
+def rng_uuid(rng: random.Random) -> str:
+    """uuid4 from the seeded generator, so ids are reproducible too"""
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def standard_services(rng, org_id, org_name):
+    now = datetime.now().isoformat()
+    tiers = [
+        ("T001", "Standard Service", "Standard serviceoppfølging", 1200.0, 950.0, 1425.0, 1900.0, 1000.0, 800.0, 6.5),
+        ("T002", "Premium Service", "Premium serviceoppfølging", 1800.0, 1200.0, 1800.0, 2400.0, 1300.0, 1000.0, 8.0),
+        ("T003", "Basic Service", "Grunnleggende service", 800.0, 700.0, 1050.0, 1400.0, 750.0, 600.0, 5.0),
+    ]
+    return [
+        {
+            "id": rng_uuid(rng),
+            "organization_id": org_id,
+            "tjenestenr": tjenestenr,
+            "tjeneste_navn": navn,
+            "beskrivelse": beskrivelse,
+            "leverandor": org_name,
+            "pris": pris,
+            "t1_ekstraservice": t1,
+            "t2_ekstraservice_50": t2,
+            "t3_ekstraservice_100": t3,
+            "t4_ekstraarbeid": t4,
+            "t5_kjoretid": t5,
+            "t6_km_godtgjorelse": t6,
+            "created_at": now
+        }
+        for tjenestenr, navn, beskrivelse, pris, t1, t2, t3, t4, t5, t6 in tiers
+    ]
+
+
+def generate_employees(rng, org_id, org_name, count):
+    employees = []
+    for i in range(count):
+        first_name = rng.choice(NORWEGIAN_FIRST_NAMES)
+        last_name = rng.choice(NORWEGIAN_LAST_NAMES)
+        employees.append({
+            "id": rng_uuid(rng),
+            "organization_id": org_id,
+            "initialer": f"{first_name[0]}{last_name[0]}{i + 1}",
+            "navn": f"{first_name} {last_name}",
+            "epost": f"{first_name.lower()}.{last_name.lower()}{i + 1}@{org_name.lower()}.no",
+            "stilling": rng.choice(["Servicetekniker", "Servicetekniker", "Montør", "Lærling"]),
+            "intern_sats": rng.randint(500, 800),
+            "faktura_sats": rng.randint(800, 1200),
+            "pa_service_sats": rng.randint(600, 900),
+            "pa_montering_sats": rng.randint(650, 950),
+            "pa_timesats": rng.randint(700, 1000),
+            "pa_kjoresats": rng.randint(400, 600),
+            "pa_km_sats": round(rng.uniform(5, 10), 2),
+            "created_at": datetime.now().isoformat()
+        })
+    return employees
+
+
+def generate_customers(rng, org_id, count, employees):
+    """Customers clustered around regional postnr centers, with service weeks spread over the year"""
+    region_weights = [weight for weight, _ in POSTNR_REGIONS]
+    weeks = list(range(1, 53))
+    week_cum = list(_cumulative(SERVICE_WEEK_WEIGHTS))
+    now = datetime.now().isoformat()
+    customers = []
+    for i in range(count):
+        _, centers = rng.choices(POSTNR_REGIONS, weights=region_weights)[0]
+        center, poststed, kommune = rng.choice(centers)
+        postnr = min(9999, max(1, center + int(rng.gauss(0, 12))))
+        company_type = rng.choice(COMPANY_TYPES)
+        typenr = rng.choices(["T001", "T002", "T003"], weights=[60, 15, 25])[0]
+        customers.append({
+            "id": rng_uuid(rng),
+            "organization_id": org_id,
+            "anleggsnr": str(100000 + i),
+            "kundennr": f"K{10000 + i}",
+            "kundnavn": f"{poststed} {company_type} {i + 1}",
+            "typenr": typenr,
+            "typenavn": {"T001": "Type A", "T002": "Type B", "T003": "Type C"}[typenr],
+            "kommune": kommune,
+            "adresse": f"{rng.choice(NORWEGIAN_STREETS)}vei {rng.randint(1, 150)}",
+            "postnr": f"{postnr:04d}",
+            "poststed": poststed,
+            "service_intervall": rng.choices(*SERVICE_INTERVALS)[0],
+            "uke": str(_pick(rng, weeks, week_cum)),
+            "serviceansvarlig": rng.choice(employees)['navn'],
+            "telefon1": f"+47 {rng.randint(20, 99)} {rng.randint(10, 99)} {rng.randint(10, 99)} {rng.randint(10, 99)}",
+            "created_at": now
+        })
+    return customers
+
+
+def _cumulative(weights):
+    total = 0
+    for weight in weights:
+        total += weight
+        yield total
+
+
+def _pick(rng, items, cum_weights):
+    """rng.choices(items, cum_weights=...)[0] without the per-call list; this runs millions of times"""
+    return items[bisect.bisect(cum_weights, rng.random() * cum_weights[-1])]
+
+
+def generate_workorders(rng, org_id, count, customers, employees, years):
+    """Work orders over the last `years` years, plus bookings up to FUTURE_HORIZON_DAYS ahead.
+
+    Services land in the customer's service week, extras and installations anywhere.
+    Customers earlier in the list get more orders, like real registers where a few sites
+    dominate. Yields documents so large counts never sit in memory at once.
+    """
+    today = date.today()
+    horizon = today + timedelta(days=FUTURE_HORIZON_DAYS)
+    first_year = today.year - years + 1
+    weeks = list(range(1, 53))
+    week_cum = list(_cumulative(SERVICE_WEEK_WEIGHTS))
+    types, type_weights = ORDER_TYPES
+    type_cum = list(_cumulative(type_weights))
+    statuses, status_weights = PAST_STATUSES
+    status_cum = list(_cumulative(status_weights))
+    # Each customer mostly sees the same technician
+    technician = {}
+    created_at = datetime.now(timezone.utc).isoformat()
+
+    for _ in range(count):
+        customer = customers[int(len(customers) * rng.random() ** 1.3)]
+        order_type = _pick(rng, types, type_cum)
+        year = first_year + rng.randrange(years)
+        if order_type == "service":
+            week = min(52, max(1, int(customer['uke']) + rng.choice((-1, 0, 0, 0, 1))))
+            arbeidstid = rng.choice((1.0, 1.5, 1.5, 2.0, 2.0, 2.5, 3.0))
+        else:
+            week = _pick(rng, weeks, week_cum)
+            arbeidstid = rng.choice((0.5, 1.0, 2.0, 3.0, 4.0)) if order_type == "extra" else rng.choice((4.0, 6.0, 7.5, 12.0, 15.0))
+        day = date.fromisocalendar(year, week, rng.randrange(1, 6))
+        if day > horizon:
+            # Later this year than anyone plans: the same week last year instead
+            day = date.fromisocalendar(year - 1, week, day.isoweekday())
+        start = datetime(day.year, day.month, day.day, rng.randrange(7, 15), rng.choice((0, 30)), tzinfo=timezone.utc)
+
+        if customer['id'] not in technician:
+            technician[customer['id']] = rng.choice(employees)['id']
+        employee_id = technician[customer['id']] if rng.random() < 0.8 else rng.choice(employees)['id']
+
+        yield {
+            "id": rng_uuid(rng),
+            "organization_id": org_id,
+            "customer_id": customer['id'],
+            "employee_id": employee_id,
+            "date": start.isoformat(),
+            "order_type": order_type,
+            "status": "planlagt" if day > today else _pick(rng, statuses, status_cum),
+            "description": None,
+            "arbeidstid": arbeidstid,
+            "kjoretid": rng.choice((0.25, 0.5, 0.5, 0.75, 1.0, 1.5)),
+            "kjorte_km": float(rng.randint(3, 80)),
+            "created_at": created_at
+        }
+
+
+def generate_internalorders(rng, org_id, count, employees, years):
+    today = date.today()
+    start = today - timedelta(days=365 * years)
+    task_types = ["kontor", "ekstra", "montering", "soknad", "vedlikehold", "diverse"]
+    created_at = datetime.now(timezone.utc).isoformat()
+    for _ in range(count):
+        day = start + timedelta(days=rng.randrange((today - start).days))
+        yield {
+            "id": rng_uuid(rng),
+            "organization_id": org_id,
+            "avdeling": rng.choice(["Drift", "Service", "Administrasjon"]),
+            "date": datetime(day.year, day.month, day.day, 8, tzinfo=timezone.utc).isoformat(),
+            "employee_id": rng.choice(employees)['id'],
+            "beskrivelse": "Internt arbeid",
+            "arbeidstid": rng.choice((1.0, 2.0, 3.75, 7.5)),
+            "task_type": rng.choice(task_types),
+            "kommentar": None,
+            "created_at": created_at
+        }
+
+
+async def write_batches(collection, docs, batch_size=5000, writers=4):
+    """insert_many in batches with `writers` inserts in flight while the next batch is generated"""
+    queue = asyncio.Queue(maxsize=writers * 2)
+    written = 0
+
+    async def writer():
+        nonlocal written
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            await collection.insert_many(batch, ordered=False)
+            written += len(batch)
+
+    tasks = [asyncio.create_task(writer()) for _ in range(writers)]
+    try:
+        batch = []
+        for doc in docs:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                await queue.put(batch)
+                batch = []
+        if batch:
+            await queue.put(batch)
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return written
+
+
+async def seed_volume_organization(db, org_id, org_name, customers=1000, workorders=10000, years=5,
+                                   seed=42, batch_size=5000, writers=4):
+    """Bulk-generate one organization's data; returns the generated customers' anleggsnr"""
+    rng = random.Random(f"{seed}:{org_name}")
+    started = time.perf_counter()
+
+    employees = generate_employees(rng, org_id, org_name, max(4, customers // CUSTOMERS_PER_TECHNICIAN))
+    customer_docs = generate_customers(rng, org_id, customers, employees)
+    await asyncio.gather(
+        db.employees.insert_many(employees),
+        db.services.insert_many(standard_services(rng, org_id, org_name)),
+        write_batches(db.customers, customer_docs, batch_size, writers),
+    )
+    # Work orders and internal orders are written side by side; separate generators keep them reproducible
+    counts = await asyncio.gather(
+        write_batches(db.workorders, generate_workorders(rng, org_id, workorders, customer_docs, employees, years),
+                      batch_size, writers),
+        write_batches(db.internalorders, generate_internalorders(random.Random(f"{seed}:{org_name}:internal"),
+                                                                 org_id, workorders // 20, employees, years),
+                      batch_size, writers),
+    )
+    print(f"  ✅ {org_name}: {len(employees)} employees, {len(customer_docs)} customers, "
+          f"{counts[0]} work orders, {counts[1]} internal orders in {time.perf_counter() - started:.1f}s")
+    return [customer['anleggsnr'] for customer in customer_docs]
+
+
+async def seed_database(volume=None, seed=42):
+    """volume: None for the small demo data set, otherwise seed_volume_organization keyword
+    arguments (customers, workorders, years, batch_size, writers) applied to each organization"""
+    random.seed(seed)
     client = AsyncIOMotorClient(MONGO_URL)
     db = client[DB_NAME]
     
     print("🗑️  Cleaning existing data...")
     collections = ['organizations', 'users', 'customers', 'employees', 'workorders', 'internalorders', 
                   'products', 'routes', 'hms_risk_assessments', 'hms_incidents', 
-                  'hms_training', 'hms_equipment', 'payouts', 'services', 'supplier_pricing']
+                  'hms_training', 'hms_equipment', 'payouts', 'services', 'supplier_pricing',
+                  'changes', 'sync_counters', 'sync_operations', 'usage_counters']
     
     for collection in collections:
         await db[collection].delete_many({})
@@ -256,62 +533,18 @@ async def seed_database():
         print(f"  ✅ Created {len(products)} products")
         
         print(f"  📋 Creating services for {org_name}...")
-        services = [
-            {
-                "id": str(uuid.uuid4()),
-                "organization_id": org_id,
-                "tjenestenr": "T001",
-                "tjeneste_navn": "Standard Service",
-                "beskrivelse": "Standard serviceoppfølging",
-                "leverandor": org_name,
-                "pris": 1200.0,
-                "t1_ekstraservice": 950.0,
-                "t2_ekstraservice_50": 1425.0,
-                "t3_ekstraservice_100": 1900.0,
-                "t4_ekstraarbeid": 1000.0,
-                "t5_kjoretid": 800.0,
-                "t6_km_godtgjorelse": 6.5,
-                "created_at": datetime.now().isoformat()
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "organization_id": org_id,
-                "tjenestenr": "T002",
-                "tjeneste_navn": "Premium Service",
-                "beskrivelse": "Premium serviceoppfølging",
-                "leverandor": org_name,
-                "pris": 1800.0,
-                "t1_ekstraservice": 1200.0,
-                "t2_ekstraservice_50": 1800.0,
-                "t3_ekstraservice_100": 2400.0,
-                "t4_ekstraarbeid": 1300.0,
-                "t5_kjoretid": 1000.0,
-                "t6_km_godtgjorelse": 8.0,
-                "created_at": datetime.now().isoformat()
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "organization_id": org_id,
-                "tjenestenr": "T003",
-                "tjeneste_navn": "Basic Service",
-                "beskrivelse": "Grunnleggende service",
-                "leverandor": org_name,
-                "pris": 800.0,
-                "t1_ekstraservice": 700.0,
-                "t2_ekstraservice_50": 1050.0,
-                "t3_ekstraservice_100": 1400.0,
-                "t4_ekstraarbeid": 750.0,
-                "t5_kjoretid": 600.0,
-                "t6_km_godtgjorelse": 5.0,
-                "created_at": datetime.now().isoformat()
-            }
-        ]
+        services = standard_services(random, org_id, org_name)
         await db.services.insert_many(services)
         print(f"  ✅ Created {len(services)} services")
     
     # Seed data for both organizations
-    await seed_organization_data(vmp_org_id, "VMP", num_customers=15)
-    await seed_organization_data(biovac_org_id, "Biovac", num_customers=20)
+    if volume:
+        print(f"\n📊 Generating volume data: {volume}")
+        for org_id, org_name in [(vmp_org_id, "VMP"), (biovac_org_id, "Biovac")]:
+            await seed_volume_organization(db, org_id, org_name, seed=seed, **volume)
+    else:
+        await seed_organization_data(vmp_org_id, "VMP", num_customers=15)
+        await seed_organization_data(biovac_org_id, "Biovac", num_customers=20)
     
     print("\n✨ Database seeding completed successfully!")
     print("\n📝 Test Login Credentials:")
@@ -327,4 +560,25 @@ async def seed_database():
     client.close()
 
 if __name__ == "__main__":
-    asyncio.run(seed_database())
+    parser = argparse.ArgumentParser(description="Seed the database with Norwegian test data")
+    parser.add_argument("--scale", type=float, default=0,
+                        help="Volume data: 1000 x scale customers and 10 work orders per customer per organization")
+    parser.add_argument("--customers", type=int, help="Customers per organization (overrides --scale)")
+    parser.add_argument("--workorders", type=int, help="Work orders per organization (overrides --scale)")
+    parser.add_argument("--years", type=int, default=5, help="Years of work order history")
+    parser.add_argument("--seed", type=int, default=42, help="RNG seed; the same seed gives the same data")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--writers", type=int, default=4, help="Concurrent insert_many calls per collection")
+    args = parser.parse_args()
+
+    volume = None
+    if args.scale or args.customers or args.workorders:
+        customers = args.customers or int(1000 * (args.scale or 1))
+        volume = {
+            "customers": customers,
+            "workorders": args.workorders if args.workorders is not None else customers * 10,
+            "years": args.years,
+            "batch_size": args.batch_size,
+            "writers": args.writers,
+        }
+    asyncio.run(seed_database(volume, args.seed))
@@ -1,28 +1,754 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Query, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.routing import APIRoute
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+import bson
+import pymongo
+from pymongo import ReturnDocument, InsertOne, UpdateOne, DeleteOne, monitoring
+from pymongo.errors import (
+    BulkWriteError, OperationFailure, CollectionInvalid, ConnectionFailure, ExecutionTimeout,
+    ServerSelectionTimeoutError, WTimeoutError
+)
 import os
+import sys
+import json
+import math
+import asyncio
+import bisect
+import collections
+import threading
+import time
+import functools
+import random
+import importlib
+import importlib.util
+import multiprocessing
+import concurrent.futures
+import warnings
+import contextvars
+from contextlib import contextmanager, asynccontextmanager
 import logging
 import traceback
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr, ConfigDict
+from pydantic import BaseModel, Field, EmailStr, ConfigDict, ValidationError
 from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
 import jwt
 from passlib.context import CryptContext
-import pandas as pd
 from io import BytesIO
+from urllib.parse import parse_qs
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, ProcessCollector, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+
+import image_variants
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# ==================== LAZY IMPORTS ====================
+# pandas (with numpy) and openpyxl are a large share of a cold start and only the Excel
+# import endpoints use them. They load on first use, or in a background thread the lifespan
+# starts once the worker is serving.
+
+HEAVY_MODULES = ["pandas", "openpyxl"]
+WARM_HEAVY_IMPORTS = os.environ.get('WARM_HEAVY_IMPORTS', 'true').lower() in ('1', 'true', 'yes')
+
+def load_pandas():
+    import pandas
+    return pandas
+
+def import_heavy_modules():
+    for name in HEAVY_MODULES:
+        started = time.perf_counter()
+        importlib.import_module(name)
+        logging.getLogger(__name__).info(f"Imported {name} in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+# ==================== REQUEST STATS ====================
+# Per-request accounting of database work and where the time went. Motor copies the context
+# into its worker threads, so the command listeners can add to the current request's stats.
+
+# Test runs warn when a request issues more Mongo operations than this, to catch N+1 patterns
+TEST_MODE = os.environ.get('TEST_MODE', '').lower() in ('1', 'true', 'yes')
+REQUEST_DB_OP_BUDGET = int(os.environ.get('REQUEST_DB_OP_BUDGET', '20'))
+# Counting reply bytes means encoding every reply again, up to 16 MB per cursor batch, so only
+# this share of requests measure it (every request in test runs)
+DB_REPLY_BYTES_SAMPLE_RATE = float(os.environ.get('DB_REPLY_BYTES_SAMPLE_RATE', '1' if TEST_MODE else '0'))
+
+class DbBudgetExceeded(UserWarning):
+    pass
+
+class RequestStats:
+    def __init__(self):
+        self.db_ops = 0
+        self.db_docs = 0
+        # None when this request isn't sampled for reply sizes
+        self.db_bytes = 0 if random.random() < DB_REPLY_BYTES_SAMPLE_RATE else None
+        self.db_ms = 0.0
+        self.timings = {}  # name -> ms
+        self.user = None  # Set by get_current_user
+        self._lock = threading.Lock()
+
+    @property
+    def measures_bytes(self) -> bool:
+        return self.db_bytes is not None
+
+    def add_db(self, duration_ms: float, docs: int, nbytes: Optional[int]):
+        with self._lock:
+            self.db_ops += 1
+            self.db_docs += docs
+            if nbytes is not None and self.db_bytes is not None:
+                self.db_bytes += nbytes
+            self.db_ms += duration_ms
+
+    def add(self, name: str, duration_ms: float):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + duration_ms
+
+    def server_timing(self, total_ms: float) -> str:
+        """Server-Timing header value; durations overlap (db time is part of handler time)"""
+        desc = f"{self.db_ops} ops, {self.db_docs} docs" + (f", {self.db_bytes} B" if self.measures_bytes else "")
+        entries = [f'db;dur={self.db_ms:.1f};desc="{desc}"']
+        entries += [f"{name};dur={ms:.1f}" for name, ms in self.timings.items()]
+        entries.append(f"total;dur={total_ms:.1f}")
+        return ", ".join(entries)
+
+request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+@contextmanager
+def timed(name: str):
+    """Add the block's duration to the current request's Server-Timing entry `name`"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = request_stats.get()
+        if stats is not None:
+            stats.add(name, (time.perf_counter() - started) * 1000)
+
+class TimedRoute(APIRoute):
+    """Splits a request's time into the endpoint function itself ("handler") and the
+    request validation, dependency and response serialization work around it ("serialize",
+    excluding "auth" which get_current_user reports separately)."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        # include_router builds the route again from the already wrapped endpoint
+        if asyncio.iscoroutinefunction(endpoint) and not getattr(endpoint, "_timed", False):
+            original = endpoint
+
+            @functools.wraps(original)
+            async def endpoint(*args, **kw):
+                with timed("handler"):
+                    return await original(*args, **kw)
+            endpoint._timed = True
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            started = time.perf_counter()
+            try:
+                # Fail fast while the database is down, except for reads the caches can answer
+                if db_breaker.rejecting() and not (request.method == "GET" and self.path in STALE_READ_PATHS):
+                    db_breaker.rejected()
+                    raise database_unavailable()
+                # Every Mongo call in the request (auth included) gets the remaining time as maxTimeMS
+                with pymongo.timeout(query_deadline(self.path)):
+                    return await handler(request)
+            finally:
+                stats = request_stats.get()
+                if stats is not None:
+                    elapsed = (time.perf_counter() - started) * 1000
+                    around = elapsed - stats.timings.get("handler", 0.0) - stats.timings.get("auth", 0.0)
+                    stats.add("serialize", max(0.0, around))
+
+        return timed_handler
+
+# ==================== METRICS ====================
+# Under gunicorn a scrape reaches one worker at random, so gunicorn.conf.py sets
+# PROMETHEUS_MULTIPROC_DIR: every worker writes its values to files there and /metrics adds up
+# all of them. Without it (a single uvicorn process) metrics live in this process's registry.
+
+metrics_registry = CollectorRegistry()
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    scrape_registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(scrape_registry)
+else:
+    # Process CPU and memory only make sense for a single process
+    ProcessCollector(registry=metrics_registry)
+    scrape_registry = metrics_registry
+
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template",
+    ["method", "route", "status"], registry=metrics_registry
+)
+http_requests_in_progress = Gauge(
+    "http_requests_in_progress", "HTTP requests currently being handled", multiprocess_mode="livesum",
+    registry=metrics_registry
+)
+event_loop_lag = Histogram(
+    "event_loop_lag_seconds", "How late the event loop woke up a sleeping task",
+    buckets=DB_BUCKETS, registry=metrics_registry
+)
+mongodb_command_duration = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by collection and command",
+    ["collection", "command", "outcome"], buckets=DB_BUCKETS, registry=metrics_registry
+)
+mongodb_pool_checkout_wait = Histogram(
+    "mongodb_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+    ["outcome"], buckets=DB_BUCKETS, registry=metrics_registry
+)
+mongodb_pool_checked_out = Gauge(
+    "mongodb_pool_connections_checked_out", "Pooled connections currently in use", multiprocess_mode="livesum",
+    registry=metrics_registry
+)
+mongodb_pool_connections_created = Counter(
+    "mongodb_pool_connections_created", "Connections opened by the pool", registry=metrics_registry
+)
+admission_rejections_total = Counter(
+    "admission_rejections_total", "Requests turned away with 429 by per-organization admission control",
+    ["pool", "reason"], registry=metrics_registry
+)
+admission_queue_wait = Histogram(
+    "admission_queue_wait_seconds", "Time admitted requests waited for their organization's limits",
+    ["pool"], buckets=DB_BUCKETS, registry=metrics_registry
+)
+
+def command_collection(command_name: str, command: dict) -> str:
+    """Collection a command targets; empty for database-level commands (ping, hello, ...)"""
+    target = command.get('collection') if command_name == 'getMore' else command.get(command_name)
+    return target if isinstance(target, str) else ""
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Times every MongoDB command. Motor runs PyMongo in worker threads, so this must stay thread-safe."""
+
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        self._pending[(event.connection_id, event.request_id)] = command_collection(event.command_name, event.command)
+
+    def _finished(self, event, outcome: str):
+        collection = self._pending.pop((event.connection_id, event.request_id), "")
+        mongodb_command_duration.labels(collection, event.command_name, outcome).observe(event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finished(event, "succeeded")
+        db_breaker.record(event.duration_micros / 1000 <= DB_BREAKER_SLOW_MS, command_source())
+        stats = request_stats.get()
+        if stats is not None:
+            stats.add_db(event.duration_micros / 1000, docs_returned(event.command_name, event.reply) or 0,
+                         len(bson.encode(event.reply)) if stats.measures_bytes else None)
+
+    def failed(self, event):
+        self._finished(event, "failed")
+        # A duplicate key or validation error still means the database answered
+        db_breaker.record(not is_database_fault(event.failure), command_source())
+        stats = request_stats.get()
+        if stats is not None:
+            stats.add_db(event.duration_micros / 1000, 0, 0)
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Connection checkout wait times. A checkout starts and ends on the same thread.
+
+    Also keeps this client's own counts and recent waits for the readiness check, which
+    can't read them back from the process-wide Prometheus metrics.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        # (finished_at, wait_seconds) of the latest checkouts that reused an open connection
+        self.recent_waits = collections.deque(maxlen=1000)
+
+    def _checkout_done(self, outcome: str):
+        started = getattr(self._local, 'checkout_started', None)
+        if started is not None:
+            now = time.perf_counter()
+            mongodb_pool_checkout_wait.labels(outcome).observe(now - started)
+            # A checkout that had to open a connection waited for the TLS and auth handshake,
+            # not for the pool; after an idle spell (minPoolSize=0) every first request does
+            if not self._local.created_connection:
+                self.recent_waits.append((now, now - started))
+            self._local.checkout_started = None
+
+    def _count(self, attribute: str, delta: int):
+        with self._lock:
+            setattr(self, attribute, getattr(self, attribute) + delta)
+
+    def checkout_waits(self, window_seconds: float) -> list:
+        since = time.perf_counter() - window_seconds
+        return [wait for finished, wait in list(self.recent_waits) if finished >= since]
+
+    def connection_check_out_started(self, event):
+        self._local.checkout_started = time.perf_counter()
+        self._local.created_connection = False
+
+    def connection_checked_out(self, event):
+        self._checkout_done("succeeded")
+        mongodb_pool_checked_out.inc()
+        self._count("checked_out", 1)
+
+    def connection_check_out_failed(self, event):
+        self._checkout_done("failed")
+        if event.reason != monitoring.ConnectionCheckOutFailedReason.POOL_CLOSED:
+            db_breaker.record(False)
+
+    def connection_checked_in(self, event):
+        mongodb_pool_checked_out.dec()
+        self._count("checked_out", -1)
+
+    def connection_created(self, event):
+        mongodb_pool_connections_created.inc()
+        self._count("open", 1)
+        # Connections are created on the thread whose checkout needs them
+        if getattr(self._local, 'checkout_started', None) is not None:
+            self._local.created_connection = True
+
+    def connection_closed(self, event):
+        self._count("open", -1)
+
+    # Pool lifecycle events carry nothing worth a metric
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+
+# ==================== DEADLINES AND CIRCUIT BREAKER ====================
+
+# Time budget for a request's database work, by endpoint class. pymongo.timeout() sends what
+# is left of it as maxTimeMS with each command, so a runaway query is stopped by the server.
+QUERY_DEADLINE_SECONDS = {
+    "default": float(os.environ.get('QUERY_DEADLINE_SECONDS', '10')),
+    "search": float(os.environ.get('SEARCH_QUERY_DEADLINE_SECONDS', '3')),
+    "expensive": float(os.environ.get('EXPENSIVE_QUERY_DEADLINE_SECONDS', '120')),
+}
+# Regex searches; the expensive class reuses the admission control path list
+SEARCH_PATHS = set(os.environ.get('SEARCH_PATHS', '/api/customers').split(','))
+
+def query_deadline(path: str) -> float:
+    if path in ADMISSION_EXPENSIVE_PATHS:
+        return QUERY_DEADLINE_SECONDS["expensive"]
+    if path in SEARCH_PATHS:
+        return QUERY_DEADLINE_SECONDS["search"]
+    return QUERY_DEADLINE_SECONDS["default"]
+
+DB_BREAKER_WINDOW_SECONDS = float(os.environ.get('DB_BREAKER_WINDOW_SECONDS', '10'))
+DB_BREAKER_MIN_CALLS = int(os.environ.get('DB_BREAKER_MIN_CALLS', '20'))
+# Share of failed or slow commands in the window that opens the breaker
+DB_BREAKER_FAILURE_RATE = float(os.environ.get('DB_BREAKER_FAILURE_RATE', '0.5'))
+DB_BREAKER_SLOW_MS = float(os.environ.get('DB_BREAKER_SLOW_MS', '2000'))
+DB_BREAKER_OPEN_SECONDS = float(os.environ.get('DB_BREAKER_OPEN_SECONDS', '5'))
+# Server error codes that mean the database (not the request) is in trouble. 50 (MaxTimeMSExpired)
+# is left out: it is the request's own deadline, typically a runaway search, not a sick database
+DATABASE_FAULT_CODES = {6, 7, 89, 91, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436}
+# GET routes that can answer from the in-process caches while the breaker is open
+STALE_READ_PATHS = {"/api/employees", "/api/economy/services", "/api/economy/supplier-pricing", "/api/auth/me"}
+
+db_circuit_state = Gauge(
+    "db_circuit_state", "Database circuit breaker: 0 closed, 1 half-open, 2 open; the worst worker's",
+    multiprocess_mode="livemax", registry=metrics_registry
+)
+db_circuit_rejections_total = Counter(
+    "db_circuit_rejections_total", "Requests failed fast with 503 while the breaker was open", registry=metrics_registry
+)
+
+def is_database_fault(failure: dict) -> bool:
+    """Driver-side failures (network, timeouts) have no server error code"""
+    return "code" not in failure or failure["code"] in DATABASE_FAULT_CODES
+
+def command_source() -> Optional[str]:
+    """Organization the current database command runs for; None outside a signed-in request"""
+    stats = request_stats.get()
+    if stats is None or stats.user is None:
+        return None
+    return stats.user.organization_id
+
+class CircuitBreaker:
+    """Opens when too many database commands in the window fail or run slow. After open_seconds
+    it goes half-open and lets traffic through; the next command outcome closes or reopens it.
+    Outcomes arrive from Motor's executor threads, hence the lock.
+
+    Each outcome carries its source (organization, or None for background work). While more than
+    one source is using the database, bad outcomes from a single source don't open the breaker:
+    one tenant's slow searches are that tenant's problem, not a reason to fail everyone fast.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, window_seconds: float = None, min_calls: int = None, failure_rate: float = None,
+                 open_seconds: float = None):
+        self.window_seconds = window_seconds or DB_BREAKER_WINDOW_SECONDS
+        self.min_calls = min_calls or DB_BREAKER_MIN_CALLS
+        self.failure_rate = failure_rate or DB_BREAKER_FAILURE_RATE
+        self.open_seconds = open_seconds or DB_BREAKER_OPEN_SECONDS
+        self._lock = threading.Lock()
+        self._outcomes = collections.deque()
+        self._bad = 0
+        self._sources = collections.Counter()
+        self._bad_sources = collections.Counter()
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.opened = 0
+        self.rejections = 0
+
+    def _set_state(self, state: str):
+        self.state = state
+        db_circuit_state.set(self.STATE_VALUES[state])
+
+    def _open(self, now: float):
+        self._set_state(self.OPEN)
+        self.opened_at = now
+        self.opened += 1
+        self._outcomes.clear()
+        self._bad = 0
+        self._sources.clear()
+        self._bad_sources.clear()
+        logging.getLogger(__name__).warning(f"Database circuit breaker opened for {self.open_seconds:g}s")
+
+    def _cooled_down(self, now: float):
+        if self.state == self.OPEN and now - self.opened_at >= self.open_seconds:
+            self._set_state(self.HALF_OPEN)
+
+    def _forget(self, source: Optional[str], bad: bool):
+        self._sources[source] -= 1
+        if not self._sources[source]:
+            del self._sources[source]
+        if bad:
+            self._bad -= 1
+            self._bad_sources[source] -= 1
+            if not self._bad_sources[source]:
+                del self._bad_sources[source]
+
+    def _tripped(self) -> bool:
+        calls = len(self._outcomes)
+        if calls < self.min_calls or self._bad / calls < self.failure_rate:
+            return False
+        return len(self._bad_sources) > 1 or len(self._sources) == 1
+
+    def record(self, ok: bool, source: Optional[str] = None):
+        now = time.monotonic()
+        with self._lock:
+            self._cooled_down(now)
+            if self.state == self.HALF_OPEN:
+                if ok:
+                    self._set_state(self.CLOSED)
+                else:
+                    self._open(now)
+                return
+            if self.state == self.OPEN:
+                return  # Stragglers admitted before the breaker opened
+            self._outcomes.append((now, source, not ok))
+            self._sources[source] += 1
+            if not ok:
+                self._bad += 1
+                self._bad_sources[source] += 1
+            while self._outcomes and self._outcomes[0][0] < now - self.window_seconds:
+                self._forget(*self._outcomes.popleft()[1:])
+            if self._tripped():
+                self._open(now)
+
+    def rejecting(self) -> bool:
+        with self._lock:
+            self._cooled_down(time.monotonic())
+            return self.state == self.OPEN
+
+    def rejected(self):
+        self.rejections += 1
+        db_circuit_rejections_total.inc()
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.opened_at + self.open_seconds - time.monotonic()))
+
+    def stats(self) -> dict:
+        return {"state": self.state, "opened": self.opened, "rejections": self.rejections}
+
+db_breaker = CircuitBreaker()
+
+def database_unavailable() -> HTTPException:
+    return HTTPException(status_code=503, detail="Database temporarily unavailable, retry shortly",
+                         headers={"Retry-After": str(db_breaker.retry_after())})
+
+async def database_error_handler(request: Request, exc: Exception):
+    """Deadline overruns become 504 and lost connections 503, instead of a bare 500"""
+    if isinstance(exc, ServerSelectionTimeoutError):
+        # Fails before any command is sent, so the listeners never see it. It is a timeout to the
+        # driver, but to the client the database is unreachable, not the query too slow
+        db_breaker.record(False)
+    elif getattr(exc, "timeout", False):
+        return JSONResponse({"detail": "Database query exceeded its deadline"}, status_code=504)
+    return JSONResponse({"detail": "Database temporarily unavailable, retry shortly"}, status_code=503,
+                        headers={"Retry-After": str(db_breaker.retry_after())})
+
+# ==================== SLOW QUERY LOG ====================
+
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', '100'))
+SLOW_QUERY_LOG_MAX_ENTRIES = int(os.environ.get('SLOW_QUERY_LOG_MAX_ENTRIES', '1000'))
+# The same query shape is explained at most this often
+SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS = float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS', '600'))
+
+# command name -> where its filter lives
+SLOW_QUERY_FILTERS = {
+    'find': lambda cmd: cmd.get('filter', {}),
+    'aggregate': lambda cmd: cmd.get('pipeline', []),
+    'count': lambda cmd: cmd.get('query', {}),
+    'distinct': lambda cmd: cmd.get('query', {}),
+    'findAndModify': lambda cmd: cmd.get('query', {}),
+    'update': lambda cmd: cmd['updates'][0].get('q', {}) if cmd.get('updates') else {},
+    'delete': lambda cmd: cmd['deletes'][0].get('q', {}) if cmd.get('deletes') else {},
+    'getMore': lambda cmd: None,
+}
+EXPLAINABLE_COMMANDS = {'find', 'aggregate', 'count', 'distinct'}
+# Values under these keys describe the query's structure, not tenant data
+SHAPE_KEPT_KEYS = {'$options', 'from', 'localField', 'foreignField', 'as'}
+# Session and routing fields the driver adds, which explain must not carry
+DRIVER_COMMAND_FIELDS = {'lsid', 'txnNumber', 'autocommit', 'startTransaction'}
+
+slow_queries_total = Counter(
+    "mongodb_slow_queries", "Commands slower than SLOW_QUERY_THRESHOLD_MS",
+    ["collection", "command"], registry=metrics_registry
+)
+
+def redact_shape(value):
+    """Keep operators and field names, replace values with '?'"""
+    if isinstance(value, dict):
+        return {k: (v if k in SHAPE_KEPT_KEYS else redact_shape(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        if any(isinstance(v, (dict, list)) for v in value):
+            return [redact_shape(v) for v in value]
+        return ["?"] if value else []
+    return "?"
+
+def filter_flags(value) -> List[str]:
+    """Patterns that cannot use an index well, detectable without explain"""
+    flags = set()
+    if isinstance(value, dict):
+        pattern = value.get('$regex')
+        if isinstance(pattern, str) and (not pattern.startswith('^') or 'i' in str(value.get('$options', ''))):
+            flags.add('unanchored_regex')
+        for v in value.values():
+            flags.update(filter_flags(v))
+    elif isinstance(value, list):
+        for v in value:
+            flags.update(filter_flags(v))
+    return sorted(flags)
+
+def docs_returned(command_name: str, reply: dict) -> Optional[int]:
+    cursor = reply.get('cursor')
+    if cursor:
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', [])))
+    if command_name == 'distinct':
+        return len(reply.get('values', []))
+    if command_name == 'findAndModify':
+        return 1 if reply.get('value') else 0
+    return reply.get('n')
+
+def plan_summary(explain: dict) -> dict:
+    """Stages, COLLSCAN flag and execution stats from an explain result (find or aggregate)"""
+    stages, stats = set(), {}
+
+    def walk(node):
+        if isinstance(node, dict):
+            if isinstance(node.get('stage'), str):
+                stages.add(node['stage'])
+            if not stats and isinstance(node.get('executionStats'), dict):
+                stats.update(node['executionStats'])
+            for v in node.values():
+                walk(v)
+        elif isinstance(node, list):
+            for v in node:
+                walk(v)
+
+    walk(explain)
+    return {
+        "stages": sorted(stages),
+        "collscan": "COLLSCAN" in stages,
+        "docs_examined": stats.get('totalDocsExamined'),
+        "keys_examined": stats.get('totalKeysExamined'),
+        "n_returned": stats.get('nReturned'),
+        "execution_ms": stats.get('executionTimeMillis')
+    }
+
+class SlowQueryLog:
+    """Collects slow commands reported by SlowQueryListener and stores them in the capped
+    slow_queries collection, with an explain("executionStats") for new query shapes.
+
+    The listener runs on the driver's threads, so entries are handed to the event loop
+    and recorded by run().
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._queue = None
+        self._explained = {}  # shape key -> monotonic time of the last explain
+        self.dropped = 0
+
+    def attach(self, loop):
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=1000)
+
+    def submit(self, entry: dict):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._enqueue, entry)
+
+    def _enqueue(self, entry: dict):
+        try:
+            self._queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def run(self):
+        while True:
+            entry = await self._queue.get()
+            try:
+                await self.record(entry)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Recording slow query failed: {str(e)}")
+
+    async def record(self, entry: dict):
+        command = entry.pop('explain_command', None)
+        shape_key = json.dumps([entry['collection'], entry['command'], entry['filter']], sort_keys=True, default=str)
+        now = time.monotonic()
+        last = self._explained.get(shape_key)
+        entry['explain'] = None
+        if command and (last is None or now - last >= SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS):
+            self._explained[shape_key] = now
+            try:
+                explain = await db.command({"explain": command, "verbosity": "executionStats"})
+                entry['explain'] = plan_summary(explain)
+                if entry['explain']['collscan']:
+                    entry['flags'] = sorted(set(entry['flags']) | {'collscan'})
+            except Exception as e:
+                logger.warning(f"Explain of slow {entry['command']} on {entry['collection']} failed: {str(e)}")
+        logger.warning(
+            f"Slow {entry['command']} on {entry['collection']}: {entry['duration_ms']} ms, "
+            f"{entry['docs_returned']} docs, filter {json.dumps(entry['filter'], default=str)}"
+            + (f", flags {','.join(entry['flags'])}" if entry['flags'] else "")
+        )
+        await db.slow_queries.insert_one(entry)
+
+slow_query_log = SlowQueryLog()
+
+class SlowQueryListener(monitoring.CommandListener):
+    """Reports commands slower than SLOW_QUERY_THRESHOLD_MS to slow_query_log"""
+
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        if event.command_name in SLOW_QUERY_FILTERS:
+            self._pending[(event.connection_id, event.request_id)] = event.command
+
+    def failed(self, event):
+        self._pending.pop((event.connection_id, event.request_id), None)
+
+    def succeeded(self, event):
+        command = self._pending.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+        if command is None or duration_ms < SLOW_QUERY_THRESHOLD_MS:
+            return
+        collection = command_collection(event.command_name, command)
+        if collection == 'slow_queries':
+            return
+        query = SLOW_QUERY_FILTERS[event.command_name](command)
+        scope = query[0].get('$match', {}) if isinstance(query, list) and query else query
+        organization_id = scope.get('organization_id') if isinstance(scope, dict) else None
+        slow_queries_total.labels(collection, event.command_name).inc()
+        slow_query_log.submit({
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "collection": collection,
+            "command": event.command_name,
+            "organization_id": organization_id if isinstance(organization_id, str) else None,
+            "filter": redact_shape(query),
+            "flags": filter_flags(query),
+            "duration_ms": round(duration_ms, 1),
+            "docs_returned": docs_returned(event.command_name, event.reply),
+            "explain_command": {
+                k: v for k, v in command.items() if k not in DRIVER_COMMAND_FIELDS and not k.startswith('$')
+            } if event.command_name in EXPLAINABLE_COMMANDS else None
+        })
+
+# ==================== SETTINGS ====================
+
+def env_int(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+class Settings(BaseModel):
+    """Per-process deployment settings. Every gunicorn/uvicorn worker builds its own app and
+    Motor client from these, so pools are sized per worker (total = workers x max_pool_size)."""
+    mongo_url: str
+    db_name: str
+    max_pool_size: int = 100
+    min_pool_size: int = 0
+    connect_timeout_ms: int = 5000
+    server_selection_timeout_ms: int = 5000
+    socket_timeout_ms: Optional[int] = None
+    wait_queue_timeout_ms: Optional[int] = None
+    cors_origins: List[str] = ["*"]
+    # Organizations whose reference data and licenses are loaded before the worker reports ready
+    warm_cache_organizations: int = 50
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        return cls(
+            mongo_url=os.environ['MONGO_URL'],
+            db_name=os.environ['DB_NAME'],
+            max_pool_size=env_int('MONGO_MAX_POOL_SIZE', 100),
+            min_pool_size=env_int('MONGO_MIN_POOL_SIZE', 0),
+            connect_timeout_ms=env_int('MONGO_CONNECT_TIMEOUT_MS', 5000),
+            server_selection_timeout_ms=env_int('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000),
+            socket_timeout_ms=env_int('MONGO_SOCKET_TIMEOUT_MS', None),
+            wait_queue_timeout_ms=env_int('MONGO_WAIT_QUEUE_TIMEOUT_MS', None),
+            cors_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+            warm_cache_organizations=env_int('WARM_CACHE_ORGANIZATIONS', 50),
+        )
+
+# MongoDB connection, created by configure_database() (called from create_app)
+client = None
+db = None
+pool_listener = None
+# Largest number of queries a single handler may have in flight at once; keeps one
+# fan-out from claiming the whole connection pool under load
+GATHER_MAX_CONCURRENCY = 10
+
+def configure_database(settings: Settings):
+    global client, db, pool_listener, GATHER_MAX_CONCURRENCY
+    pool_listener = PoolMetricsListener()
+    client = AsyncIOMotorClient(
+        settings.mongo_url,
+        maxPoolSize=settings.max_pool_size,
+        minPoolSize=settings.min_pool_size,
+        connectTimeoutMS=settings.connect_timeout_ms,
+        serverSelectionTimeoutMS=settings.server_selection_timeout_ms,
+        socketTimeoutMS=settings.socket_timeout_ms,
+        waitQueueTimeoutMS=settings.wait_queue_timeout_ms,
+        event_listeners=[CommandMetricsListener(), pool_listener, SlowQueryListener()]
+    )
+    db = client[settings.db_name]
+    GATHER_MAX_CONCURRENCY = env_int('GATHER_MAX_CONCURRENCY', max(1, settings.max_pool_size // 10))
+
+async def gather_bounded(*awaitables, limit: int = None):
+    """asyncio.gather that runs at most `limit` (default GATHER_MAX_CONCURRENCY) awaitables at a time"""
+    semaphore = asyncio.Semaphore(limit or GATHER_MAX_CONCURRENCY)
+
+    async def run(awaitable):
+        async with semaphore:
+            return await awaitable
+
+    return await asyncio.gather(*(run(awaitable) for awaitable in awaitables))
 
 # Security setup
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
@@ -32,9 +758,9 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
-# Create the main app
-app = FastAPI()
-api_router = APIRouter(prefix="/api")
+# Routes are collected on routers and mounted by create_app()
+root_router = APIRouter()
+api_router = APIRouter(prefix="/api", route_class=TimedRoute)
 
 # ==================== MODELS ====================
 
@@ -213,6 +939,23 @@ class WorkOrderCreate(BaseModel):
     kjoretid: float = 0.0
     kjorte_km: float = 0.0
 
+class CustomerSummary(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    anleggsnr: str
+    kundnavn: str
+    typenr: Optional[str] = None
+
+class EmployeeSummary(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    initialer: str
+    navn: str
+
+class WorkOrderExpanded(WorkOrder):
+    customer: Optional[CustomerSummary] = None  # Only with ?expand=customer
+    employee: Optional[EmployeeSummary] = None  # Only with ?expand=employee
+
 # Internal Order Models
 class InternalOrder(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -414,6 +1157,17 @@ class SupplierPricingCreate(BaseModel):
     kjoretid_rate: float = 0.0
     km_rate: float = 0.0
 
+# Sync Models
+class SyncOperation(BaseModel):
+    idempotency_key: str
+    collection: str  # workorders, internalorders, hms_incidents
+    op: str = "create"  # create, update, delete
+    id: Optional[str] = None  # Client-generated id for creates, target id for update/delete
+    data: dict = {}
+
+class SyncPushRequest(BaseModel):
+    operations: List[SyncOperation]
+
 # ==================== AUTHENTICATION ====================
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -429,29 +1183,659 @@ def create_access_token(data: dict) -> str:
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Users seen recently, so cached reads keep working while the database is unreachable
+LAST_KNOWN_USERS_MAX = int(os.environ.get('LAST_KNOWN_USERS_MAX', '10000'))
+last_known_users = {}
+
+def remember_user(user: User):
+    last_known_users.pop(user.id, None)
+    last_known_users[user.id] = user
+    if len(last_known_users) > LAST_KNOWN_USERS_MAX:
+        last_known_users.pop(next(iter(last_known_users)))
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.JWTError:
-        raise HTTPException(status_code=401, detail="Could not validate credentials")
-    
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
-    if user is None:
-        raise HTTPException(status_code=401, detail="User not found")
-    
-    return User(**user)
+    with timed("auth"):
+        try:
+            token = credentials.credentials
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            user_id: str = payload.get("sub")
+            if user_id is None:
+                raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+        except jwt.ExpiredSignatureError:
+            raise HTTPException(status_code=401, detail="Token has expired")
+        except jwt.JWTError:
+            raise HTTPException(status_code=401, detail="Could not validate credentials")
+        
+        if db_breaker.rejecting():
+            user = last_known_users.get(user_id)
+            if user is None:
+                db_breaker.rejected()
+                raise database_unavailable()
+        else:
+            try:
+                user = await db.users.find_one({"id": user_id}, {"_id": 0})
+            except (ConnectionFailure, ExecutionTimeout):
+                if user_id not in last_known_users:
+                    raise
+                user = last_known_users[user_id]
+            else:
+                if user is None:
+                    raise HTTPException(status_code=401, detail="User not found")
+                user = User(**user)
+                remember_user(user)
+        stats = request_stats.get()
+        if stats is not None:
+            stats.user = user
+        return user
 
 def check_organization_access(item_org_id: str, user_org_id: str):
     """Verify user has access to item in their organization"""
     if item_org_id != user_org_id:
         raise HTTPException(status_code=403, detail="Access denied: Not authorized to access this organization's data")
 
+def date_range_filter(date_from: Optional[datetime], date_to: Optional[datetime]) -> Optional[dict]:
+    """Mongo filter for a [date_from, date_to) window on an ISO-string date field"""
+    if not date_from and not date_to:
+        return None
+    window = {}
+    for op, value in (("$gte", date_from), ("$lt", date_to)):
+        if value:
+            # Stored dates are UTC isoformat strings, which sort chronologically
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=timezone.utc)
+            window[op] = value.astimezone(timezone.utc).isoformat()
+    return window
+
+def utc_isoformat(value) -> str:
+    """How date fields filtered by date_range_filter are stored; another offset would sort wrong"""
+    return as_utc(value).isoformat()
+
+# ==================== CHANGE LOG ====================
+
+# Collections that offline clients mirror through /api/sync
+SYNC_COLLECTIONS = [
+    'customers', 'employees', 'workorders', 'internalorders', 'products', 'routes',
+    'hms_risk_assessments', 'hms_incidents', 'hms_training', 'hms_equipment',
+    'payouts', 'services', 'supplier_pricing'
+]
+CHANGE_LOG_RETENTION_DAYS = int(os.environ.get('CHANGE_LOG_RETENTION_DAYS', '30'))
+
+async def next_change_seq(organization_id: str, count: int = 1) -> int:
+    """Reserve `count` sequence numbers for an organization and return the last one"""
+    counter = await db.sync_counters.find_one_and_update(
+        {"organization_id": organization_id},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter['seq']
+
+async def record_changes(organization_id: str, collection: str, doc_ids: List[str], op: str = "upsert"):
+    """Append entries to the change log. op is upsert, delete or reset (whole collection replaced)"""
+    if not doc_ids:
+        return
+    # Every write path goes through here, so this is also where cached data goes stale
+    await invalidation_bus.publish(organization_id, collection)
+    last_seq = await next_change_seq(organization_id, len(doc_ids))
+    first_seq = last_seq - len(doc_ids) + 1
+    now = datetime.now(timezone.utc).isoformat()
+    await db.changes.insert_many([
+        {
+            "organization_id": organization_id,
+            "seq": first_seq + i,
+            "collection": collection,
+            "doc_id": doc_id,
+            "op": op,
+            "ts": now
+        }
+        for i, doc_id in enumerate(doc_ids)
+    ])
+
+async def record_change(organization_id: str, collection: str, doc_id: str, op: str = "upsert"):
+    await record_changes(organization_id, collection, [doc_id], op)
+
+async def record_reset(organization_id: str, collection: str):
+    """Log that a collection was replaced wholesale (imports), so clients refetch it once"""
+    await record_changes(organization_id, collection, ["*"], "reset")
+
+async def compact_change_log(organization_id: Optional[str] = None) -> int:
+    """Drop change log entries older than the retention window and raise each org's floor_seq.
+
+    Clients asking for changes below the floor are told to do a full resync.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=CHANGE_LOG_RETENTION_DAYS)).isoformat()
+    query = {"ts": {"$lt": cutoff}}
+    if organization_id:
+        query["organization_id"] = organization_id
+
+    floors = await db.changes.aggregate([
+        {"$match": query},
+        {"$group": {"_id": "$organization_id", "floor_seq": {"$max": "$seq"}}}
+    ]).to_list(None)
+    if not floors:
+        return 0
+
+    for floor in floors:
+        await db.sync_counters.update_one(
+            {"organization_id": floor['_id']},
+            {"$max": {"floor_seq": floor['floor_seq']}}
+        )
+    result = await db.changes.delete_many(query)
+    return result.deleted_count
+
+# ==================== REFERENCE DATA CACHE ====================
+
+def estimate_size(obj) -> int:
+    """Rough deep size in bytes of a document tree"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(estimate_size(v) for v in obj)
+    return size
+
+def prepare_employee(doc: dict) -> dict:
+    if isinstance(doc['created_at'], str):
+        doc['created_at'] = datetime.fromisoformat(doc['created_at'])
+    return doc
+
+def prepare_service(doc: dict) -> dict:
+    if isinstance(doc.get('created_at'), str):
+        doc['created_at'] = datetime.fromisoformat(doc['created_at'])
+    return doc
+
+def prepare_supplier_pricing(doc: dict) -> dict:
+    if isinstance(doc['created_at'], str):
+        doc['created_at'] = datetime.fromisoformat(doc['created_at'])
+    if isinstance(doc['updated_at'], str):
+        doc['updated_at'] = datetime.fromisoformat(doc['updated_at'])
+    # Handle legacy data without name field
+    if 'name' not in doc:
+        doc['name'] = 'Standard'
+    return doc
+
+# collection -> (document preparer, extra lookup keys besides id)
+REFERENCE_COLLECTIONS = {
+    'employees': (prepare_employee, ['initialer']),
+    'services': (prepare_service, ['tjenestenr']),
+    'supplier_pricing': (prepare_supplier_pricing, ['name']),
+}
+
+class ReferenceSnapshot:
+    def __init__(self, version: int, docs: List[dict], keys: List[str]):
+        self.version = version
+        self.docs = docs
+        self.by_id = {doc['id']: doc for doc in docs}
+        self.by_key = {key: {} for key in keys}
+        for doc in docs:
+            for key in keys:
+                if doc.get(key):
+                    # First match wins, like find_one
+                    self.by_key[key].setdefault(doc[key], doc)
+        self.size_bytes = estimate_size(docs)
+
+    def get(self, key: str, value) -> Optional[dict]:
+        if key == 'id':
+            return self.by_id.get(value)
+        return self.by_key[key].get(value)
+
+class ReferenceDataCache:
+    """In-process per-organization snapshots of employees, services and supplier pricing.
+
+    Writes bump the (organization, collection) version; the next read reloads the snapshot.
+    Snapshot documents are shared between requests and must not be mutated.
+    """
+
+    def __init__(self):
+        self._snapshots = {}
+        # Last loaded snapshot per key, kept through invalidation to answer reads while the database is down
+        self._last = {}
+        self._versions = {}
+        self._locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    def _stale(self, key) -> Optional[ReferenceSnapshot]:
+        snapshot = self._last.get(key)
+        if snapshot is not None:
+            self.stale_hits += 1
+        return snapshot
+
+    def bump(self, organization_id: Optional[str], collection: str):
+        """Invalidate one organization's snapshot, or every organization's when organization_id is None"""
+        if collection not in REFERENCE_COLLECTIONS:
+            return
+        if organization_id is None:
+            keys = [key for key in set(self._versions) | set(self._snapshots) if key[1] == collection]
+        else:
+            keys = [(organization_id, collection)]
+        for key in keys:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._snapshots.pop(key, None)
+
+    def clear(self):
+        for key in list(self._versions):
+            self._versions[key] += 1
+        self._snapshots.clear()
+        self._last.clear()
+
+    async def get(self, organization_id: str, collection: str) -> ReferenceSnapshot:
+        key = (organization_id, collection)
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None:
+            self.hits += 1
+            return snapshot
+
+        if db_breaker.rejecting():
+            snapshot = self._stale(key)
+            if snapshot is None:
+                db_breaker.rejected()
+                raise database_unavailable()
+            return snapshot
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None:
+                self.hits += 1
+                return snapshot
+            self.misses += 1
+            version = self._versions.get(key, 0)
+            prepare, keys = REFERENCE_COLLECTIONS[collection]
+            try:
+                docs = await db[collection].find({"organization_id": organization_id}, {"_id": 0}).to_list(None)
+            except (ConnectionFailure, ExecutionTimeout):
+                snapshot = self._stale(key)
+                if snapshot is None:
+                    raise
+                return snapshot
+            snapshot = ReferenceSnapshot(version, [prepare(doc) for doc in docs], keys)
+            self._last[key] = snapshot
+            # A write during the load makes this snapshot stale already; serve it but don't keep it
+            if self._versions.get(key, 0) == version:
+                self._snapshots[key] = snapshot
+            return snapshot
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._snapshots),
+            "documents": sum(len(s.docs) for s in self._snapshots.values()),
+            "size_bytes": sum(s.size_bytes for s in self._snapshots.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None
+        }
+
+reference_cache = ReferenceDataCache()
+
+# ==================== CACHE INVALIDATION ====================
+
+CACHE_INVALIDATION_POLL_SECONDS = float(os.environ.get('CACHE_INVALIDATION_POLL_SECONDS', '1.0'))
+CACHE_INVALIDATION_MODE = os.environ.get('CACHE_INVALIDATION_MODE', 'auto')  # auto, polling
+
+class InvalidationBus:
+    """Keeps in-process caches consistent across uvicorn workers.
+
+    Caches subscribe per collection. Writes on this worker evict locally right away.
+    Other workers learn about them from a change stream on the subscribed collections
+    or, when change streams are unavailable (standalone mongod), by polling the
+    cache_versions collection every CACHE_INVALIDATION_POLL_SECONDS.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._known_versions = {}
+        self.mode = None  # change_stream or polling once running
+        self.received = 0
+
+    def subscribe(self, collection: str, handler, local: bool = True):
+        """handler(organization_id, collection); organization_id None means all organizations.
+
+        local=False handlers apply this worker's writes themselves and are only told about
+        writes from other workers.
+        """
+        self._handlers.setdefault(collection, []).append((handler, local))
+
+    def dispatch(self, organization_id: Optional[str], collection: str, local: bool = False):
+        for handler, wants_local in self._handlers.get(collection, []):
+            if local and not wants_local:
+                continue
+            handler(organization_id, collection)
+
+    def dispatch_all(self):
+        for collection in self._handlers:
+            self.dispatch(None, collection)
+
+    async def publish(self, organization_id: str, collection: str):
+        if collection not in self._handlers:
+            return
+        self.dispatch(organization_id, collection, local=True)
+        # Change stream subscribers see the write itself; pollers need a version bump
+        if self.mode != "change_stream":
+            version = await db.cache_versions.find_one_and_update(
+                {"organization_id": organization_id, "collection": collection},
+                {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            self._known_versions[(organization_id, collection)] = version['version']
+
+    async def run(self):
+        if CACHE_INVALIDATION_MODE == "polling":
+            self.mode = "polling"
+        while True:
+            try:
+                if self.mode == "polling":
+                    await self._poll()
+                else:
+                    await self._watch()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if self.mode is None:
+                    # Rejected before the stream ever opened, e.g. standalone mongod
+                    logger.info(f"Change streams unavailable ({e.code}), polling cache_versions instead")
+                    self.mode = "polling"
+                    continue
+                logger.error(f"Cache invalidation {self.mode} failed: {str(e)}")
+                await asyncio.sleep(CACHE_INVALIDATION_POLL_SECONDS)
+            except Exception as e:
+                logger.error(f"Cache invalidation {self.mode} failed: {str(e)}")
+                await asyncio.sleep(CACHE_INVALIDATION_POLL_SECONDS)
+            # Events may have been missed while reconnecting
+            self.dispatch_all()
+
+    async def _watch(self):
+        pipeline = [
+            {"$match": {"ns.coll": {"$in": list(self._handlers)}}},
+            {"$project": {"operationType": 1, "ns": 1, "fullDocument.organization_id": 1}}
+        ]
+        async with db.watch(pipeline, full_document="updateLookup") as stream:
+            self.mode = "change_stream"
+            async for change in stream:
+                self.received += 1
+                collection = change['ns']['coll']
+                # Deletes carry no document, so every organization's entry for the collection goes
+                organization_id = (change.get('fullDocument') or {}).get('organization_id')
+                self.dispatch(organization_id, collection)
+
+    async def _poll(self):
+        self.mode = "polling"
+        since = datetime.now(timezone.utc)
+        while True:
+            # Overlap polls a little so writes from workers with slightly skewed clocks are not missed
+            cutoff = (since - timedelta(seconds=max(5, CACHE_INVALIDATION_POLL_SECONDS * 2))).isoformat()
+            since = datetime.now(timezone.utc)
+            versions = await db.cache_versions.find({"updated_at": {"$gte": cutoff}}, {"_id": 0}).to_list(None)
+            for entry in versions:
+                key = (entry['organization_id'], entry['collection'])
+                if self._known_versions.get(key) != entry['version']:
+                    self._known_versions[key] = entry['version']
+                    self.received += 1
+                    self.dispatch(*key)
+            await asyncio.sleep(CACHE_INVALIDATION_POLL_SECONDS)
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "collections": sorted(self._handlers), "received": self.received}
+
+invalidation_bus = InvalidationBus()
+for collection in REFERENCE_COLLECTIONS:
+    invalidation_bus.subscribe(collection, reference_cache.bump)
+
+# ==================== SCHEDULE INDEX ====================
+
+SCHEDULE_COLLECTIONS = ("workorders", "internalorders")
+WORKDAY_HOURS = float(os.environ.get('WORKDAY_HOURS', '7.5'))
+AVAILABILITY_MAX_DAYS = 62
+
+def as_utc(value) -> datetime:
+    """Stored dates are ISO strings (or datetimes on older documents); naive means UTC"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def booking_interval(doc: dict) -> Optional[tuple]:
+    """(start, end) an order books its employee for: date plus arbeidstid and kjoretid hours"""
+    hours = (doc.get('arbeidstid') or 0) + (doc.get('kjoretid') or 0)
+    if hours <= 0:
+        return None
+    start = as_utc(doc['date'])
+    return start, start + timedelta(hours=hours)
+
+def interval_days(start: datetime, end: datetime) -> List[str]:
+    """UTC days an interval touches; bookings past midnight are indexed under both days"""
+    day, last = start.date(), (end - timedelta(microseconds=1)).date()
+    days = []
+    while day <= last:
+        days.append(day.isoformat())
+        day += timedelta(days=1)
+    return days
+
+class DaySchedule:
+    """One employee's bookings on one day, sorted by start.
+
+    max_end[i] is the latest end among the first i+1 bookings. Finding what overlaps
+    [start, end) is a bisect for the last booking starting before end, then a walk back that
+    stops as soon as max_end drops to start or below.
+    """
+
+    __slots__ = ("starts", "ends", "max_end", "refs")
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.max_end = []
+        self.refs = []
+
+    def add(self, start: datetime, end: datetime, ref: tuple):
+        i = bisect.bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.refs.insert(i, ref)
+        self._update_max_end(i)
+
+    def remove(self, ref: tuple):
+        i = self.refs.index(ref)
+        del self.starts[i], self.ends[i], self.refs[i]
+        self._update_max_end(i)
+
+    def _update_max_end(self, i: int):
+        del self.max_end[i:]
+        running = self.max_end[-1] if self.max_end else None
+        for end in self.ends[i:]:
+            running = end if running is None or end > running else running
+            self.max_end.append(running)
+
+    def overlapping(self, start: datetime, end: datetime, exclude: Optional[tuple] = None) -> list:
+        j = bisect.bisect_left(self.starts, end) - 1
+        found = []
+        while j >= 0 and self.max_end[j] > start:
+            if self.ends[j] > start and self.refs[j] != exclude:
+                found.append((self.starts[j], self.ends[j], self.refs[j]))
+            j -= 1
+        return found[::-1]
+
+    def bookings(self) -> list:
+        return list(zip(self.starts, self.ends, self.refs))
+
+def booking_dict(start: datetime, end: datetime, ref: tuple) -> dict:
+    return {"collection": ref[0], "id": ref[1], "start": start.isoformat(), "end": end.isoformat()}
+
+class ScheduleIndex:
+    """In-process per-employee, per-day interval index over work orders and internal orders.
+
+    An employee's bookings are loaded on first use and then kept current by update() from this
+    worker's write handlers. Writes on other workers arrive through the invalidation bus and drop
+    the organization's entries, so the next check reloads them. (With change streams a worker
+    also hears its own writes come back, which costs a reload but never a stale answer.)
+    """
+
+    def __init__(self):
+        self._days = {}      # (organization_id, employee_id) -> {day: DaySchedule}
+        self._bookings = {}  # (organization_id, employee_id) -> {ref: (start, end)}
+        self._versions = {}
+        self._locks = {}
+        self.loads = 0
+
+    def drop(self, organization_id: Optional[str], collection: Optional[str] = None):
+        """Forget one organization's bookings, or everyone's when organization_id is None"""
+        keys = set(self._versions) | set(self._days)
+        if organization_id is not None:
+            keys = {key for key in keys if key[0] == organization_id}
+        for key in keys:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._days.pop(key, None)
+            self._bookings.pop(key, None)
+
+    def clear(self):
+        self.drop(None)
+
+    @staticmethod
+    def _insert(days: dict, bookings: dict, ref: tuple, interval: tuple):
+        ScheduleIndex._discard(days, bookings, ref)
+        bookings[ref] = interval
+        for day in interval_days(*interval):
+            days.setdefault(day, DaySchedule()).add(*interval, ref)
+
+    @staticmethod
+    def _discard(days: dict, bookings: dict, ref: tuple):
+        interval = bookings.pop(ref, None)
+        if interval is None:
+            return
+        for day in interval_days(*interval):
+            days[day].remove(ref)
+            if not days[day].starts:
+                del days[day]
+
+    def update(self, organization_id: str, collection: str, old: Optional[dict] = None, new: Optional[dict] = None):
+        """Apply one local write: old is the document before it (None for creates), new the one after (None for deletes)"""
+        for doc, present in ((old, False), (new, True)):
+            if not doc:
+                continue
+            key = (organization_id, doc['employee_id'])
+            if key not in self._days:
+                # Not loaded on this worker; just make sure a load racing this write is not kept
+                self._versions[key] = self._versions.get(key, 0) + 1
+                continue
+            ref = (collection, doc['id'])
+            interval = booking_interval(doc) if present else None
+            if interval:
+                self._insert(self._days[key], self._bookings[key], ref, interval)
+            else:
+                self._discard(self._days[key], self._bookings[key], ref)
+
+    async def _employee(self, organization_id: str, employee_id: str) -> dict:
+        key = (organization_id, employee_id)
+        days = self._days.get(key)
+        if days is not None:
+            return days
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            days = self._days.get(key)
+            if days is not None:
+                return days
+            self.loads += 1
+            version = self._versions.get(key, 0)
+            query = {"organization_id": organization_id, "employee_id": employee_id}
+            projection = {"_id": 0, "id": 1, "date": 1, "arbeidstid": 1, "kjoretid": 1}
+            loaded = await gather_bounded(*(
+                db[collection].find(query, projection).to_list(None) for collection in SCHEDULE_COLLECTIONS
+            ))
+            days, bookings = {}, {}
+            for collection, docs in zip(SCHEDULE_COLLECTIONS, loaded):
+                for doc in docs:
+                    interval = booking_interval(doc)
+                    if interval:
+                        self._insert(days, bookings, (collection, doc['id']), interval)
+            # A write during the load makes this stale already; use it once but don't keep it
+            if self._versions.get(key, 0) == version:
+                self._days[key] = days
+                self._bookings[key] = bookings
+            return days
+
+    async def conflicts(self, organization_id: str, employee_id: str, start: datetime, end: datetime,
+                        exclude: Optional[tuple] = None) -> List[dict]:
+        """Bookings that overlap [start, end), excluding the order being rescheduled"""
+        days = await self._employee(organization_id, employee_id)
+        found = {}
+        for day in interval_days(start, end):
+            if day in days:
+                for booking in days[day].overlapping(start, end, exclude):
+                    found[booking[2]] = booking
+        return [booking_dict(*booking) for booking in sorted(found.values())]
+
+    async def day_bookings(self, organization_id: str, employee_id: str, day: str) -> list:
+        days = await self._employee(organization_id, employee_id)
+        return days[day].bookings() if day in days else []
+
+    def stats(self) -> dict:
+        return {
+            "employees": len(self._days),
+            "bookings": sum(len(b) for b in self._bookings.values()),
+            "loads": self.loads
+        }
+
+schedule_index = ScheduleIndex()
+for collection in SCHEDULE_COLLECTIONS:
+    invalidation_bus.subscribe(collection, schedule_index.drop, local=False)
+
+async def check_booking_conflicts(organization_id: str, doc: dict, collection: str = "workorders", exclude_self: bool = False):
+    """409 when the order's time overlaps something its employee is already booked for"""
+    interval = booking_interval(doc)
+    if not interval:
+        return
+    exclude = (collection, doc['id']) if exclude_self else None
+    conflicts = await schedule_index.conflicts(organization_id, doc['employee_id'], *interval, exclude=exclude)
+    if conflicts:
+        raise HTTPException(status_code=409, detail={"message": "Employee is already booked", "conflicts": conflicts})
+
+class BookingLocks:
+    """Per (organization, employee, day) locks held from the conflict check until the booking
+    is in the database and the schedule index, so two concurrent bookings can't both pass the
+    check. These are asyncio locks: they only serialize requests within one worker process."""
+
+    def __init__(self):
+        self._locks = {}  # key -> [lock, holders and waiters]
+
+    def _leave(self, key: tuple, locked: bool):
+        entry = self._locks[key]
+        if locked:
+            entry[0].release()
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._locks[key]
+
+    @asynccontextmanager
+    async def hold(self, organization_id: str, docs: List[dict]):
+        # Always taken in sorted order, so batches sharing employees can't deadlock
+        keys = sorted({
+            (organization_id, doc['employee_id'], day)
+            for doc in docs if (interval := booking_interval(doc)) for day in interval_days(*interval)
+        })
+        held = []
+        try:
+            for key in keys:
+                entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+                entry[1] += 1
+                try:
+                    await entry[0].acquire()
+                except BaseException:
+                    self._leave(key, locked=False)
+                    raise
+                held.append(key)
+            yield
+        finally:
+            for key in reversed(held):
+                self._leave(key, locked=True)
+
+booking_locks = BookingLocks()
+
 # ==================== AUTH ENDPOINTS ====================
 
 @api_router.post("/auth/register", response_model=Token)
@@ -499,13 +1883,21 @@ async def register(user_input: UserCreate):
     await db.users.insert_one(user_doc)
     
     # Generate token
-    access_token = create_access_token(data={"sub": user.id})
+    access_token = create_access_token(data={"sub": user.id, "org": user.organization_id})
     return Token(access_token=access_token, token_type="bearer", user=user, organization=organization)
 
 @api_router.post("/auth/login", response_model=Token)
 async def login(credentials: UserLogin):
     user_doc = await db.users.find_one({"email": credentials.email})
-    if not user_doc or not verify_password(credentials.password, user_doc['password_hash']):
+    if not user_doc:
+        raise HTTPException(status_code=401, detail="Incorrect email or password")
+    
+    # bcrypt runs in a thread while the organization is fetched
+    password_ok, org_doc = await asyncio.gather(
+        asyncio.to_thread(verify_password, credentials.password, user_doc['password_hash']),
+        db.organizations.find_one({"id": user_doc['organization_id']}, {"_id": 0})
+    )
+    if not password_ok:
         raise HTTPException(status_code=401, detail="Incorrect email or password")
     
     # Convert datetime
@@ -515,7 +1907,6 @@ async def login(credentials: UserLogin):
     user = User(**user_doc)
     
     # Get organization
-    org_doc = await db.organizations.find_one({"id": user.organization_id}, {"_id": 0})
     if not org_doc:
         raise HTTPException(status_code=404, detail="Organization not found")
     
@@ -525,7 +1916,7 @@ async def login(credentials: UserLogin):
         org_doc['trial_ends_at'] = datetime.fromisoformat(org_doc['trial_ends_at'])
     
     organization = Organization(**org_doc)
-    access_token = create_access_token(data={"sub": user.id})
+    access_token = create_access_token(data={"sub": user.id, "org": user.organization_id})
     
     return Token(access_token=access_token, token_type="bearer", user=user, organization=organization)
 
@@ -546,6 +1937,86 @@ def generate_license_key() -> str:
     formatted = '-'.join([key_hash[i:i+4] for i in range(0, 24, 4)])
     return formatted
 
+def license_from_doc(license_doc: dict) -> License:
+    # Convert datetime fields
+    if isinstance(license_doc['created_at'], str):
+        license_doc['created_at'] = datetime.fromisoformat(license_doc['created_at'])
+    if license_doc.get('activated_at') and isinstance(license_doc['activated_at'], str):
+        license_doc['activated_at'] = datetime.fromisoformat(license_doc['activated_at'])
+    if license_doc.get('expires_at') and isinstance(license_doc['expires_at'], str):
+        license_doc['expires_at'] = datetime.fromisoformat(license_doc['expires_at'])
+    return License(**license_doc)
+
+LICENSE_CACHE_TTL_SECONDS = int(os.environ.get('LICENSE_CACHE_TTL_SECONDS', '300'))
+LICENSE_SWEEP_INTERVAL_SECONDS = int(os.environ.get('LICENSE_SWEEP_INTERVAL_SECONDS', '300'))
+
+class LicenseCache:
+    """Active license per organization, kept until min(expires_at, now + LICENSE_CACHE_TTL_SECONDS).
+
+    Organizations without an active license are cached too, for the plain TTL.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, organization_id: Optional[str], collection: str = "licenses"):
+        if organization_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(organization_id, None)
+
+    async def get_active(self, organization_id: str) -> Optional[License]:
+        now = datetime.now(timezone.utc)
+        entry = self._entries.get(organization_id)
+        if entry and entry[1] > now:
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        license_doc = await db.licenses.find_one(
+            {"organization_id": organization_id, "status": "active"},
+            {"_id": 0}
+        )
+        license_obj = license_from_doc(license_doc) if license_doc else None
+        valid_until = now + timedelta(seconds=LICENSE_CACHE_TTL_SECONDS)
+        if license_obj and license_obj.expires_at and license_obj.expires_at > now:
+            valid_until = min(valid_until, license_obj.expires_at)
+        self._entries[organization_id] = (license_obj, valid_until)
+        return license_obj
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None
+        }
+
+license_cache = LicenseCache()
+invalidation_bus.subscribe("licenses", license_cache.invalidate)
+
+async def expire_overdue_licenses() -> int:
+    """Flip every active license past its expires_at to expired, across all organizations"""
+    now = datetime.now(timezone.utc).isoformat()
+    result = await db.licenses.update_many(
+        {"status": "active", "expires_at": {"$ne": None, "$lt": now}},
+        {"$set": {"status": "expired"}}
+    )
+    return result.modified_count
+
+async def license_expiry_sweeper():
+    while True:
+        try:
+            expired = await expire_overdue_licenses()
+            if expired:
+                logger.info(f"Expired {expired} overdue licenses")
+        except Exception as e:
+            logger.error(f"License expiry sweep failed: {str(e)}")
+        await asyncio.sleep(LICENSE_SWEEP_INTERVAL_SECONDS)
+
 @api_router.post("/licenses/generate")
 async def generate_license(license_data: LicenseCreate, current_user: User = Depends(get_current_user)):
     """Generate a new license key (admin only)"""
@@ -586,6 +2057,7 @@ async def generate_license(license_data: LicenseCreate, current_user: User = Dep
         doc['expires_at'] = doc['expires_at'].isoformat()
     
     await db.licenses.insert_one(doc)
+    await invalidation_bus.publish(license.organization_id, "licenses")
     return license
 
 @api_router.post("/licenses/validate")
@@ -596,22 +2068,10 @@ async def validate_license(validation: LicenseValidation):
     if not license_doc:
         raise HTTPException(status_code=404, detail="License key not found")
     
-    # Convert datetime fields
-    if isinstance(license_doc['created_at'], str):
-        license_doc['created_at'] = datetime.fromisoformat(license_doc['created_at'])
-    if license_doc.get('activated_at') and isinstance(license_doc['activated_at'], str):
-        license_doc['activated_at'] = datetime.fromisoformat(license_doc['activated_at'])
-    if license_doc.get('expires_at') and isinstance(license_doc['expires_at'], str):
-        license_doc['expires_at'] = datetime.fromisoformat(license_doc['expires_at'])
-    
-    license_obj = License(**license_doc)
+    license_obj = license_from_doc(license_doc)
     
-    # Check if license is expired
+    # Check if license is expired (the status flip is left to license_expiry_sweeper)
     if license_obj.expires_at and license_obj.expires_at < datetime.now(timezone.utc):
-        await db.licenses.update_one(
-            {"license_key": validation.license_key},
-            {"$set": {"status": "expired"}}
-        )
         raise HTTPException(status_code=403, detail="License has expired")
     
     # Check status
@@ -630,6 +2090,7 @@ async def validate_license(validation: LicenseValidation):
             {"$set": {"activated_at": activated_at.isoformat()}}
         )
         license_obj.activated_at = activated_at
+        await invalidation_bus.publish(license_obj.organization_id, "licenses")
     
     return {
         "valid": True,
@@ -640,30 +2101,13 @@ async def validate_license(validation: LicenseValidation):
 @api_router.get("/licenses/check")
 async def check_license(current_user: User = Depends(get_current_user)):
     """Check current organization's license status"""
-    license_doc = await db.licenses.find_one(
-        {"organization_id": current_user.organization_id, "status": "active"},
-        {"_id": 0}
-    )
+    license_obj = await license_cache.get_active(current_user.organization_id)
     
-    if not license_doc:
+    if not license_obj:
         return {"valid": False, "message": "No active license found"}
     
-    # Convert datetime fields
-    if isinstance(license_doc['created_at'], str):
-        license_doc['created_at'] = datetime.fromisoformat(license_doc['created_at'])
-    if license_doc.get('activated_at') and isinstance(license_doc['activated_at'], str):
-        license_doc['activated_at'] = datetime.fromisoformat(license_doc['activated_at'])
-    if license_doc.get('expires_at') and isinstance(license_doc['expires_at'], str):
-        license_doc['expires_at'] = datetime.fromisoformat(license_doc['expires_at'])
-    
-    license_obj = License(**license_doc)
-    
-    # Check expiration
+    # Check expiration (the status flip is left to license_expiry_sweeper)
     if license_obj.expires_at and license_obj.expires_at < datetime.now(timezone.utc):
-        await db.licenses.update_one(
-            {"license_key": license_obj.license_key},
-            {"$set": {"status": "expired"}}
-        )
         return {"valid": False, "message": "License has expired"}
     
     return {
@@ -672,14 +2116,121 @@ async def check_license(current_user: User = Depends(get_current_user)):
         "days_remaining": (license_obj.expires_at - datetime.now(timezone.utc)).days if license_obj.expires_at else None
     }
 
+# ==================== USAGE LIMITS ====================
+
+# Counted collections and the license feature holding their limit (-1 = unlimited)
+USAGE_LIMITS = {
+    'customers': 'max_customers',
+    'routes': 'max_routes',
+    'products': 'max_products',
+}
+USAGE_RECONCILE_INTERVAL_SECONDS = int(os.environ.get('USAGE_RECONCILE_INTERVAL_SECONDS', str(24 * 3600)))
+
+async def get_usage_limit(organization_id: str, collection: str) -> int:
+    license_obj = await license_cache.get_active(organization_id)
+    if not license_obj:
+        return -1
+    return license_obj.features.get(USAGE_LIMITS[collection], -1)
+
+async def reconcile_usage(organization_id: Optional[str] = None):
+    """Recount usage_counters from the collections themselves"""
+    match = {"organization_id": organization_id} if organization_id else {}
+    counts = {}
+    for collection in USAGE_LIMITS:
+        grouped = await db[collection].aggregate([
+            {"$match": match},
+            {"$group": {"_id": "$organization_id", "count": {"$sum": 1}}}
+        ]).to_list(None)
+        for entry in grouped:
+            counts.setdefault(entry['_id'], {})[collection] = entry['count']
+    if organization_id:
+        counts.setdefault(organization_id, {})
+
+    for org_id, org_counts in counts.items():
+        await db.usage_counters.update_one(
+            {"organization_id": org_id},
+            {"$set": {collection: org_counts.get(collection, 0) for collection in USAGE_LIMITS}},
+            upsert=True
+        )
+
+async def reserve_usage(organization_id: str, collection: str, count: int = 1):
+    """Count new documents against the organization's tier limit before inserting them.
+
+    The limit check and increment are one conditional update, so concurrent creates
+    cannot overshoot. Raises 403 when the limit would be exceeded.
+    """
+    limit = await get_usage_limit(organization_id, collection)
+    # A counter without this field hasn't been counted yet; $inc would start it from zero
+    query = {"organization_id": organization_id, collection: {"$lte": limit - count} if limit >= 0 else {"$exists": True}}
+
+    result = await db.usage_counters.update_one(query, {"$inc": {collection: count}})
+    if result.matched_count == 0:
+        # First counted write for this organization or collection: build the counter, then retry once
+        counter = await db.usage_counters.find_one({"organization_id": organization_id}, {"_id": 0})
+        if not counter or collection not in counter:
+            await reconcile_usage(organization_id)
+            result = await db.usage_counters.update_one(query, {"$inc": {collection: count}})
+        if result.matched_count == 0:
+            raise HTTPException(status_code=403, detail=f"Subscription limit reached: max {limit} {collection}")
+
+async def release_usage(organization_id: str, collection: str, count: int = 1):
+    await db.usage_counters.update_one(
+        {"organization_id": organization_id, collection: {"$exists": True}}, {"$inc": {collection: -count}}
+    )
+
+async def check_usage_replacement(organization_id: str, collection: str, count: int):
+    """Imports replace the whole collection, so only the new total has to fit"""
+    limit = await get_usage_limit(organization_id, collection)
+    if limit >= 0 and count > limit:
+        raise HTTPException(status_code=403, detail=f"Subscription limit reached: max {limit} {collection}, file has {count}")
+
+async def set_usage(organization_id: str, collection: str, count: int):
+    result = await db.usage_counters.update_one({"organization_id": organization_id}, {"$set": {collection: count}})
+    if result.matched_count == 0:
+        # No counter yet: count every collection, so later reserves find all their fields
+        await reconcile_usage(organization_id)
+
+async def usage_reconciler():
+    while True:
+        await asyncio.sleep(USAGE_RECONCILE_INTERVAL_SECONDS)
+        try:
+            await reconcile_usage()
+        except Exception as e:
+            logger.error(f"Usage reconciliation failed: {str(e)}")
+
+@api_router.get("/usage")
+async def get_usage(current_user: User = Depends(get_current_user)):
+    """Current counts and tier limits for the organization"""
+    counter = await db.usage_counters.find_one({"organization_id": current_user.organization_id}, {"_id": 0})
+    if not counter:
+        await reconcile_usage(current_user.organization_id)
+        counter = await db.usage_counters.find_one({"organization_id": current_user.organization_id}, {"_id": 0})
+    return {
+        collection: {
+            "count": counter.get(collection, 0),
+            "limit": await get_usage_limit(current_user.organization_id, collection)
+        }
+        for collection in USAGE_LIMITS
+    }
+
+@api_router.post("/usage/reconcile")
+async def reconcile_my_usage(current_user: User = Depends(get_current_user)):
+    """Recount the organization's usage counters (admin only)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can reconcile usage")
+    await reconcile_usage(current_user.organization_id)
+    return await get_usage(current_user)
+
 # ==================== CUSTOMER ENDPOINTS ====================
 
 @api_router.post("/customers", response_model=Customer)
 async def create_customer(customer_input: CustomerCreate, current_user: User = Depends(get_current_user)):
+    await reserve_usage(current_user.organization_id, "customers")
     customer = Customer(organization_id=current_user.organization_id, **customer_input.model_dump())
     doc = customer.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.customers.insert_one(doc)
+    await record_change(current_user.organization_id, "customers", customer.id)
     return customer
 
 @api_router.get("/customers", response_model=List[Customer])
@@ -737,6 +2288,7 @@ async def update_customer(
     doc['created_at'] = doc['created_at'].isoformat()
     
     await db.customers.replace_one({"id": customer_id}, doc)
+    await record_change(existing['organization_id'], "customers", customer_id)
     return updated_customer
 
 @api_router.delete("/customers/{customer_id}")
@@ -747,6 +2299,8 @@ async def delete_customer(customer_id: str, current_user: User = Depends(get_cur
     result = await db.customers.delete_one({"id": customer_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Customer not found")
+    await release_usage(current_user.organization_id, "customers")
+    await record_change(current_user.organization_id, "customers", customer_id, "delete")
     return {"message": "Customer deleted successfully"}
 
 @api_router.post("/customers/import")
@@ -760,6 +2314,7 @@ async def import_customers(
     
     try:
         contents = await file.read()
+        pd = load_pandas()
         df = pd.read_excel(BytesIO(contents))
         
         # Helper function to safely convert values
@@ -776,6 +2331,8 @@ async def import_customers(
             except:
                 return str(val).strip() if val else None
         
+        await check_usage_replacement(current_user.organization_id, "customers", len(df))
+        
         # Delete existing customers FOR THIS ORGANIZATION ONLY
         await db.customers.delete_many({"organization_id": current_user.organization_id})
         
@@ -810,9 +2367,14 @@ async def import_customers(
         
         if customers:
             await db.customers.insert_many(customers)
+
+        await set_usage(current_user.organization_id, "customers", len(customers))
+        await record_reset(current_user.organization_id, "customers")
         
         return {"message": "Import successful", "imported_count": len(customers)}
     
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Import error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Import failed: {str(e)}")
@@ -825,15 +2387,13 @@ async def create_employee(employee_input: EmployeeCreate, current_user: User = D
     doc = employee.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.employees.insert_one(doc)
+    await record_change(current_user.organization_id, "employees", employee.id)
     return employee
 
 @api_router.get("/employees", response_model=List[Employee])
 async def get_employees(current_user: User = Depends(get_current_user)):
-    employees = await db.employees.find({"organization_id": current_user.organization_id}, {"_id": 0}).to_list(1000)
-    for employee in employees:
-        if isinstance(employee['created_at'], str):
-            employee['created_at'] = datetime.fromisoformat(employee['created_at'])
-    return employees
+    snapshot = await reference_cache.get(current_user.organization_id, "employees")
+    return snapshot.docs
 
 @api_router.get("/employees/{employee_id}", response_model=Employee)
 async def get_employee(employee_id: str, current_user: User = Depends(get_current_user)):
@@ -845,6 +2405,51 @@ async def get_employee(employee_id: str, current_user: User = Depends(get_curren
         employee['created_at'] = datetime.fromisoformat(employee['created_at'])
     return Employee(**employee)
 
+@api_router.get("/employees/{employee_id}/availability")
+async def get_employee_availability(
+    employee_id: str,
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    current_user: User = Depends(get_current_user)
+):
+    """Bookings and free hours per day in [from, to) (default: the next 7 days from today)"""
+    org_id = current_user.organization_id
+    employees = await reference_cache.get(org_id, "employees")
+    if not employees.get('id', employee_id):
+        raise HTTPException(status_code=404, detail="Employee not found")
+
+    start = as_utc(date_from).date() if date_from else datetime.now(timezone.utc).date()
+    end = as_utc(date_to).date() if date_to else start + timedelta(days=7)
+    if not 0 < (end - start).days <= AVAILABILITY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"to must be after from and at most {AVAILABILITY_MAX_DAYS} days later")
+
+    days = []
+    for offset in range((end - start).days):
+        day = start + timedelta(days=offset)
+        day_start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+        day_end = day_start + timedelta(days=1)
+        bookings = await schedule_index.day_bookings(org_id, employee_id, day.isoformat())
+        # Merge overlapping bookings (clipped to the day) so double bookings aren't counted twice
+        booked = timedelta()
+        covered_until = day_start
+        overbooked = False
+        for booking_start, booking_end, _ in bookings:
+            if booking_start < covered_until and covered_until > day_start:
+                overbooked = True
+            booking_start, booking_end = max(booking_start, covered_until), min(booking_end, day_end)
+            if booking_end > booking_start:
+                booked += booking_end - booking_start
+                covered_until = booking_end
+        booked_hours = round(booked.total_seconds() / 3600, 2)
+        days.append({
+            "date": day.isoformat(),
+            "bookings": [booking_dict(*booking) for booking in bookings],
+            "booked_hours": booked_hours,
+            "free_hours": round(max(0.0, WORKDAY_HOURS - booked_hours), 2),
+            "overbooked": overbooked
+        })
+    return {"employee_id": employee_id, "workday_hours": WORKDAY_HOURS, "days": days}
+
 @api_router.put("/employees/{employee_id}", response_model=Employee)
 async def update_employee(
     employee_id: str,
@@ -866,6 +2471,7 @@ async def update_employee(
     doc['created_at'] = doc['created_at'].isoformat()
     
     await db.employees.replace_one({"id": employee_id}, doc)
+    await record_change(existing['organization_id'], "employees", employee_id)
     return updated_employee
 
 @api_router.delete("/employees/{employee_id}")
@@ -876,26 +2482,101 @@ async def delete_employee(employee_id: str, current_user: User = Depends(get_cur
     result = await db.employees.delete_one({"id": employee_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Employee not found")
+    await record_change(current_user.organization_id, "employees", employee_id, "delete")
     return {"message": "Employee deleted successfully"}
 
 # ==================== WORK ORDER ENDPOINTS ====================
 
 @api_router.post("/workorders", response_model=WorkOrder)
-async def create_workorder(workorder_input: WorkOrderCreate, current_user: User = Depends(get_current_user)):
+async def create_workorder(
+    workorder_input: WorkOrderCreate,
+    check_conflicts: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Create a work order. check_conflicts=true rejects it with 409 if the employee is already booked."""
     workorder = WorkOrder(organization_id=current_user.organization_id, **workorder_input.model_dump())
     doc = workorder.model_dump()
-    doc['date'] = doc['date'].isoformat()
+    doc['date'] = utc_isoformat(doc['date'])
     doc['created_at'] = doc['created_at'].isoformat()
-    await db.workorders.insert_one(doc)
+    async with booking_locks.hold(current_user.organization_id, [doc] if check_conflicts else []):
+        if check_conflicts:
+            await check_booking_conflicts(current_user.organization_id, doc)
+        await db.workorders.insert_one(doc)
+        schedule_index.update(current_user.organization_id, "workorders", new=doc)
+    await record_change(current_user.organization_id, "workorders", workorder.id)
     return workorder
 
-@api_router.get("/workorders", response_model=List[WorkOrder])
+WORKORDER_BULK_MAX = 500
+
+@api_router.post("/workorders/bulk", response_model=List[WorkOrder])
+async def create_workorders_bulk(
+    workorder_inputs: List[WorkOrderCreate],
+    check_conflicts: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Create several work orders at once (e.g. planning a route).
+    check_conflicts=true rejects the whole batch with 409 if any order overlaps an existing
+    booking or another order in the batch."""
+    if len(workorder_inputs) > WORKORDER_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"Too many work orders (max {WORKORDER_BULK_MAX})")
+    org_id = current_user.organization_id
+    workorders = [WorkOrder(organization_id=org_id, **wo.model_dump()) for wo in workorder_inputs]
+    docs = []
+    for workorder in workorders:
+        doc = workorder.model_dump()
+        doc['date'] = utc_isoformat(doc['date'])
+        doc['created_at'] = doc['created_at'].isoformat()
+        docs.append(doc)
+    if not docs:
+        return []
+
+    async with booking_locks.hold(org_id, docs if check_conflicts else []):
+        if check_conflicts:
+            batch = {}  # (employee_id, day) -> DaySchedule of the orders earlier in this batch
+            rejected = []
+            for index, doc in enumerate(docs):
+                interval = booking_interval(doc)
+                if not interval:
+                    continue
+                conflicts = await schedule_index.conflicts(org_id, doc['employee_id'], *interval)
+                seen = set()
+                for day in interval_days(*interval):
+                    day_batch = batch.setdefault((doc['employee_id'], day), DaySchedule())
+                    for booking in day_batch.overlapping(*interval):
+                        if booking[2] not in seen:
+                            seen.add(booking[2])
+                            conflicts.append(booking_dict(*booking))
+                    day_batch.add(*interval, ("workorders", doc['id']))
+                if conflicts:
+                    rejected.append({"index": index, "conflicts": conflicts})
+            if rejected:
+                raise HTTPException(status_code=409, detail={"message": "Employee is already booked", "orders": rejected})
+
+        await db.workorders.insert_many(docs)
+        for doc in docs:
+            schedule_index.update(org_id, "workorders", new=doc)
+    await record_changes(org_id, "workorders", [wo.id for wo in workorders])
+    return workorders
+
+WORKORDER_EXPANSIONS = {"customer", "employee"}
+
+@api_router.get("/workorders", response_model=List[WorkOrderExpanded])
 async def get_workorders(
     status: Optional[str] = None,
     order_type: Optional[str] = None,
     employee_id: Optional[str] = None,
+    expand: Optional[str] = None,
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
     current_user: User = Depends(get_current_user)
 ):
+    """List work orders. from/to limits them to a [from, to) date window.
+    expand=customer,employee embeds name summaries so clients don't need the
+    full customer and employee lists to render them."""
+    expansions = set(expand.split(',')) if expand else set()
+    if expansions - WORKORDER_EXPANSIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown expand value(s): {', '.join(sorted(expansions - WORKORDER_EXPANSIONS))}")
+    
     query = {"organization_id": current_user.organization_id}
     if status:
         query['status'] = status
@@ -903,8 +2584,40 @@ async def get_workorders(
         query['order_type'] = order_type
     if employee_id:
         query['employee_id'] = employee_id
+    date_window = date_range_filter(date_from, date_to)
+    if date_window:
+        query['date'] = date_window
+    
+    if "customer" in expansions:
+        workorders = await db.workorders.aggregate([
+            {"$match": query},
+            {"$limit": 1000},
+            {"$lookup": {
+                "from": "customers",
+                "let": {"customer_id": "$customer_id", "org_id": "$organization_id"},
+                "pipeline": [
+                    # customer_id is client supplied; never resolve it to another organization's customer
+                    {"$match": {"$expr": {"$and": [
+                        {"$eq": ["$id", "$$customer_id"]},
+                        {"$eq": ["$organization_id", "$$org_id"]}
+                    ]}}},
+                    {"$project": {"_id": 0, "id": 1, "anleggsnr": 1, "kundnavn": 1, "typenr": 1}}
+                ],
+                "as": "customer"
+            }},
+            {"$project": {"_id": 0}}
+        ]).to_list(1000)
+        for wo in workorders:
+            wo['customer'] = wo['customer'][0] if wo['customer'] else None
+    else:
+        workorders = await db.workorders.find(query, {"_id": 0}).to_list(1000)
+    
+    if "employee" in expansions:
+        # Employees are small and cached, so resolve them in memory
+        employees = await reference_cache.get(current_user.organization_id, "employees")
+        for wo in workorders:
+            wo['employee'] = employees.get('id', wo['employee_id'])
     
-    workorders = await db.workorders.find(query, {"_id": 0}).to_list(1000)
     for wo in workorders:
         if isinstance(wo['date'], str):
             wo['date'] = datetime.fromisoformat(wo['date'])
@@ -928,6 +2641,7 @@ async def get_workorder(workorder_id: str, current_user: User = Depends(get_curr
 async def update_workorder(
     workorder_id: str,
     workorder_input: WorkOrderCreate,
+    check_conflicts: bool = False,
     current_user: User = Depends(get_current_user)
 ):
     existing = await db.workorders.find_one({"id": workorder_id})
@@ -942,10 +2656,14 @@ async def update_workorder(
         **workorder_input.model_dump()
     )
     doc = updated_wo.model_dump()
-    doc['date'] = doc['date'].isoformat()
+    doc['date'] = utc_isoformat(doc['date'])
     doc['created_at'] = doc['created_at'].isoformat()
-    
-    await db.workorders.replace_one({"id": workorder_id}, doc)
+    async with booking_locks.hold(existing['organization_id'], [doc] if check_conflicts else []):
+        if check_conflicts:
+            await check_booking_conflicts(existing['organization_id'], doc, exclude_self=True)
+        await db.workorders.replace_one({"id": workorder_id}, doc)
+        schedule_index.update(existing['organization_id'], "workorders", old=existing, new=doc)
+    await record_change(existing['organization_id'], "workorders", workorder_id)
     return updated_wo
 
 @api_router.delete("/workorders/{workorder_id}")
@@ -956,6 +2674,8 @@ async def delete_workorder(workorder_id: str, current_user: User = Depends(get_c
     result = await db.workorders.delete_one({"id": workorder_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Work order not found")
+    schedule_index.update(current_user.organization_id, "workorders", old=existing)
+    await record_change(current_user.organization_id, "workorders", workorder_id, "delete")
     return {"message": "Work order deleted successfully"}
 
 # ==================== INTERNAL ORDER ENDPOINTS ====================
@@ -964,14 +2684,27 @@ async def delete_workorder(workorder_id: str, current_user: User = Depends(get_c
 async def create_internalorder(order_input: InternalOrderCreate, current_user: User = Depends(get_current_user)):
     order = InternalOrder(organization_id=current_user.organization_id, **order_input.model_dump())
     doc = order.model_dump()
-    doc['date'] = doc['date'].isoformat()
+    doc['date'] = utc_isoformat(doc['date'])
     doc['created_at'] = doc['created_at'].isoformat()
     await db.internalorders.insert_one(doc)
+    schedule_index.update(current_user.organization_id, "internalorders", new=doc)
+    await record_change(current_user.organization_id, "internalorders", order.id)
     return order
 
 @api_router.get("/internalorders", response_model=List[InternalOrder])
-async def get_internalorders(current_user: User = Depends(get_current_user)):
-    orders = await db.internalorders.find({"organization_id": current_user.organization_id}, {"_id": 0}).to_list(1000)
+async def get_internalorders(
+    employee_id: Optional[str] = None,
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    current_user: User = Depends(get_current_user)
+):
+    query = {"organization_id": current_user.organization_id}
+    if employee_id:
+        query['employee_id'] = employee_id
+    date_window = date_range_filter(date_from, date_to)
+    if date_window:
+        query['date'] = date_window
+    orders = await db.internalorders.find(query, {"_id": 0}).to_list(1000)
     for order in orders:
         if isinstance(order['date'], str):
             order['date'] = datetime.fromisoformat(order['date'])
@@ -987,6 +2720,8 @@ async def delete_internalorder(order_id: str, current_user: User = Depends(get_c
     result = await db.internalorders.delete_one({"id": order_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Internal order not found")
+    schedule_index.update(current_user.organization_id, "internalorders", old=existing)
+    await record_change(current_user.organization_id, "internalorders", order_id, "delete")
     return {"message": "Internal order deleted successfully"}
 
 @api_router.put("/internalorders/{order_id}", response_model=InternalOrder)
@@ -1000,22 +2735,92 @@ async def update_internalorder(order_id: str, order_input: InternalOrderCreate,
     update_data['id'] = order_id
     update_data['organization_id'] = existing['organization_id']
     update_data['created_at'] = existing.get('created_at', datetime.now(timezone.utc).isoformat())
+    # Stored as an ISO string like on create, so date range queries match it
+    update_data['date'] = utc_isoformat(update_data['date'])
     
     await db.internalorders.replace_one({"id": order_id}, update_data)
+    schedule_index.update(existing['organization_id'], "internalorders", old=existing, new=update_data)
+    await record_change(existing['organization_id'], "internalorders", order_id)
     
+    update_data['date'] = datetime.fromisoformat(update_data['date'])
     if isinstance(update_data['created_at'], str):
         update_data['created_at'] = datetime.fromisoformat(update_data['created_at'])
     
     return InternalOrder(**update_data)
 
+# ==================== CALENDAR ENDPOINTS ====================
+
+def parse_iso_week(week: Optional[str]) -> datetime:
+    """Monday 00:00 UTC of an ISO week like 2026-W02 (current week when empty)"""
+    if not week:
+        today = datetime.now(timezone.utc)
+        year, week_no, _ = today.isocalendar()
+    else:
+        try:
+            year, week_no = week.upper().split('-W')
+            year, week_no = int(year), int(week_no)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="week must look like 2026-W02")
+    try:
+        return datetime.fromisocalendar(year, week_no, 1).replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid ISO week: {week}")
+
+@api_router.get("/calendar")
+async def get_calendar(
+    week: Optional[str] = None,
+    employee_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Work orders and internal orders for one ISO week, grouped by employee and day"""
+    monday = parse_iso_week(week)
+    days = [(monday + timedelta(days=i)).date().isoformat() for i in range(7)]
+    query = {
+        "organization_id": current_user.organization_id,
+        "date": date_range_filter(monday, monday + timedelta(days=7))
+    }
+    if employee_id:
+        query['employee_id'] = employee_id
+
+    workorders, internalorders, employees = await gather_bounded(
+        db.workorders.find(query, {"_id": 0, "organization_id": 0}).sort("date", 1).to_list(None),
+        db.internalorders.find(query, {"_id": 0, "organization_id": 0}).sort("date", 1).to_list(None),
+        reference_cache.get(current_user.organization_id, "employees")
+    )
+
+    by_employee = {}
+    for kind, orders in (("workorders", workorders), ("internalorders", internalorders)):
+        for order in orders:
+            day = order['date'][:10]
+            employee_days = by_employee.setdefault(order['employee_id'], {})
+            entry = employee_days.setdefault(day, {"workorders": [], "internalorders": [], "total_hours": 0.0})
+            entry[kind].append(order)
+            entry["total_hours"] += order.get('arbeidstid', 0) + order.get('kjoretid', 0)
+
+    calendar = []
+    for emp_id, employee_days in by_employee.items():
+        employee = employees.get('id', emp_id)
+        calendar.append({
+            "employee_id": emp_id,
+            "initialer": employee['initialer'] if employee else None,
+            "navn": employee['navn'] if employee else None,
+            "days": employee_days
+        })
+    calendar.sort(key=lambda e: e['initialer'] or '')
+
+    iso_year, iso_week, _ = monday.isocalendar()
+    return {"week": f"{iso_year}-W{iso_week:02d}", "days": days, "employees": calendar}
+
 # ==================== PRODUCT ENDPOINTS ====================
 
 @api_router.post("/products", response_model=Product)
 async def create_product(product_input: ProductCreate, current_user: User = Depends(get_current_user)):
+    await reserve_usage(current_user.organization_id, "products")
     product = Product(organization_id=current_user.organization_id, **product_input.model_dump())
     doc = product.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.products.insert_one(doc)
+    await record_change(current_user.organization_id, "products", product.id)
     return product
 
 @api_router.get("/products", response_model=List[Product])
@@ -1047,6 +2852,9 @@ async def update_product(
     doc['created_at'] = doc['created_at'].isoformat()
     
     await db.products.replace_one({"id": product_id}, doc)
+    await record_change(existing['organization_id'], "products", product_id)
+    if existing.get('image_url') != doc['image_url']:
+        await release_product_images([existing.get('image_url')])
     return updated_product
 
 @api_router.delete("/products/{product_id}")
@@ -1057,8 +2865,193 @@ async def delete_product(product_id: str, current_user: User = Depends(get_curre
     result = await db.products.delete_one({"id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    await release_usage(current_user.organization_id, "products")
+    await record_change(current_user.organization_id, "products", product_id, "delete")
+    if existing:
+        await release_product_images([existing.get('image_url')])
     return {"message": "Product deleted successfully"}
 
+# ==================== PRODUCT IMAGES ====================
+# Uploads are streamed to disk in chunks and stored under their SHA-256 digest, so the same
+# image uploaded for several products is kept once. Resized and WebP variants are rendered in a
+# process pool (see image_variants.py) and GET /api/images/products/{digest}.{ext} picks one
+# by ?size= and the Accept header. Without Pillow only the originals are served.
+# The extension is the format the file decodes as, not the content type the client sent. Files
+# no product references any more are deleted when a product drops its image, and swept
+# periodically for the ones an upload touched too recently to delete right away.
+
+PRODUCT_IMAGES_DIR = ROOT_DIR / "uploads" / "products"
+IMAGE_CONTENT_TYPES = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/gif': 'gif', 'image/webp': 'webp'}
+IMAGE_UPLOAD_CHUNK_BYTES = int(os.environ.get('IMAGE_UPLOAD_CHUNK_BYTES', str(256 * 1024)))
+IMAGE_UPLOAD_MAX_BYTES = int(os.environ.get('IMAGE_UPLOAD_MAX_BYTES', str(10 * 1024 * 1024)))
+# Longest edge in pixels; the product grid shows 48 px images, the edit form 96 px
+IMAGE_SIZES = {"thumb": int(os.environ.get('IMAGE_THUMB_PX', '128')), "medium": int(os.environ.get('IMAGE_MEDIUM_PX', '512'))}
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', '2'))
+IMAGE_VARIANTS_ENABLED = importlib.util.find_spec("PIL") is not None
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+IMAGE_URL_PREFIX = "/api/images/products/"
+# An unreferenced image touched this recently may be an upload about to be saved on its product
+IMAGE_GC_GRACE_SECONDS = int(os.environ.get('IMAGE_GC_GRACE_SECONDS', '600'))
+IMAGE_GC_BATCH = 500
+
+image_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+def get_image_pool() -> concurrent.futures.ProcessPoolExecutor:
+    """Started on the first upload; spawned workers import image_variants, not this module"""
+    global image_pool
+    if image_pool is None:
+        image_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return image_pool
+
+def shutdown_image_pool():
+    global image_pool
+    if image_pool is not None:
+        image_pool.shutdown(wait=False, cancel_futures=True)
+        image_pool = None
+
+def open_partial_upload():
+    PRODUCT_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+    path = PRODUCT_IMAGES_DIR / f".upload-{uuid.uuid4().hex}.partial"
+    return path, open(path, 'wb')
+
+def write_upload_chunk(handle, digest, chunk: bytes):
+    # hashlib releases the GIL for large buffers, so hashing in the thread keeps the loop free too
+    digest.update(chunk)
+    handle.write(chunk)
+
+def discard_partial_upload(path: Path, handle):
+    handle.close()
+    path.unlink(missing_ok=True)
+
+def commit_upload(path: Path, handle, target: Path) -> bool:
+    """Move the finished upload into place; False when the same content is already stored"""
+    handle.close()
+    if target.exists():
+        path.unlink(missing_ok=True)
+        # Keeps the garbage collector off it until this upload is saved on its product
+        os.utime(target)
+        return False
+    path.replace(target)
+    return True
+
+async def identify_product_image(path: Path) -> Optional[str]:
+    """Decoding a whole image is CPU work, so it goes to the process pool with the rendering"""
+    if IMAGE_VARIANTS_ENABLED:
+        return await asyncio.get_running_loop().run_in_executor(get_image_pool(), image_variants.identify, str(path))
+    return await asyncio.to_thread(image_variants.identify, str(path))
+
+async def store_product_image(file: UploadFile) -> str:
+    """Stream the upload to disk while hashing it; returns the stored file name, <sha256>.<ext>"""
+    path, handle = await asyncio.to_thread(open_partial_upload)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while chunk := await file.read(IMAGE_UPLOAD_CHUNK_BYTES):
+            size += len(chunk)
+            if size > IMAGE_UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Image is larger than {IMAGE_UPLOAD_MAX_BYTES // (1024 * 1024)} MB")
+            await asyncio.to_thread(write_upload_chunk, handle, digest, chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Empty file")
+        await asyncio.to_thread(handle.close)
+        ext = await identify_product_image(path)
+        if ext is None:
+            raise HTTPException(status_code=400, detail="File is not a valid jpeg, png, gif or webp image")
+    except BaseException:
+        await asyncio.to_thread(discard_partial_upload, path, handle)
+        raise
+    filename = f"{digest.hexdigest()}.{ext}"
+    stored = await asyncio.to_thread(commit_upload, path, handle, PRODUCT_IMAGES_DIR / filename)
+    logger.info(f"Product image {filename}: {size} bytes, {'stored' if stored else 'already stored'}")
+    return filename
+
+async def render_product_image_variants(filename: str):
+    """Render missing variants in the process pool. Concurrent uploads of the same image share
+    one rendering; a failure leaves the original in place and is only logged."""
+    if not IMAGE_VARIANTS_ENABLED:
+        return []
+    loop = asyncio.get_running_loop()
+
+    async def render():
+        return await loop.run_in_executor(
+            get_image_pool(), image_variants.render_variants, str(PRODUCT_IMAGES_DIR / filename), IMAGE_SIZES
+        )
+    try:
+        return await request_coalescer.run((None, "product_image_variants", filename), render, ttl=0)
+    except Exception as e:
+        logger.warning(f"Could not render variants of {filename}: {str(e)}")
+        return []
+
+def is_image_digest(digest: str) -> bool:
+    return len(digest) == 64 and all(c in "0123456789abcdef" for c in digest)
+
+def image_digest(image_url: Optional[str]) -> Optional[str]:
+    """Digest of a stored product image URL; None for external links and pre-digest uploads"""
+    if not image_url or not image_url.startswith(IMAGE_URL_PREFIX):
+        return None
+    digest = image_url[len(IMAGE_URL_PREFIX):].partition(".")[0]
+    return digest if is_image_digest(digest) else None
+
+def image_files(digest: str) -> List[Path]:
+    """The original and every variant stored for a digest"""
+    return [*PRODUCT_IMAGES_DIR.glob(f"{digest}.*"), *PRODUCT_IMAGES_DIR.glob(f"{digest}-*")]
+
+def stored_image_files() -> dict:
+    """digest -> its files, for everything in the image directory"""
+    files = {}
+    if PRODUCT_IMAGES_DIR.exists():
+        for path in PRODUCT_IMAGES_DIR.iterdir():
+            digest = path.name[:64]
+            if path.name[64:65] in (".", "-") and is_image_digest(digest):
+                files.setdefault(digest, []).append(path)
+    return files
+
+def delete_image_files(paths: List[Path], grace_seconds: float) -> bool:
+    cutoff = time.time() - grace_seconds
+    try:
+        if any(path.stat().st_mtime > cutoff for path in paths):
+            return False
+    except FileNotFoundError:
+        pass  # Deleted by another worker already
+    for path in paths:
+        path.unlink(missing_ok=True)
+    return True
+
+async def delete_unreferenced_images(files: dict) -> int:
+    """Delete the digests in `files` (digest -> paths) that no product's image_url points at.
+    Returns how many were deleted."""
+    if not files:
+        return 0
+    urls = [IMAGE_URL_PREFIX + path.name for paths in files.values() for path in paths]
+    referenced = {image_digest(url) for url in await db.products.distinct("image_url", {"image_url": {"$in": urls}})}
+    deleted = 0
+    for digest, paths in files.items():
+        if digest not in referenced and await asyncio.to_thread(delete_image_files, paths, IMAGE_GC_GRACE_SECONDS):
+            deleted += 1
+    return deleted
+
+async def release_product_images(image_urls: List[Optional[str]]):
+    """Called after products drop these image URLs; files nobody else uses are deleted"""
+    digests = {digest for digest in map(image_digest, image_urls) if digest}
+    if not digests:
+        return
+    try:
+        files = {digest: await asyncio.to_thread(image_files, digest) for digest in digests}
+        await delete_unreferenced_images({digest: paths for digest, paths in files.items() if paths})
+    except Exception as e:
+        # The product change is already saved; the periodic sweep retries
+        logger.warning(f"Could not delete unused product images: {str(e)}")
+
+async def purge_product_images() -> int:
+    files = await asyncio.to_thread(stored_image_files)
+    digests = list(files)
+    deleted = 0
+    for start in range(0, len(digests), IMAGE_GC_BATCH):
+        deleted += await delete_unreferenced_images({digest: files[digest] for digest in digests[start:start + IMAGE_GC_BATCH]})
+    return deleted
+
 @api_router.post("/products/{product_id}/upload-image")
 async def upload_product_image(
     product_id: str,
@@ -1071,31 +3064,22 @@ async def upload_product_image(
         raise HTTPException(status_code=404, detail="Product not found")
     check_organization_access(existing['organization_id'], current_user.organization_id)
     
-    # Validate file type
-    allowed_types = ['image/jpeg', 'image/png', 'image/gif', 'image/webp']
-    if file.content_type not in allowed_types:
+    # Validate file type; the stored extension comes from the content, not from this header
+    if file.content_type not in IMAGE_CONTENT_TYPES:
         raise HTTPException(status_code=400, detail="Invalid file type. Allowed: jpeg, png, gif, webp")
     
-    # Save file to uploads directory
-    import os
-    uploads_dir = Path(__file__).parent / "uploads" / "products"
-    uploads_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Generate unique filename
-    ext = file.filename.split('.')[-1] if '.' in file.filename else 'jpg'
-    filename = f"{product_id}.{ext}"
-    filepath = uploads_dir / filename
-    
-    contents = await file.read()
-    with open(filepath, 'wb') as f:
-        f.write(contents)
+    filename = await store_product_image(file)
+    await render_product_image_variants(filename)
     
     # Update product with image URL
-    image_url = f"/api/uploads/products/{filename}"
+    image_url = f"{IMAGE_URL_PREFIX}{filename}"
     await db.products.update_one(
         {"id": product_id},
         {"$set": {"image_url": image_url}}
     )
+    await record_change(existing['organization_id'], "products", product_id)
+    if existing.get('image_url') != image_url:
+        await release_product_images([existing.get('image_url')])
     
     return {"message": "Image uploaded successfully", "image_url": image_url}
 
@@ -1110,6 +3094,7 @@ async def import_products(
     
     try:
         contents = await file.read()
+        pd = load_pandas()
         df = pd.read_excel(BytesIO(contents))
         
         # Helper function to safely convert values
@@ -1134,6 +3119,9 @@ async def import_products(
             except:
                 return 0
         
+        await check_usage_replacement(current_user.organization_id, "products", len(df))
+        
+        replaced_images = await db.products.distinct("image_url", {"organization_id": current_user.organization_id})
         # Delete existing products FOR THIS ORGANIZATION ONLY
         await db.products.delete_many({"organization_id": current_user.organization_id})
         
@@ -1155,14 +3143,20 @@ async def import_products(
         
         if products:
             await db.products.insert_many(products)
+
+        await set_usage(current_user.organization_id, "products", len(products))
+        await record_reset(current_user.organization_id, "products")
+        await release_product_images(replaced_images)
         
         return {"imported_count": len(products), "message": f"{len(products)} products imported successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Import failed: {traceback.format_exc()}")
         raise HTTPException(status_code=400, detail=f"Could not process file: {str(e)}")
 
 # Serve uploaded files
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 
 @api_router.get("/uploads/products/{filename}")
 async def get_product_image(filename: str):
@@ -1171,6 +3165,32 @@ async def get_product_image(filename: str):
         raise HTTPException(status_code=404, detail="Image not found")
     return FileResponse(filepath)
 
+@api_router.get("/images/products/{filename}")
+async def get_product_image_variant(
+    filename: str,
+    request: Request,
+    size: str = Query("original", description="thumb, medium or original"),
+    fmt: Optional[str] = Query(None, alias="format", description="webp or original; default follows Accept")
+):
+    """Content-addressed product image. Falls back to the original when a variant wasn't rendered."""
+    digest, _, ext = filename.partition(".")
+    if not is_image_digest(digest) or ext not in IMAGE_CONTENT_TYPES.values():
+        raise HTTPException(status_code=404, detail="Image not found")
+    if size != "original" and size not in IMAGE_SIZES:
+        raise HTTPException(status_code=400, detail=f"Unknown size. Allowed: {', '.join(['original', *IMAGE_SIZES])}")
+    if fmt not in (None, "webp", "original"):
+        raise HTTPException(status_code=400, detail="Unknown format. Allowed: webp, original")
+    if fmt is None:
+        fmt = "webp" if "image/webp" in request.headers.get("accept", "") else "original"
+
+    candidates = [(size, "webp")] if fmt == "webp" else []
+    candidates += [(size, ext), ("original", ext)]
+    for variant_size, variant_ext in candidates:
+        path = PRODUCT_IMAGES_DIR / image_variants.variant_name(digest, variant_size, variant_ext)
+        if path.exists():
+            return FileResponse(path, headers={"Cache-Control": IMAGE_CACHE_CONTROL, "Vary": "Accept"})
+    raise HTTPException(status_code=404, detail="Image not found")
+
 # ==================== ROUTE ENDPOINTS ====================
 
 @api_router.post("/routes", response_model=Route)
@@ -1185,6 +3205,7 @@ async def create_route(route_input: RouteCreate, current_user: User = Depends(ge
     customers_sorted = sorted(customers, key=lambda x: (x.get('postnr', '9999'), x.get('adresse', '')))
     optimized_list = [c['anleggsnr'] for c in customers_sorted]
     
+    await reserve_usage(current_user.organization_id, "routes")
     route = Route(
         organization_id=current_user.organization_id,
         date=route_input.date,
@@ -1192,9 +3213,10 @@ async def create_route(route_input: RouteCreate, current_user: User = Depends(ge
         optimized=True
     )
     doc = route.model_dump()
-    doc['date'] = doc['date'].isoformat()
+    doc['date'] = utc_isoformat(doc['date'])
     doc['created_at'] = doc['created_at'].isoformat()
     await db.routes.insert_one(doc)
+    await record_change(current_user.organization_id, "routes", route.id)
     return route
 
 @api_router.post("/routes/from-anleggsnr", response_model=Route)
@@ -1221,9 +3243,10 @@ async def get_routes(current_user: User = Depends(get_current_user)):
 async def create_risk_assessment(input: HMSRiskAssessmentCreate, current_user: User = Depends(get_current_user)):
     assessment = HMSRiskAssessment(organization_id=current_user.organization_id, **input.model_dump())
     doc = assessment.model_dump()
-    doc['dato'] = doc['dato'].isoformat()
+    doc['dato'] = utc_isoformat(doc['dato'])
     doc['created_at'] = doc['created_at'].isoformat()
     await db.hms_risk_assessments.insert_one(doc)
+    await record_change(current_user.organization_id, "hms_risk_assessments", assessment.id)
     return assessment
 
 @api_router.get("/hms/riskassessments", response_model=List[HMSRiskAssessment])
@@ -1240,9 +3263,10 @@ async def get_risk_assessments(current_user: User = Depends(get_current_user)):
 async def create_incident(input: HMSIncidentCreate, current_user: User = Depends(get_current_user)):
     incident = HMSIncident(organization_id=current_user.organization_id, **input.model_dump())
     doc = incident.model_dump()
-    doc['dato'] = doc['dato'].isoformat()
+    doc['dato'] = utc_isoformat(doc['dato'])
     doc['created_at'] = doc['created_at'].isoformat()
     await db.hms_incidents.insert_one(doc)
+    await record_change(current_user.organization_id, "hms_incidents", incident.id)
     return incident
 
 @api_router.get("/hms/incidents", response_model=List[HMSIncident])
@@ -1259,11 +3283,12 @@ async def get_incidents(current_user: User = Depends(get_current_user)):
 async def create_training(input: HMSTrainingCreate, current_user: User = Depends(get_current_user)):
     training = HMSTraining(organization_id=current_user.organization_id, **input.model_dump())
     doc = training.model_dump()
-    doc['dato'] = doc['dato'].isoformat()
+    doc['dato'] = utc_isoformat(doc['dato'])
     if doc['expires_at']:
         doc['expires_at'] = doc['expires_at'].isoformat()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.hms_training.insert_one(doc)
+    await record_change(current_user.organization_id, "hms_training", training.id)
     return training
 
 @api_router.get("/hms/training", response_model=List[HMSTraining])
@@ -1286,6 +3311,7 @@ async def create_equipment(input: HMSEquipmentCreate, current_user: User = Depen
     doc['next_control'] = doc['next_control'].isoformat()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.hms_equipment.insert_one(doc)
+    await record_change(current_user.organization_id, "hms_equipment", equipment.id)
     return equipment
 
 @api_router.get("/hms/equipment", response_model=List[HMSEquipment])
@@ -1306,9 +3332,10 @@ async def get_equipment(current_user: User = Depends(get_current_user)):
 async def create_payout(input: PayoutCreate, current_user: User = Depends(get_current_user)):
     payout = Payout(organization_id=current_user.organization_id, **input.model_dump())
     doc = payout.model_dump()
-    doc['date'] = doc['date'].isoformat()
+    doc['date'] = utc_isoformat(doc['date'])
     doc['created_at'] = doc['created_at'].isoformat()
     await db.payouts.insert_one(doc)
+    await record_change(current_user.organization_id, "payouts", payout.id)
     return payout
 
 @api_router.get("/economy/payouts", response_model=List[Payout])
@@ -1327,15 +3354,13 @@ async def create_service(input: ServiceCreate, current_user: User = Depends(get_
     doc = service.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.services.insert_one(doc)
+    await record_change(current_user.organization_id, "services", service.id)
     return service
 
 @api_router.get("/economy/services", response_model=List[Service])
 async def get_services(current_user: User = Depends(get_current_user)):
-    services = await db.services.find({"organization_id": current_user.organization_id}, {"_id": 0}).to_list(1000)
-    for s in services:
-        if isinstance(s['created_at'], str):
-            s['created_at'] = datetime.fromisoformat(s['created_at'])
-    return services
+    snapshot = await reference_cache.get(current_user.organization_id, "services")
+    return snapshot.docs
 
 @api_router.get("/economy/services/{service_id}", response_model=Service)
 async def get_service(service_id: str, current_user: User = Depends(get_current_user)):
@@ -1368,6 +3393,7 @@ async def update_service(
     doc['created_at'] = doc['created_at'].isoformat()
     
     await db.services.replace_one({"id": service_id}, doc)
+    await record_change(existing['organization_id'], "services", service_id)
     return updated_service
 
 @api_router.delete("/economy/services/{service_id}")
@@ -1378,6 +3404,7 @@ async def delete_service(service_id: str, current_user: User = Depends(get_curre
     result = await db.services.delete_one({"id": service_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Service not found")
+    await record_change(current_user.organization_id, "services", service_id, "delete")
     return {"message": "Service deleted successfully"}
 
 @api_router.post("/economy/services/import")
@@ -1391,6 +3418,7 @@ async def import_services(
     
     try:
         contents = await file.read()
+        pd = load_pandas()
         df = pd.read_excel(BytesIO(contents))
         
         # Log available columns for debugging
@@ -1450,6 +3478,8 @@ async def import_services(
         
         if services:
             await db.services.insert_many(services)
+
+        await record_reset(current_user.organization_id, "services")
         
         logging.info(f"Successfully imported {len(services)} services")
         return {"message": "Import successful", "imported_count": len(services)}
@@ -1474,13 +3504,11 @@ async def get_service_pricing_for_customer(anleggsnr: str, current_user: User =
     if not service_nr:
         return {"customer": customer, "service": None, "message": "No service type (typenr) assigned to customer"}
     
-    service = await db.services.find_one({"tjenestenr": service_nr, "organization_id": current_user.organization_id}, {"_id": 0})
+    services = await reference_cache.get(current_user.organization_id, "services")
+    service = services.get('tjenestenr', service_nr)
     if not service:
         return {"customer": customer, "service": None, "message": f"Service with tjenestenr {service_nr} not found"}
     
-    if isinstance(service.get('created_at'), str):
-        service['created_at'] = datetime.fromisoformat(service['created_at'])
-    
     return {
         "customer": customer,
         "service": service,
@@ -1495,20 +3523,13 @@ async def create_supplier_pricing(input: SupplierPricingCreate, current_user: Us
     doc['created_at'] = doc['created_at'].isoformat()
     doc['updated_at'] = doc['updated_at'].isoformat()
     await db.supplier_pricing.insert_one(doc)
+    await record_change(current_user.organization_id, "supplier_pricing", pricing.id)
     return pricing
 
 @api_router.get("/economy/supplier-pricing", response_model=List[SupplierPricing])
 async def get_supplier_pricing(current_user: User = Depends(get_current_user)):
-    pricing = await db.supplier_pricing.find({"organization_id": current_user.organization_id}, {"_id": 0}).to_list(1000)
-    for p in pricing:
-        if isinstance(p['created_at'], str):
-            p['created_at'] = datetime.fromisoformat(p['created_at'])
-        if isinstance(p['updated_at'], str):
-            p['updated_at'] = datetime.fromisoformat(p['updated_at'])
-        # Handle legacy data without name field
-        if 'name' not in p:
-            p['name'] = 'Standard'
-    return pricing
+    snapshot = await reference_cache.get(current_user.organization_id, "supplier_pricing")
+    return snapshot.docs
 
 @api_router.put("/economy/supplier-pricing/{pricing_id}", response_model=SupplierPricing)
 async def update_supplier_pricing(
@@ -1533,6 +3554,7 @@ async def update_supplier_pricing(
     doc['updated_at'] = doc['updated_at'].isoformat()
     
     await db.supplier_pricing.replace_one({"id": pricing_id}, doc)
+    await record_change(existing['organization_id'], "supplier_pricing", pricing_id)
     return updated_pricing
 
 @api_router.delete("/economy/supplier-pricing/{pricing_id}")
@@ -1543,20 +3565,121 @@ async def delete_supplier_pricing(pricing_id: str, current_user: User = Depends(
     result = await db.supplier_pricing.delete_one({"id": pricing_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Supplier pricing not found")
+    await record_change(current_user.organization_id, "supplier_pricing", pricing_id, "delete")
     return {"message": "Supplier pricing deleted successfully"}
 
+# ==================== REQUEST COALESCING ====================
+# When a whole organization opens the same page at once, identical reads share one computation:
+# requests for a key already in flight wait for that result instead of querying again, and the
+# result is kept for COALESCE_MEMO_SECONDS unless the organization writes to the data meanwhile.
+
+COALESCE_MEMO_SECONDS = float(os.environ.get('COALESCE_MEMO_SECONDS', '2'))
+COALESCE_MEMO_MAX_ENTRIES = int(os.environ.get('COALESCE_MEMO_MAX_ENTRIES', '256'))
+
+coalesced_requests_total = Counter(
+    "coalesced_requests_total", "Coalesced reads by outcome: computed, joined an in-flight computation, or memo hit",
+    ["endpoint", "outcome"], registry=metrics_registry
+)
+
+class RequestCoalescer:
+    """Single-flight per key; keys start with the organization id. Results are shared between
+    requests and must not be mutated."""
+
+    def __init__(self):
+        self._inflight = {}
+        self._memo = {}  # key -> (result, expires_at)
+        self._versions = {}
+        self.counts = {}
+
+    def _count(self, endpoint: str, outcome: str):
+        coalesced_requests_total.labels(endpoint, outcome).inc()
+        self.counts[(endpoint, outcome)] = self.counts.get((endpoint, outcome), 0) + 1
+
+    def invalidate(self, organization_id: Optional[str], collection: str = None):
+        """Writes drop the organization's memoized results; in-flight ones finish but aren't kept"""
+        if organization_id is None:
+            self._memo.clear()
+            for key in self._versions:
+                self._versions[key] += 1
+            return
+        self._versions[organization_id] = self._versions.get(organization_id, 0) + 1
+        for key in [key for key in self._memo if key[0] == organization_id]:
+            del self._memo[key]
+
+    def _remember(self, key: tuple, result, ttl: float):
+        now = time.monotonic()
+        if len(self._memo) >= COALESCE_MEMO_MAX_ENTRIES:
+            for stale in [k for k, (_, expires_at) in self._memo.items() if expires_at <= now]:
+                del self._memo[stale]
+            if len(self._memo) >= COALESCE_MEMO_MAX_ENTRIES:
+                return
+        self._memo[key] = (result, now + ttl)
+
+    @staticmethod
+    async def _compute(compute, deadline: float):
+        with pymongo.timeout(deadline):
+            return await compute()
+
+    async def run(self, key: tuple, compute, ttl: float = None, deadline: float = None):
+        """key: (organization_id, endpoint, *normalized params); compute: no-argument coroutine function.
+        The shared computation gets its own query deadline, by default the default class's."""
+        endpoint = key[1]
+        ttl = COALESCE_MEMO_SECONDS if ttl is None else ttl
+        memo = self._memo.get(key)
+        if memo is not None and memo[1] > time.monotonic():
+            self._count(endpoint, "memo")
+            return memo[0]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self._count(endpoint, "joined")
+        else:
+            self._count(endpoint, "computed")
+            version = self._versions.get(key[0], 0)
+            # Its own task, so a disconnecting client doesn't cancel the result others wait for.
+            # An empty context, so the work isn't billed to the first caller's RequestStats and
+            # isn't cut short by that caller's deadline
+            task = asyncio.get_running_loop().create_task(
+                self._compute(compute, deadline or QUERY_DEADLINE_SECONDS["default"]), context=contextvars.Context()
+            )
+            self._inflight[key] = task
+
+            def finished(task):
+                self._inflight.pop(key, None)
+                if ttl and not task.cancelled() and task.exception() is None \
+                        and self._versions.get(key[0], 0) == version:
+                    self._remember(key, task.result(), ttl)
+            task.add_done_callback(finished)
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._inflight),
+            "memo_entries": len(self._memo),
+            "requests": {f"{endpoint}:{outcome}": count for (endpoint, outcome), count in sorted(self.counts.items())}
+        }
+
+request_coalescer = RequestCoalescer()
+
 # ==================== DASHBOARD STATS ====================
 
 @api_router.get("/dashboard/stats")
 async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
-    org_filter = {"organization_id": current_user.organization_id}
-    total_customers = await db.customers.count_documents(org_filter)
-    total_workorders = await db.workorders.count_documents(org_filter)
-    planned_workorders = await db.workorders.count_documents({**org_filter, "status": "planlagt"})
-    total_products = await db.products.count_documents(org_filter)
-    
-    # Get work orders by type
-    workorders = await db.workorders.find(org_filter, {"_id": 0, "order_type": 1, "arbeidstid": 1, "kjoretid": 1, "kjorte_km": 1}).to_list(1000)
+    organization_id = current_user.organization_id
+    return await request_coalescer.run(
+        (organization_id, "dashboard_stats"), lambda: compute_dashboard_stats(organization_id)
+    )
+
+async def compute_dashboard_stats(organization_id: str) -> dict:
+    org_filter = {"organization_id": organization_id}
+    total_customers, total_workorders, planned_workorders, total_products, workorders = await gather_bounded(
+        db.customers.count_documents(org_filter),
+        db.workorders.count_documents(org_filter),
+        db.workorders.count_documents({**org_filter, "status": "planlagt"}),
+        db.products.count_documents(org_filter),
+        # Work orders by type
+        db.workorders.find(org_filter, {"_id": 0, "order_type": 1, "arbeidstid": 1, "kjoretid": 1, "kjorte_km": 1}).to_list(1000)
+    )
     
     stats_by_type = {}
     for wo in workorders:
@@ -1707,6 +3830,561 @@ async def remove_organization_user(
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User removed successfully"}
 
+# ==================== SYNC ENDPOINTS ====================
+
+SYNC_PAGE_SIZE = 5000
+# Sequence numbers are reserved before their entries are inserted, so a later seq can land
+# first. A missing seq holds back everything after it until this long after the next entry
+# was logged; by then the writer that reserved it has failed and it is skipped.
+SYNC_GAP_GRACE_SECONDS = float(os.environ.get('SYNC_GAP_GRACE_SECONDS', '30'))
+
+def contiguous_changes(entries: List[dict], since: int) -> List[dict]:
+    """The entries up to the first seq still in flight"""
+    abandoned_before = (datetime.now(timezone.utc) - timedelta(seconds=SYNC_GAP_GRACE_SECONDS)).isoformat()
+    expected = since + 1
+    for i, entry in enumerate(entries):
+        if entry['seq'] != expected and entry['ts'] > abandoned_before:
+            return entries[:i]
+        expected = entry['seq'] + 1
+    return entries
+
+@api_router.get("/sync")
+async def sync_changes(
+    since: int = 0,
+    limit: int = SYNC_PAGE_SIZE,
+    current_user: User = Depends(get_current_user)
+):
+    """Return documents changed since sequence number `since`, plus tombstones for deleted ones.
+
+    Clients store the returned `seq` and pass it as `since` on the next call. When
+    `full_resync` is true the client must reload its collections through the regular
+    list endpoints and continue syncing from the returned `seq`.
+    """
+    org_id = current_user.organization_id
+    limit = max(1, min(limit, SYNC_PAGE_SIZE))
+    counter = await db.sync_counters.find_one({"organization_id": org_id}, {"_id": 0}) or {}
+    current_seq = counter.get('seq', 0)
+    floor_seq = counter.get('floor_seq', 0)
+
+    # First sync, entries compacted away, or client ahead of the server (database reseeded)
+    if since <= 0 or since < floor_seq or since > current_seq:
+        return {"full_resync": True, "seq": current_seq, "has_more": False, "changes": {}}
+
+    entries = await db.changes.find(
+        {"organization_id": org_id, "seq": {"$gt": since}},
+        {"_id": 0, "seq": 1, "collection": 1, "doc_id": 1, "op": 1, "ts": 1}
+    ).sort("seq", 1).to_list(limit + 1)
+    has_more = len(entries) > limit
+    committed = contiguous_changes(entries[:limit], since)
+    # Stopped at a gap: the rest comes on the next regular sync, once the gap fills
+    if len(committed) < len(entries[:limit]):
+        has_more = False
+    entries = committed
+
+    # Collapse to the latest op per document; a reset supersedes earlier entries in its collection
+    latest_ops = {}
+    resets = set()
+    for entry in entries:
+        collection = entry['collection']
+        if entry['op'] == 'reset':
+            resets.add(collection)
+            latest_ops[collection] = {}
+        else:
+            latest_ops.setdefault(collection, {})[entry['doc_id']] = entry['op']
+
+    changes = {}
+    for collection, ops in latest_ops.items():
+        if collection in resets:
+            docs = await db[collection].find({"organization_id": org_id}, {"_id": 0}).to_list(None)
+            changes[collection] = {"reset": True, "upserted": docs, "deleted": []}
+            continue
+
+        upsert_ids = [doc_id for doc_id, op in ops.items() if op == 'upsert']
+        docs = []
+        if upsert_ids:
+            docs = await db[collection].find(
+                {"id": {"$in": upsert_ids}, "organization_id": org_id}, {"_id": 0}
+            ).to_list(None)
+        found_ids = {doc['id'] for doc in docs}
+        # Anything logged as upserted but gone by now was deleted later
+        deleted = [doc_id for doc_id in ops if doc_id not in found_ids]
+        changes[collection] = {"reset": False, "upserted": docs, "deleted": deleted}
+
+    return {
+        "full_resync": False,
+        "seq": entries[-1]['seq'] if entries else since,
+        "has_more": has_more,
+        "changes": changes
+    }
+
+SYNC_PUSH_MAX_OPERATIONS = 1000
+SYNC_OPERATIONS_RETENTION_DAYS = int(os.environ.get('SYNC_OPERATIONS_RETENTION_DAYS', '30'))
+
+# Collections that accept queued offline writes: (model, input model, datetime fields)
+SYNC_PUSH_COLLECTIONS = {
+    'workorders': (WorkOrder, WorkOrderCreate, ['date']),
+    'internalorders': (InternalOrder, InternalOrderCreate, ['date']),
+    'hms_incidents': (HMSIncident, HMSIncidentCreate, ['dato']),
+}
+
+# A key claimed by a push that never stored its result (worker killed mid-request) can be
+# claimed again by a retry after this long
+SYNC_CLAIM_LEASE_SECONDS = int(os.environ.get('SYNC_CLAIM_LEASE_SECONDS', '300'))
+
+async def claim_idempotency_keys(organization_id: str, keys: List[str]) -> set:
+    """Insert keys into sync_operations and return the ones that were already taken.
+
+    A taken key without a result whose lease has run out is claimed again and not returned.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await db.sync_operations.insert_many(
+            [{"organization_id": organization_id, "idempotency_key": key, "result": None, "created_at": now.isoformat(),
+              "claimed_at": now.isoformat()} for key in keys],
+            ordered=False
+        )
+    except BulkWriteError as e:
+        taken = {keys[err['index']] for err in e.details.get('writeErrors', []) if err.get('code') == 11000}
+    else:
+        return set()
+    expired = (now - timedelta(seconds=SYNC_CLAIM_LEASE_SECONDS)).isoformat()
+    for key in list(taken):
+        reclaimed = await db.sync_operations.update_one(
+            {"organization_id": organization_id, "idempotency_key": key, "result": None,
+             "$or": [{"claimed_at": {"$lt": expired}}, {"claimed_at": {"$exists": False}}]},
+            {"$set": {"claimed_at": now.isoformat()}}
+        )
+        if reclaimed.modified_count:
+            taken.discard(key)
+    return taken
+
+async def release_idempotency_keys(organization_id: str, keys: List[str]):
+    """Drop claims that never got a result, so a retry applies the operations"""
+    if keys:
+        await db.sync_operations.delete_many(
+            {"organization_id": organization_id, "idempotency_key": {"$in": keys}, "result": None}
+        )
+
+async def store_push_results(organization_id: str, results: dict, keys: List[str]):
+    if keys:
+        await db.sync_operations.bulk_write([
+            UpdateOne({"organization_id": organization_id, "idempotency_key": key}, {"$set": {"result": results[key]}})
+            for key in keys
+        ], ordered=False)
+
+async def purge_sync_operations() -> int:
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=SYNC_OPERATIONS_RETENTION_DAYS)).isoformat()
+    result = await db.sync_operations.delete_many({"created_at": {"$lt": cutoff}})
+    return result.deleted_count
+
+async def apply_push_writes(collection: str, writes: list, pending: list) -> dict:
+    """Run one collection's writes in order. Returns index -> error fields for the ones not applied.
+
+    A create whose id another push inserted since the lookup fails on the unique id index; it and
+    the later operations on that id are rejected, and the rest of the batch still goes through.
+    """
+    failures = {}
+    remaining = list(range(len(writes)))
+    while remaining:
+        try:
+            await db[collection].bulk_write([writes[index] for index in remaining], ordered=True)
+            break
+        except BulkWriteError as e:
+            # Ordered bulk writes stop at the first error; everything from there on was not applied
+            write_errors = e.details.get('writeErrors') or []
+            position = write_errors[0]['index'] if write_errors else 0
+            rest = remaining[position:]
+            if not write_errors or write_errors[0].get('code') != 11000:
+                logging.error(f"Sync push bulk_write failed on {collection}: {str(e)}")
+                failures.update({index: {"detail": "Write failed"} for index in rest})
+                break
+            taken_id = pending[rest[0]][1]['id']
+            for index in rest:
+                if pending[index][1]['id'] == taken_id:
+                    failures[index] = {"id": taken_id, "detail": "A document with this id already exists"}
+            remaining = [index for index in rest if index not in failures]
+    return failures
+
+@api_router.post("/sync/push")
+async def sync_push(push: SyncPushRequest, current_user: User = Depends(get_current_user)):
+    """Apply a batch of queued offline operations in one round trip.
+
+    Each operation carries a client-generated idempotency key; replaying a key returns the
+    stored result instead of applying the operation again. Writes are grouped into one
+    bulk_write per collection and applied in the order they were sent.
+    """
+    org_id = current_user.organization_id
+    operations = push.operations
+    if len(operations) > SYNC_PUSH_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"Too many operations (max {SYNC_PUSH_MAX_OPERATIONS})")
+    keys = [op.idempotency_key for op in operations]
+    if len(set(keys)) != len(keys):
+        raise HTTPException(status_code=400, detail="Duplicate idempotency_key in batch")
+
+    duplicates = await claim_idempotency_keys(org_id, keys)
+    results = {key: {"idempotency_key": key, "status": "in_progress", "duplicate": True} for key in duplicates}
+    if duplicates:
+        stored = await db.sync_operations.find(
+            {"organization_id": org_id, "idempotency_key": {"$in": list(duplicates)}}, {"_id": 0}
+        ).to_list(None)
+        for entry in stored:
+            if entry['result']:
+                results[entry['idempotency_key']] = {**entry['result'], "duplicate": True}
+
+    fresh = [key for key in keys if key not in duplicates]
+    stored_keys = set()
+    try:
+        # Group fresh operations per collection, keeping client order
+        grouped = {}
+        for op in operations:
+            if op.idempotency_key in duplicates:
+                continue
+            if op.collection not in SYNC_PUSH_COLLECTIONS:
+                results[op.idempotency_key] = {"idempotency_key": op.idempotency_key, "status": "error", "detail": f"Unsupported collection: {op.collection}"}
+                continue
+            grouped.setdefault(op.collection, []).append(op)
+
+        for collection, ops in grouped.items():
+            model, input_model, date_fields = SYNC_PUSH_COLLECTIONS[collection]
+            # Updates and deletes need the document in this organization; a create's client
+            # generated id must not be in use anywhere
+            lookup_ids = [op.id for op in ops if op.id]
+            existing_ids, taken_ids = set(), set()
+            if lookup_ids:
+                existing = await db[collection].find(
+                    {"id": {"$in": lookup_ids}}, {"_id": 0, "id": 1, "organization_id": 1}
+                ).to_list(None)
+                taken_ids = {doc['id'] for doc in existing}
+                existing_ids = {doc['id'] for doc in existing if doc.get('organization_id') == org_id}
+
+            writes = []
+            pending = []  # (op, result) aligned with writes
+            for op in ops:
+                key = op.idempotency_key
+                try:
+                    if op.op == "create":
+                        if op.id and op.id in taken_ids:
+                            results[key] = {"idempotency_key": key, "status": "error", "id": op.id, "detail": "A document with this id already exists"}
+                            continue
+                        item = model(organization_id=org_id, id=op.id or str(uuid.uuid4()), **input_model(**op.data).model_dump())
+                        doc = item.model_dump()
+                        for field in date_fields:
+                            doc[field] = utc_isoformat(doc[field])
+                        doc['created_at'] = doc['created_at'].isoformat()
+                        writes.append(InsertOne(doc))
+                        pending.append((op, {"idempotency_key": key, "status": "created", "id": item.id}))
+                        existing_ids.add(item.id)
+                        taken_ids.add(item.id)
+                    elif op.op == "update":
+                        if op.id not in existing_ids:
+                            results[key] = {"idempotency_key": key, "status": "not_found", "id": op.id}
+                            continue
+                        doc = input_model(**op.data).model_dump()
+                        for field in date_fields:
+                            doc[field] = utc_isoformat(doc[field])
+                        writes.append(UpdateOne({"id": op.id, "organization_id": org_id}, {"$set": doc}))
+                        pending.append((op, {"idempotency_key": key, "status": "updated", "id": op.id}))
+                    elif op.op == "delete":
+                        if op.id not in existing_ids:
+                            results[key] = {"idempotency_key": key, "status": "not_found", "id": op.id}
+                            continue
+                        writes.append(DeleteOne({"id": op.id, "organization_id": org_id}))
+                        pending.append((op, {"idempotency_key": key, "status": "deleted", "id": op.id}))
+                        existing_ids.discard(op.id)
+                    else:
+                        results[key] = {"idempotency_key": key, "status": "error", "detail": f"Unsupported op: {op.op}"}
+                except ValidationError as e:
+                    results[key] = {"idempotency_key": key, "status": "error", "detail": str(e)}
+
+            if not writes:
+                continue
+
+            failures = await apply_push_writes(collection, writes, pending)
+
+            upserted_ids, deleted_ids = [], []
+            for index, (op, result) in enumerate(pending):
+                if index in failures:
+                    result = {"idempotency_key": op.idempotency_key, "status": "error", **failures[index]}
+                elif result['status'] == "deleted":
+                    deleted_ids.append(result['id'])
+                else:
+                    upserted_ids.append(result['id'])
+                results[op.idempotency_key] = result
+            # Applied writes get their results right away, so a failure further on can't
+            # release their keys and have a retry apply them twice
+            applied = [op.idempotency_key for op, _ in pending]
+            await store_push_results(org_id, results, applied)
+            stored_keys.update(applied)
+            if collection in SCHEDULE_COLLECTIONS:
+                # Cheaper to reload the organization's bookings than to replay the batch
+                schedule_index.drop(org_id)
+            await record_changes(org_id, collection, upserted_ids)
+            await record_changes(org_id, collection, deleted_ids, "delete")
+
+        # Store the rest (rejected operations) so replays are answered without re-applying
+        await store_push_results(org_id, results, [key for key in fresh if key not in stored_keys])
+    except BaseException:
+        # Claims without a result go back, so the client's retry applies them instead of
+        # being told "in_progress" until the lease runs out
+        await asyncio.shield(release_idempotency_keys(org_id, [key for key in fresh if key not in stored_keys]))
+        raise
+
+    return {"results": [{"duplicate": False, **results[key]} for key in keys]}
+
+@api_router.post("/sync/compact")
+async def compact_sync_log(current_user: User = Depends(get_current_user)):
+    """Compact the organization's change log now (admin only)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can compact the change log")
+    removed = await compact_change_log(current_user.organization_id)
+    return {"message": "Change log compacted", "removed_count": removed}
+
+# ==================== BOOTSTRAP ENDPOINT ====================
+
+# dataset -> (collection, date field for from/to windows, max documents)
+BOOTSTRAP_COLLECTIONS = {
+    'customers': ('customers', None, 2000),
+    'workorders': ('workorders', 'date', 1000),
+    'internalorders': ('internalorders', 'date', 1000),
+    'products': ('products', None, 1000),
+    'routes': ('routes', 'date', 1000),
+    'payouts': ('payouts', 'date', 1000),
+    'hms_risk_assessments': ('hms_risk_assessments', 'dato', 1000),
+    'hms_incidents': ('hms_incidents', 'dato', 1000),
+    'hms_training': ('hms_training', 'dato', 1000),
+    'hms_equipment': ('hms_equipment', None, 1000),
+}
+BOOTSTRAP_REFERENCE_DATASETS = ['employees', 'services', 'supplier_pricing']
+
+# Datasets each page loads on mount
+BOOTSTRAP_VIEWS = {
+    'results': ['workorders', 'internalorders', 'employees', 'services', 'customers', 'supplier_pricing'],
+    'invoicing': ['workorders', 'customers', 'employees'],
+    'economy': ['employees', 'services', 'supplier_pricing'],
+    'dashboard': ['dashboard_stats', 'workorders', 'customers', 'employees', 'services'],
+    'internal': ['internalorders', 'employees'],
+    'hms': ['hms_risk_assessments', 'hms_incidents', 'hms_training', 'hms_equipment'],
+    'routes': ['routes', 'customers'],
+    'products': ['products'],
+}
+
+for collection in {collection for collection, _, _ in BOOTSTRAP_COLLECTIONS.values()} | set(REFERENCE_COLLECTIONS):
+    invalidation_bus.subscribe(collection, request_coalescer.invalidate)
+
+def parse_bootstrap_fields(fields: Optional[str]) -> dict:
+    """"customers:id,kundnavn;employees:id,initialer" -> {"customers": ["id", "kundnavn"], ...}"""
+    projections = {}
+    if not fields:
+        return projections
+    for part in fields.split(';'):
+        if ':' not in part:
+            raise HTTPException(status_code=400, detail=f"Invalid fields spec: {part}")
+        dataset, names = part.split(':', 1)
+        projections[dataset.strip()] = [name.strip() for name in names.split(',') if name.strip()]
+    return projections
+
+async def load_bootstrap_dataset(dataset: str, current_user: User, fields: Optional[List[str]], date_window: Optional[dict]):
+    if dataset == 'dashboard_stats':
+        return await get_dashboard_stats(current_user)
+
+    if dataset in BOOTSTRAP_REFERENCE_DATASETS:
+        snapshot = await reference_cache.get(current_user.organization_id, dataset)
+        if not fields:
+            return snapshot.docs
+        return [{name: doc[name] for name in fields if name in doc} for doc in snapshot.docs]
+
+    collection, date_field, max_docs = BOOTSTRAP_COLLECTIONS[dataset]
+    query = {"organization_id": current_user.organization_id}
+    if date_field and date_window:
+        query[date_field] = date_window
+    projection = {"_id": 0}
+    if fields:
+        projection.update({name: 1 for name in set(fields) | {"id"}})
+    return await db[collection].find(query, projection).to_list(max_docs)
+
+@api_router.get("/bootstrap")
+async def get_bootstrap(
+    views: str,
+    fields: Optional[str] = None,
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    current_user: User = Depends(get_current_user)
+):
+    """Everything the requested pages load on mount, resolved concurrently in one response.
+
+    views: comma-separated page names (results, invoicing, economy, ...).
+    fields: optional per-dataset projections, e.g. "customers:id,kundnavn;employees:id,initialer".
+    from/to: [from, to) date window applied to dated datasets (work orders, internal orders, ...).
+    Documents are returned as stored, with dates as ISO strings.
+    """
+    datasets = []
+    for view in views.split(','):
+        view = view.strip()
+        if view not in BOOTSTRAP_VIEWS:
+            raise HTTPException(status_code=400, detail=f"Unknown view: {view}")
+        datasets.extend(d for d in BOOTSTRAP_VIEWS[view] if d not in datasets)
+
+    projections = parse_bootstrap_fields(fields)
+    date_window = date_range_filter(date_from, date_to)
+
+    async def load():
+        results = await gather_bounded(*(
+            load_bootstrap_dataset(dataset, current_user, projections.get(dataset), date_window)
+            for dataset in datasets
+        ))
+        return dict(zip(datasets, results))
+
+    # Everything in the response depends only on the organization and these parameters
+    key = (
+        current_user.organization_id, "bootstrap", tuple(sorted(datasets)),
+        tuple(sorted((dataset, tuple(sorted(names))) for dataset, names in projections.items())),
+        tuple(sorted((date_window or {}).items()))
+    )
+    data = await request_coalescer.run(key, load)
+    return {"views": views.split(','), "data": data}
+
+# ==================== CACHE ENDPOINTS ====================
+
+@api_router.get("/cache/stats")
+async def get_cache_stats(current_user: User = Depends(get_current_user)):
+    """In-process cache sizes and hit rates for this worker (admin only)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view cache statistics")
+    return {
+        "reference_data": reference_cache.stats(),
+        "schedule": schedule_index.stats(),
+        "licenses": license_cache.stats(),
+        "invalidation": invalidation_bus.stats(),
+        "admission": admission_controller.stats(),
+        "database_breaker": db_breaker.stats(),
+        "coalescing": request_coalescer.stats()
+    }
+
+@api_router.get("/admin/slow-queries")
+async def get_slow_queries(limit: int = Query(100, ge=1, le=1000), current_user: User = Depends(get_current_user)):
+    """Recent slow MongoDB commands, newest first, with redacted filters (admin only).
+    Includes commands not scoped to any organization, e.g. lookups by id."""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view slow queries")
+    entries = await db.slow_queries.find(
+        {"organization_id": {"$in": [current_user.organization_id, None]}}, {"_id": 0}
+    ).sort("$natural", -1).to_list(limit)
+    return {"threshold_ms": SLOW_QUERY_THRESHOLD_MS, "dropped": slow_query_log.dropped, "entries": entries}
+
+# ==================== PROFILER ====================
+
+PROFILE_MAX_SECONDS = 60
+PROFILE_BACKENDS = {"sampler", "pyinstrument"}
+PROFILE_REQUEST_INTERVAL_SECONDS = 0.001
+
+class StackSampler:
+    """Samples every thread's Python stack with sys._current_frames() from a background thread"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.counts = {}  # collapsed stack -> samples
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self, own: int):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ";".join([names.get(thread_id, str(thread_id))] + stack[::-1])
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            self._sample(own)
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        return "\n".join(f"{stack} {count}" for stack, count in sorted(self.counts.items()))
+
+class PyinstrumentProfile:
+    """Optional backend (pip install pyinstrument). Profiles the event loop thread only, but with
+    async_mode="enabled" attributes awaited time to the coroutine that started it."""
+
+    def __init__(self, interval: float, async_mode: str = "disabled"):
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise HTTPException(status_code=400, detail="pyinstrument is not installed on this server")
+        self._profiler = Profiler(interval=interval, async_mode=async_mode)
+
+    def start(self):
+        self._profiler.start()
+
+    def stop(self) -> str:
+        session = self._profiler.stop()
+        lines = []
+
+        def walk(frame, path):
+            path = path + [f"{frame.function} ({os.path.basename(frame.file_path or '')}:{frame.line_no})"]
+            # Weights are microseconds of self time rather than sample counts
+            self_us = round((frame.time - sum(child.time for child in frame.children)) * 1e6)
+            if self_us > 0:
+                lines.append(f"{';'.join(path)} {self_us}")
+            for child in frame.children:
+                walk(child, path)
+
+        root = session.root_frame()
+        if root is not None:
+            walk(root, [])
+        return "\n".join(lines)
+
+def start_profile(backend: str, interval: float, per_request: bool = False):
+    if backend not in PROFILE_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"backend must be one of: {', '.join(sorted(PROFILE_BACKENDS))}")
+    profile = (
+        PyinstrumentProfile(interval, "enabled" if per_request else "disabled")
+        if backend == "pyinstrument" else StackSampler(interval)
+    )
+    profile.start()
+    return profile
+
+# One profile at a time per worker; sampling overhead adds up
+profile_lock = asyncio.Lock()
+
+def collapsed_response(collapsed: str, label: str) -> PlainTextResponse:
+    filename = f"profile-{label}-{os.getpid()}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}.collapsed"
+    return PlainTextResponse(collapsed + "\n", headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@api_router.post("/admin/profile")
+async def profile_worker(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    backend: str = "sampler",
+    current_user: User = Depends(get_current_user)
+):
+    """Profile the worker that handles this request for `seconds` and return collapsed stacks
+    (one "frame;frame;... count" line per stack, ready for flamegraph.pl or speedscope). Admin only."""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can profile the server")
+    if profile_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running on this worker")
+    async with profile_lock:
+        profile = start_profile(backend, interval_ms / 1000)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            collapsed = profile.stop()
+    return collapsed_response(collapsed, "worker")
+
 # ==================== SEED DATABASE ENDPOINT ====================
 
 @api_router.get("/seed-database")
@@ -1724,16 +4402,18 @@ async def seed_database_endpoint(secret: str):
         # Clean existing data
         collections = ['organizations', 'users', 'customers', 'employees', 'workorders', 'internalorders', 
                       'products', 'routes', 'hms_risk_assessments', 'hms_incidents', 
-                      'hms_training', 'hms_equipment', 'payouts', 'services', 'supplier_pricing']
+                      'hms_training', 'hms_equipment', 'payouts', 'services', 'supplier_pricing',
+                      'changes', 'sync_counters', 'sync_operations', 'usage_counters']
         
-        for collection in collections:
-            await db[collection].delete_many({})
+        await gather_bounded(*(db[collection].delete_many({}) for collection in collections))
+        reference_cache.clear()
+        schedule_index.clear()
         
         # Create organizations
         vmp_org_id = str(uuid.uuid4())
         biovac_org_id = str(uuid.uuid4())
         
-        await db.organizations.insert_many([
+        inserts = [db.organizations.insert_many([
             {
                 "id": vmp_org_id,
                 "name": "VMP",
@@ -1750,11 +4430,13 @@ async def seed_database_endpoint(secret: str):
                 "trial_ends_at": None,
                 "settings": {}
             }
-        ])
+        ])]
         
         # Create users
-        admin_password = get_password_hash("admin123")
-        user_password = get_password_hash("user123")
+        admin_password, user_password = await asyncio.gather(
+            asyncio.to_thread(get_password_hash, "admin123"),
+            asyncio.to_thread(get_password_hash, "user123")
+        )
         
         users = [
             {"id": str(uuid.uuid4()), "email": "admin@vmp.no", "name": "VMP Admin", "organization_id": vmp_org_id, "role": "admin", "password_hash": admin_password, "created_at": datetime.now().isoformat()},
@@ -1767,7 +4449,7 @@ async def seed_database_endpoint(secret: str):
             {"id": str(uuid.uuid4()), "email": "user4@biovac.no", "name": "Biovac User 4", "organization_id": biovac_org_id, "role": "user", "password_hash": user_password, "created_at": datetime.now().isoformat()},
             {"id": str(uuid.uuid4()), "email": "user5@biovac.no", "name": "Biovac User 5", "organization_id": biovac_org_id, "role": "user", "password_hash": user_password, "created_at": datetime.now().isoformat()},
         ]
-        await db.users.insert_many(users)
+        inserts.append(db.users.insert_many(users))
         
         # Create sample data for each organization
         for org_id, org_name in [(vmp_org_id, "VMP"), (biovac_org_id, "Biovac")]:
@@ -1791,7 +4473,7 @@ async def seed_database_endpoint(secret: str):
                     "pa_km_sats": 7.5,
                     "created_at": datetime.now().isoformat()
                 })
-            await db.employees.insert_many(employees)
+            inserts.append(db.employees.insert_many(employees))
             
             # Customers
             customers = []
@@ -1815,7 +4497,7 @@ async def seed_database_endpoint(secret: str):
                     "epost": f"kunde{i+1}@example.no",
                     "created_at": datetime.now().isoformat()
                 })
-            await db.customers.insert_many(customers)
+            inserts.append(db.customers.insert_many(customers))
             
             # Services
             services = [
@@ -1823,7 +4505,7 @@ async def seed_database_endpoint(secret: str):
                 {"id": str(uuid.uuid4()), "organization_id": org_id, "tjenestenr": "T002", "tjeneste_navn": "Premium Service", "pris": 1800.0, "t1_ekstraservice": 1200.0, "t2_ekstraservice_50": 1800.0, "t3_ekstraservice_100": 2400.0, "t4_ekstraarbeid": 1300.0, "t5_kjoretid": 1000.0, "t6_km_godtgjorelse": 8.0, "created_at": datetime.now().isoformat()},
                 {"id": str(uuid.uuid4()), "organization_id": org_id, "tjenestenr": "T003", "tjeneste_navn": "Basic Service", "pris": 800.0, "t1_ekstraservice": 700.0, "t2_ekstraservice_50": 1050.0, "t3_ekstraservice_100": 1400.0, "t4_ekstraarbeid": 750.0, "t5_kjoretid": 600.0, "t6_km_godtgjorelse": 5.0, "created_at": datetime.now().isoformat()}
             ]
-            await db.services.insert_many(services)
+            inserts.append(db.services.insert_many(services))
             
             # Products
             products = []
@@ -1839,7 +4521,10 @@ async def seed_database_endpoint(secret: str):
                     "pa_lager": random.randint(0, 50),
                     "created_at": datetime.now().isoformat()
                 })
-            await db.products.insert_many(products)
+            inserts.append(db.products.insert_many(products))
+        
+        # Documents are built up front, then written concurrently
+        await gather_bounded(*inserts)
         
         return {
             "message": "Database seeded successfully",
@@ -1856,23 +4541,388 @@ async def seed_database_endpoint(secret: str):
 
 # ==================== APP SETUP ====================
 
-@app.get("/")
+@root_router.get("/")
 async def root():
     return {"status": "ok", "message": "Firmanager API is running"}
 
-@app.get("/health")
+@root_router.get("/health")
 async def health():
-    return {"status": "healthy", "database": "connected"}
+    """Liveness: the process is up and serving. Says nothing about the database."""
+    return {"status": "healthy"}
+
+# Readiness thresholds; breaching any of them takes the worker out of the load balancer
+HEALTH_PING_TIMEOUT_MS = float(os.environ.get('HEALTH_PING_TIMEOUT_MS', '1000'))
+HEALTH_MAX_PING_MS = float(os.environ.get('HEALTH_MAX_PING_MS', '250'))
+HEALTH_MAX_CHECKOUT_WAIT_MS = float(os.environ.get('HEALTH_MAX_CHECKOUT_WAIT_MS', '500'))
+HEALTH_MAX_EVENT_LOOP_LAG_MS = float(os.environ.get('HEALTH_MAX_EVENT_LOOP_LAG_MS', '500'))
+# Checkout waits older than this no longer count against readiness
+HEALTH_CHECKOUT_WINDOW_SECONDS = float(os.environ.get('HEALTH_CHECKOUT_WINDOW_SECONDS', '10'))
+# The pool is judged on this percentile of the window's waits, and only once it holds enough
+# samples, so one slow checkout doesn't take the worker out for the whole window
+HEALTH_CHECKOUT_WAIT_PERCENTILE = float(os.environ.get('HEALTH_CHECKOUT_WAIT_PERCENTILE', '0.95'))
+HEALTH_MIN_CHECKOUT_SAMPLES = int(os.environ.get('HEALTH_MIN_CHECKOUT_SAMPLES', '5'))
+# Probes within this interval share one result, so several balancers polling every second cost one ping
+HEALTH_CACHE_SECONDS = float(os.environ.get('HEALTH_CACHE_SECONDS', '1'))
+
+class ReadinessProbe:
+    """Database round trip, pool pressure, event-loop lag and cache state for /health/ready"""
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._result = None
+        self._checked_at = 0.0
+
+    async def check(self, application: FastAPI) -> dict:
+        if self._result is not None and time.monotonic() - self._checked_at < HEALTH_CACHE_SECONDS:
+            return self._result
+        async with self._lock:
+            if self._result is None or time.monotonic() - self._checked_at >= HEALTH_CACHE_SECONDS:
+                self._result = await self._run(application)
+                self._checked_at = time.monotonic()
+        return self._result
+
+    async def _run(self, application: FastAPI) -> dict:
+        database = {"ok": False, "ping_ms": None, "circuit": db_breaker.state}
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(db.command("ping"), HEALTH_PING_TIMEOUT_MS / 1000)
+            database["ping_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            database["ok"] = database["ping_ms"] <= HEALTH_MAX_PING_MS
+        except asyncio.TimeoutError:
+            database["error"] = f"ping timed out after {HEALTH_PING_TIMEOUT_MS:g} ms"
+        except Exception as e:
+            database["error"] = str(e)
+
+        waits = sorted(pool_listener.checkout_waits(HEALTH_CHECKOUT_WINDOW_SECONDS)) if pool_listener else []
+        max_wait_ms = round(waits[-1] * 1000, 2) if waits else 0.0
+        # Nearest rank: the smallest wait at least that share of the samples doesn't exceed
+        percentile_wait_ms = round(waits[max(0, math.ceil(len(waits) * HEALTH_CHECKOUT_WAIT_PERCENTILE) - 1)] * 1000, 2) \
+            if waits else 0.0
+        pool = {
+            "ok": len(waits) < HEALTH_MIN_CHECKOUT_SAMPLES or percentile_wait_ms <= HEALTH_MAX_CHECKOUT_WAIT_MS,
+            "max_size": application.state.settings.max_pool_size,
+            "open": pool_listener.open if pool_listener else None,
+            "checked_out": pool_listener.checked_out if pool_listener else None,
+            "checkout_wait_ms": {
+                "avg": round(sum(waits) / len(waits) * 1000, 2) if waits else 0.0,
+                f"p{HEALTH_CHECKOUT_WAIT_PERCENTILE * 100:g}": percentile_wait_ms,
+                "max": max_wait_ms,
+                "samples": len(waits),
+                "window_s": HEALTH_CHECKOUT_WINDOW_SECONDS
+            }
+        }
+        lag_ms = round(last_event_loop_lag * 1000, 2)
+        event_loop = {"ok": lag_ms <= HEALTH_MAX_EVENT_LOOP_LAG_MS, "lag_ms": lag_ms}
+        caches = {
+            "warm": application.state.caches_warm,
+            "warmed_organizations": application.state.warmed_organizations,
+            "reference_entries": reference_cache.stats().get("entries"),
+            "license_entries": license_cache.stats()["entries"]
+        }
 
-app.include_router(api_router)
+        checks = {"database": database, "pool": pool, "event_loop": event_loop}
+        failing = [name for name, check in checks.items() if not check["ok"]]
+        return {
+            "status": "degraded" if failing else "ready",
+            "failing": failing,
+            "checks": {**checks, "caches": caches}
+        }
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+readiness_probe = ReadinessProbe()
+
+@root_router.get("/health/ready")
+async def health_ready(request: Request):
+    """Readiness: startup has finished, Mongo answers a ping quickly, connections aren't queueing
+    and the event loop isn't blocked. 503 otherwise, so the balancer stops routing here."""
+    if not request.app.state.ready:
+        return JSONResponse({"status": "starting"}, status_code=503)
+    result = await readiness_probe.check(request.app)
+    return JSONResponse(result, status_code=503 if result["failing"] else 200)
+
+async def is_admin_request(scope) -> bool:
+    """Whether the bearer token belongs to an admin; the role is read from the database, since
+    tokens don't carry it"""
+    payload = bearer_claims(scope)
+    if not payload or not payload.get("sub"):
+        return False
+    user = await db.users.find_one({"id": payload["sub"]}, {"_id": 0, "role": 1})
+    return bool(user) and user.get("role") == "admin"
+
+class ProfileRequestMiddleware:
+    """?profile=1 (or ?profile=pyinstrument) returns the request's collapsed-stack profile instead
+    of its response. Only admins are profiled; anyone else's request passes straight through
+    without sampling overhead or taking the profile lock."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or b"profile=" not in scope["query_string"]:
+            return await self.app(scope, receive, send)
+        requested = parse_qs(scope["query_string"].decode()).get("profile", [""])[0]
+        backend = "pyinstrument" if requested == "pyinstrument" else "sampler"
+        if requested not in ("1", "sampler", "pyinstrument") or profile_lock.locked():
+            return await self.app(scope, receive, send)
+        if not await is_admin_request(scope):
+            return await self.app(scope, receive, send)
+
+        async def discard(message):
+            pass
+
+        async with profile_lock:
+            try:
+                profile = start_profile(backend, PROFILE_REQUEST_INTERVAL_SECONDS, per_request=True)
+            except HTTPException:
+                return await self.app(scope, receive, send)
+            try:
+                await self.app(scope, receive, discard)
+            finally:
+                collapsed = profile.stop()
+
+        return await collapsed_response(collapsed, "request")(scope, receive, send)
+
+request_logger = logging.getLogger("firmanager.requests")
+
+class RequestMetricsMiddleware:
+    """Records latency per route template (not raw path, so ids don't explode the label set),
+    adds a Server-Timing header and logs each request's database work"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status_code = 500
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                total_ms = (time.perf_counter() - started) * 1000
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", stats.server_timing(total_ms).encode())
+                ]
+            await send(message)
+
+        http_requests_in_progress.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_progress.dec()
+            request_stats.reset(token)
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            route_path = route.path if route else "unmatched"
+            http_request_duration.labels(scope["method"], route_path, str(status_code)).observe(elapsed)
+            fields = {
+                "method": scope["method"], "route": route_path, "status": status_code,
+                "duration_ms": round(elapsed * 1000, 1), "db_ops": stats.db_ops, "db_docs": stats.db_docs,
+                "db_bytes": stats.db_bytes, "db_ms": round(stats.db_ms, 1),
+                **{f"{name}_ms": round(ms, 1) for name, ms in stats.timings.items()}
+            }
+            if not stats.measures_bytes:
+                del fields["db_bytes"]
+            request_logger.info(" ".join(f"{k}={v}" for k, v in fields.items()), extra={"request": fields})
+            if TEST_MODE and stats.db_ops > REQUEST_DB_OP_BUDGET:
+                message = (f"{scope['method']} {route_path} issued {stats.db_ops} database operations "
+                           f"(budget {REQUEST_DB_OP_BUDGET})")
+                request_logger.warning(message)
+                warnings.warn(message, DbBudgetExceeded)
+
+# ==================== ADMISSION CONTROL ====================
+# Per-organization bulkheads (concurrent requests) and token buckets (request rate), so one
+# tenant's import or search storm can't take the whole Motor pool and event loop. Limits are
+# per worker process. Requests over a limit wait up to the pool's queue timeout, then get 429.
+
+class AdmissionPool:
+    def __init__(self, name: str, concurrency: int, rate_per_second: float, burst: int,
+                 queue_timeout_seconds: float, max_queue: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.max_queue = max_queue
+
+ADMISSION_POOLS = {
+    "default": AdmissionPool(
+        "default",
+        concurrency=int(os.environ.get('ORG_MAX_CONCURRENT_REQUESTS', '20')),
+        rate_per_second=float(os.environ.get('ORG_RATE_LIMIT_PER_SECOND', '50')),
+        burst=int(os.environ.get('ORG_RATE_LIMIT_BURST', '100')),
+        queue_timeout_seconds=float(os.environ.get('ORG_QUEUE_TIMEOUT_SECONDS', '2')),
+        max_queue=int(os.environ.get('ORG_MAX_QUEUED_REQUESTS', '50')),
+    ),
+    "expensive": AdmissionPool(
+        "expensive",
+        concurrency=int(os.environ.get('ORG_MAX_CONCURRENT_EXPENSIVE', '2')),
+        rate_per_second=float(os.environ.get('ORG_EXPENSIVE_RATE_LIMIT_PER_MINUTE', '30')) / 60,
+        burst=int(os.environ.get('ORG_EXPENSIVE_RATE_LIMIT_BURST', '10')),
+        queue_timeout_seconds=float(os.environ.get('ORG_EXPENSIVE_QUEUE_TIMEOUT_SECONDS', '10')),
+        max_queue=int(os.environ.get('ORG_MAX_QUEUED_EXPENSIVE', '5')),
+    ),
+}
+# Imports, bulk writes and maintenance jobs; matched on the raw path since admission runs before routing
+ADMISSION_EXPENSIVE_PATHS = set(os.environ.get('ADMISSION_EXPENSIVE_PATHS', ",".join([
+    "/api/customers/import", "/api/products/import", "/api/economy/services/import", "/api/workorders/bulk",
+    "/api/usage/reconcile", "/api/sync/compact", "/api/admin/profile", "/api/seed-database",
+])).split(','))
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, burst: int):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def reserve(self, max_wait: float) -> tuple:
+        """(True, wait) with a token taken once `wait` seconds have passed, or (False, retry_after)
+        when the next token is further away than max_wait"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        if wait > max_wait:
+            return False, wait
+        # Queued requests take their token now, so later arrivals queue behind them
+        self.tokens -= 1
+        return True, wait
+
+    def refund(self):
+        """Give back a reserved token whose request was turned away after all"""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+class Bulkhead:
+    """At most `limit` requests at a time, with a bounded queue of waiters"""
+
+    def __init__(self, limit: int, max_queue: int):
+        self._semaphore = asyncio.Semaphore(limit)
+        self.max_queue = max_queue
+        self.waiting = 0
+        self.active = 0
+
+    async def acquire(self, timeout: float) -> bool:
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                return False
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout)
+            except asyncio.TimeoutError:
+                return False
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+class AdmissionController:
+    def __init__(self, pools: dict = None):
+        self.pools = pools or ADMISSION_POOLS
+        self._buckets = {}
+        self._bulkheads = {}
+
+    def pool_for(self, path: str) -> AdmissionPool:
+        return self.pools["expensive" if path in ADMISSION_EXPENSIVE_PATHS else "default"]
+
+    async def admit(self, key: str, pool: AdmissionPool) -> tuple:
+        """(bulkhead, None) once admitted, or (None, (reason, retry_after_seconds))"""
+        bucket = self._buckets.get((key, pool.name))
+        if bucket is None:
+            bucket = self._buckets[(key, pool.name)] = TokenBucket(pool.rate_per_second, pool.burst)
+        bulkhead = self._bulkheads.get((key, pool.name))
+        if bulkhead is None:
+            bulkhead = self._bulkheads[(key, pool.name)] = Bulkhead(pool.concurrency, pool.max_queue)
+
+        started = time.monotonic()
+        admitted, wait = bucket.reserve(pool.queue_timeout_seconds)
+        if not admitted:
+            return None, ("rate", wait)
+        try:
+            if wait:
+                await asyncio.sleep(wait)
+            acquired = await bulkhead.acquire(pool.queue_timeout_seconds - (time.monotonic() - started))
+        except asyncio.CancelledError:
+            bucket.refund()
+            raise
+        if not acquired:
+            # A request rejected for concurrency shouldn't also use up the organization's rate
+            bucket.refund()
+            return None, ("concurrency", 1.0)
+        admission_queue_wait.labels(pool.name).observe(time.monotonic() - started)
+        return bulkhead, None
+
+    def stats(self) -> dict:
+        return {
+            f"{key}:{pool}": {"active": bulkhead.active, "waiting": bulkhead.waiting}
+            for (key, pool), bulkhead in self._bulkheads.items() if bulkhead.active or bulkhead.waiting
+        }
+
+admission_controller = AdmissionController()
+
+def bearer_claims(scope) -> Optional[dict]:
+    """Claims of a valid bearer token, for middleware that runs before get_current_user"""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer":
+                return None
+            try:
+                return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            except jwt.PyJWTError:
+                return None
+    return None
+
+def admission_key(scope) -> Optional[str]:
+    """Organization from the bearer token (user for tokens issued before the org claim).
+    Anonymous or invalid tokens aren't limited here; the endpoint rejects them."""
+    payload = bearer_claims(scope)
+    if payload is None:
+        return None
+    if payload.get("org"):
+        return f"org:{payload['org']}"
+    return f"user:{payload['sub']}" if payload.get("sub") else None
+
+class AdmissionControlMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        key = admission_key(scope)
+        if key is None:
+            return await self.app(scope, receive, send)
+
+        pool = admission_controller.pool_for(scope["path"])
+        bulkhead, rejection = await admission_controller.admit(key, pool)
+        if bulkhead is None:
+            reason, retry_after = rejection
+            admission_rejections_total.labels(pool.name, reason).inc()
+            logger.warning(f"Admission rejected {scope['method']} {scope['path']} for {key}: {reason} limit ({pool.name})")
+            response = JSONResponse(
+                {"detail": f"Too many {'concurrent ' if reason == 'concurrency' else ''}requests for this organization, retry later"},
+                status_code=429, headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+            return await response(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            bulkhead.release()
+
+@root_router.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(generate_latest(scrape_registry), media_type=CONTENT_TYPE_LATEST)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -1880,6 +4930,214 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+async def ensure_indexes():
+    try:
+        await db.create_collection(
+            "slow_queries", capped=True, size=SLOW_QUERY_LOG_MAX_ENTRIES * 4096, max=SLOW_QUERY_LOG_MAX_ENTRIES
+        )
+    except CollectionInvalid:
+        pass  # Already there
+    await db.changes.create_index([("organization_id", 1), ("seq", 1)], unique=True)
+    await db.changes.create_index("ts")
+    await db.sync_counters.create_index("organization_id", unique=True)
+    await db.sync_operations.create_index([("organization_id", 1), ("idempotency_key", 1)], unique=True)
+    await db.cache_versions.create_index([("organization_id", 1), ("collection", 1)], unique=True)
+    await db.cache_versions.create_index("updated_at")
+    await db.licenses.create_index([("organization_id", 1), ("status", 1)])
+    await db.licenses.create_index([("status", 1), ("expires_at", 1)])
+    await db.licenses.create_index("license_key")
+    await db.usage_counters.create_index("organization_id", unique=True)
+    await db.customers.create_index("id")
+    await db.products.create_index("image_url")
+    # Offline clients pick the ids of what they create, so the database has to refuse a reused one
+    for collection in SYNC_PUSH_COLLECTIONS:
+        await ensure_unique_id_index(collection)
+    await db.workorders.create_index([("organization_id", 1), ("date", 1)])
+    await db.workorders.create_index([("organization_id", 1), ("employee_id", 1), ("date", 1)])
+    await db.internalorders.create_index([("organization_id", 1), ("date", 1)])
+    await db.internalorders.create_index([("organization_id", 1), ("employee_id", 1), ("date", 1)])
+    fixed = await normalize_stored_dates()
+    if fixed:
+        logger.info(f"Normalized {fixed} stored dates to UTC")
+
+async def ensure_unique_id_index(collection: str):
+    """Replaces a non-unique id index, renaming duplicate ids first so the unique one can be built"""
+    index = (await db[collection].index_information()).get("id_1")
+    if index and index.get("unique"):
+        return
+    await dedupe_ids(collection)
+    if index:
+        try:
+            await db[collection].drop_index("id_1")
+        except OperationFailure:
+            pass  # Another worker dropped it first
+    await db[collection].create_index("id", unique=True)
+
+async def dedupe_ids(collection: str) -> int:
+    """Give every document but the oldest of each duplicated id a new id. Returns how many changed."""
+    duplicates = await db[collection].aggregate([
+        {"$group": {"_id": "$id", "docs": {"$push": {"_id": "$_id", "organization_id": "$organization_id"}},
+                    "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]).to_list(None)
+    renamed = 0
+    for duplicate in duplicates:
+        for doc in sorted(duplicate['docs'], key=lambda doc: doc['_id'])[1:]:
+            new_id = str(uuid.uuid4())
+            await db[collection].update_one({"_id": doc['_id']}, {"$set": {"id": new_id}})
+            # Synced clients fetch it under the new id
+            await record_change(doc['organization_id'], collection, new_id)
+            logger.warning(f"Renamed duplicate {collection} id {duplicate['_id']} to {new_id}")
+            renamed += 1
+    return renamed
+
+NORMALIZE_DATES_BATCH = 1000
+
+async def normalize_stored_dates() -> int:
+    """Rewrite the date fields date_range_filter queries to UTC ISO strings.
+
+    Internal orders edited through PUT used to be saved with a BSON datetime, and other writes
+    kept whatever offset the client sent; neither compares correctly against the string bounds.
+    """
+    fixed = 0
+    for collection, field, _ in BOOTSTRAP_COLLECTIONS.values():
+        if field is None:
+            continue
+        query = {"$or": [
+            {field: {"$type": "date"}},
+            {field: {"$type": "string", "$not": {"$regex": r"\+00:00$"}}},
+        ]}
+        writes = []
+        async for doc in db[collection].find(query, {"_id": 1, field: 1}):
+            try:
+                value = utc_isoformat(doc[field])
+            except ValueError:
+                logger.warning(f"Unparseable {collection}.{field} {doc[field]!r} on {doc['_id']}")
+                continue
+            writes.append(UpdateOne({"_id": doc['_id']}, {"$set": {field: value}}))
+            if len(writes) >= NORMALIZE_DATES_BATCH:
+                await db[collection].bulk_write(writes, ordered=False)
+                fixed += len(writes)
+                writes = []
+        if writes:
+            await db[collection].bulk_write(writes, ordered=False)
+            fixed += len(writes)
+    return fixed
+
+CHANGE_LOG_COMPACT_INTERVAL_SECONDS = int(os.environ.get('CHANGE_LOG_COMPACT_INTERVAL_SECONDS', str(6 * 3600)))
+background_tasks = []
+EVENT_LOOP_LAG_INTERVAL_SECONDS = float(os.environ.get('EVENT_LOOP_LAG_INTERVAL_SECONDS', '0.5'))
+
+last_event_loop_lag = 0.0
+
+async def event_loop_lag_monitor():
+    """A blocked loop wakes this task late; the overshoot is the lag every request sees"""
+    global last_event_loop_lag
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL_SECONDS)
+        last_event_loop_lag = max(0.0, loop.time() - started - EVENT_LOOP_LAG_INTERVAL_SECONDS)
+        event_loop_lag.observe(last_event_loop_lag)
+
+async def change_log_compactor():
+    while True:
+        try:
+            removed = await compact_change_log()
+            if removed:
+                logger.info(f"Compacted change log: removed {removed} entries")
+            await purge_sync_operations()
+            removed_images = await purge_product_images()
+            if removed_images:
+                logger.info(f"Deleted {removed_images} unused product images")
+        except Exception as e:
+            logger.error(f"Change log compaction failed: {str(e)}")
+        await asyncio.sleep(CHANGE_LOG_COMPACT_INTERVAL_SECONDS)
+
+async def warm_caches(limit: int):
+    """Load reference data and licenses for the most recently active organizations, so the
+    first requests after a deploy don't all miss at once"""
+    versions = await db.cache_versions.find({}, {"_id": 0, "organization_id": 1}).sort("updated_at", -1).to_list(limit * 10)
+    organization_ids = list(dict.fromkeys(v['organization_id'] for v in versions if v.get('organization_id')))[:limit]
+    if len(organization_ids) < limit:
+        organizations = await db.organizations.find({}, {"_id": 0, "id": 1}).to_list(limit)
+        organization_ids = list(dict.fromkeys(organization_ids + [o['id'] for o in organizations]))[:limit]
+    await gather_bounded(*(
+        reference_cache.get(organization_id, collection)
+        for organization_id in organization_ids for collection in REFERENCE_COLLECTIONS
+    ), *(license_cache.get_active(organization_id) for organization_id in organization_ids))
+    return len(organization_ids)
+
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    settings = application.state.settings
+    await ensure_indexes()
+    slow_query_log.attach(asyncio.get_running_loop())
+    background_tasks.append(asyncio.create_task(slow_query_log.run()))
+    background_tasks.append(asyncio.create_task(change_log_compactor()))
+    background_tasks.append(asyncio.create_task(invalidation_bus.run()))
+    background_tasks.append(asyncio.create_task(license_expiry_sweeper()))
+    background_tasks.append(asyncio.create_task(usage_reconciler()))
+    background_tasks.append(asyncio.create_task(event_loop_lag_monitor()))
+    if WARM_HEAVY_IMPORTS:
+        background_tasks.append(asyncio.create_task(asyncio.to_thread(import_heavy_modules)))
+    if settings.warm_cache_organizations:
+        try:
+            application.state.warmed_organizations = await warm_caches(settings.warm_cache_organizations)
+            application.state.caches_warm = True
+            logger.info(f"Warmed caches for {application.state.warmed_organizations} organizations")
+        except Exception as e:
+            logger.error(f"Cache warm-up failed: {str(e)}")
+    application.state.ready = True
+    try:
+        yield
+    finally:
+        application.state.ready = False
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        background_tasks.clear()
+        shutdown_image_pool()
+        client.close()
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """Build the ASGI app. Run one per worker process, e.g.
+    gunicorn -k uvicorn.workers.UvicornWorker -w 4 'server:create_app()'"""
+    settings = settings or Settings.from_env()
+    configure_database(settings)
+
+    application = FastAPI(lifespan=lifespan)
+    application.state.settings = settings
+    application.state.ready = False
+    application.state.caches_warm = False
+    application.state.warmed_organizations = 0
+    application.include_router(root_router)
+    application.include_router(api_router)
+
+    application.add_middleware(ProfileRequestMiddleware)
+    # Compress larger responses (list endpoints, bootstrap payloads)
+    application.add_middleware(GZipMiddleware, minimum_size=1000)
+    # Inside CORS, so browsers can read the 429s and their Retry-After
+    application.add_middleware(AdmissionControlMiddleware)
+    application.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=settings.cors_origins,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    # Outermost, so the timings include compression and CORS handling
+    application.add_middleware(RequestMetricsMiddleware)
+    for exc_class in (ConnectionFailure, ExecutionTimeout, WTimeoutError):
+        application.add_exception_handler(exc_class, database_error_handler)
+    return application
+
+def __getattr__(name):
+    """Default app for `uvicorn server:app`, configured from the environment. Built on first
+    access rather than at import, so `gunicorn 'server:create_app()'` builds only its own app
+    and database client per worker."""
+    if name == "app":
+        application = create_app()
+        globals()["app"] = application
+        return application
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,14 +1,12 @@
 import React, { useState, useEffect, useRef } from 'react';
 import {
-  getEmployees,
+  getBootstrap,
   createEmployee,
   updateEmployee,
   deleteEmployee,
-  getServices,
   createService,
   updateService,
   deleteService,
-  getSupplierPricing,
   createSupplierPricing,
   updateSupplierPricing,
   deleteSupplierPricing
@@ -75,14 +73,10 @@ const Economy = () => {
 
   const loadData = async () => {
     try {
-      const [empRes, servicesRes, pricingRes] = await Promise.all([
-        getEmployees(),
-        getServices(),
-        getSupplierPricing()
-      ]);
-      setEmployees(empRes.data);
-      setServices(servicesRes.data);
-      setSupplierPricing(pricingRes.data);
+      const { data } = (await getBootstrap('economy')).data;
+      setEmployees(data.employees);
+      setServices(data.services);
+      setSupplierPricing(data.supplier_pricing);
     } catch (error) {
       console.error('Failed to load economy data:', error);
     } finally {
@@ -1,10 +1,11 @@
-import React, { useState, useEffect } from 'react';
-import { getWorkOrders, createWorkOrder, updateWorkOrder, deleteWorkOrder, getCustomers, getEmployees, getServicePricingForCustomer } from '../services/api';
+import React, { useState, useEffect, useRef } from 'react';
+import { getWorkOrders, createWorkOrder, updateWorkOrder, deleteWorkOrder, getEmployees, getServicePricingForCustomer } from '../services/api';
 import { Plus, Edit, Trash2, Filter, Info, CheckSquare, Square } from 'lucide-react';
 
 const Invoicing = () => {
   const [workOrders, setWorkOrders] = useState([]);
-  const [customers, setCustomers] = useState([]);
+  const [currentCustomer, setCurrentCustomer] = useState(null);
+  const latestAnleggsnr = useRef('');
   const [employees, setEmployees] = useState([]);
   const [loading, setLoading] = useState(true);
   const [showModal, setShowModal] = useState(false);
@@ -30,16 +31,15 @@ const Invoicing = () => {
 
   const loadData = async () => {
     try {
-      const params = {};
+      // Customer and employee names come embedded in each order
+      const params = { expand: 'customer,employee' };
       if (filterOrderType) params.order_type = filterOrderType;
 
-      const [ordersRes, customersRes, employeesRes] = await Promise.all([
+      const [ordersRes, employeesRes] = await Promise.all([
         getWorkOrders(params),
-        getCustomers(),
         getEmployees()
       ]);
       setWorkOrders(ordersRes.data);
-      setCustomers(customersRes.data);
       setEmployees(employeesRes.data);
     } catch (error) {
       console.error('Failed to load data:', error);
@@ -51,24 +51,28 @@ const Invoicing = () => {
   const handleAnleggsnrChange = async (anleggsnr) => {
     setFormData(prev => ({ ...prev, anleggsnr }));
     setServicePricing(null);
+    latestAnleggsnr.current = anleggsnr;
     
-    // Auto-identify customer by anleggsnr
-    const customer = customers.find(c => c.anleggsnr === anleggsnr);
-    if (customer) {
-      setFormData(prev => ({ ...prev, customer_id: customer.id }));
-      
-      // Fetch service pricing for this customer
+    // Auto-identify customer by anleggsnr; the service pricing lookup returns the customer too
+    let customer = null;
+    let service = null;
+    if (anleggsnr) {
       try {
         const response = await getServicePricingForCustomer(anleggsnr);
-        if (response.data.service) {
-          setServicePricing(response.data.service);
-        }
+        customer = response.data.customer;
+        service = response.data.service;
       } catch (error) {
-        console.error('Failed to fetch service pricing:', error);
+        if (error.response?.status !== 404) {
+          console.error('Failed to fetch service pricing:', error);
+        }
       }
-    } else {
-      setFormData(prev => ({ ...prev, customer_id: '' }));
     }
+    
+    // Ignore answers for numbers the user has already typed past
+    if (latestAnleggsnr.current !== anleggsnr) return;
+    setCurrentCustomer(customer);
+    setServicePricing(service);
+    setFormData(prev => ({ ...prev, customer_id: customer ? customer.id : '' }));
   };
 
   const handleSubmit = async (e) => {
@@ -99,6 +103,9 @@ const Invoicing = () => {
       } else {
         await createWorkOrder(submitData);
         // Keep modal open and reset form for next entry
+        setCurrentCustomer(null);
+        setServicePricing(null);
+        latestAnleggsnr.current = '';
         setFormData({
           anleggsnr: '',
           customer_id: '',
@@ -120,8 +127,11 @@ const Invoicing = () => {
   };
 
   const handleEdit = (order) => {
-    const customer = customers.find(c => c.id === order.customer_id);
+    const customer = order.customer;
     setEditingOrder(order);
+    setCurrentCustomer(customer);
+    setServicePricing(null);
+    latestAnleggsnr.current = customer?.anleggsnr || '';
     setFormData({
       anleggsnr: customer?.anleggsnr || '',
       customer_id: order.customer_id,
@@ -183,6 +193,9 @@ const Invoicing = () => {
   };
 
   const resetForm = () => {
+    setCurrentCustomer(null);
+    setServicePricing(null);
+    latestAnleggsnr.current = '';
     setFormData({
       anleggsnr: '',
       customer_id: '',
@@ -208,18 +221,16 @@ const Invoicing = () => {
     resetForm();
   };
 
-  const getCustomerName = (id) => {
-    const customer = customers.find(c => c.id === id);
-    return customer?.kundnavn || '-';
+  const getCustomerName = (order) => {
+    return order.customer?.kundnavn || '-';
   };
 
-  const getEmployeeName = (id) => {
-    const employee = employees.find(e => e.id === id);
-    return employee?.navn || '-';
+  const getEmployeeName = (order) => {
+    return order.employee?.navn || '-';
   };
 
   const getCurrentCustomer = () => {
-    return customers.find(c => c.id === formData.customer_id);
+    return currentCustomer;
   };
 
   return (
@@ -321,8 +332,8 @@ const Invoicing = () => {
                       </button>
                     </td>
                     <td className="px-4 py-2 text-sm">{new Date(order.date).toLocaleDateString('no-NO')}</td>
-                    <td className="px-4 py-2 text-sm">{getCustomerName(order.customer_id)}</td>
-                    <td className="px-4 py-2 text-sm">{getEmployeeName(order.employee_id)}</td>
+                    <td className="px-4 py-2 text-sm">{getCustomerName(order)}</td>
+                    <td className="px-4 py-2 text-sm">{getEmployeeName(order)}</td>
                     <td className="px-4 py-2 text-sm capitalize">{order.order_type}</td>
                     <td className="px-4 py-2 text-sm">{order.arbeidstid}h</td>
                     <td className="px-4 py-2 text-sm">{order.kjoretid}h</td>
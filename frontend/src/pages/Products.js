@@ -6,6 +6,12 @@ import { canAddMore } from '../services/licenseService';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL;
 
+// Uploaded images are served in several sizes; external URLs are used as they are
+const imageSrc = (url, size) => {
+  if (url.startsWith('/api/images/')) return `${API_URL}${url}?size=${size}`;
+  return url.startsWith('/') ? `${API_URL}${url}` : url;
+};
+
 const Products = () => {
   const [products, setProducts] = useState([]);
   const [loading, setLoading] = useState(true);
@@ -335,7 +341,7 @@ const Products = () => {
                   <td className="p-4">
                     {product.image_url ? (
                       <img 
-                        src={product.image_url.startsWith('http') ? product.image_url : `${process.env.REACT_APP_BACKEND_URL}${product.image_url}`} 
+                        src={imageSrc(product.image_url, 'thumb')}
                         alt={product.navn}
                         className="w-12 h-12 object-cover rounded"
                       />
@@ -467,7 +473,7 @@ const Products = () => {
                   {formData.image_url && (
                     <div className="mt-2">
                       <img 
-                        src={formData.image_url.startsWith('/api') ? `${process.env.REACT_APP_BACKEND_URL}${formData.image_url}` : formData.image_url}
+                        src={imageSrc(formData.image_url, 'thumb')}
                         alt="Preview"
                         className="w-24 h-24 object-cover rounded border border-gray-300"
                         onError={(e) => e.target.style.display = 'none'}
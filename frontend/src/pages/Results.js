@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import { getWorkOrders, getEmployees, getInternalOrders, getServices, getCustomers, getSupplierPricing } from '../services/api';
+import { getBootstrap } from '../services/api';
 import { TrendingUp, DollarSign, Users, Briefcase, Building2 } from 'lucide-react';
 
 const Results = () => {
@@ -15,24 +15,29 @@ const Results = () => {
 
   useEffect(() => {
     loadData();
-  }, []);
+  }, [selectedMonth]);
+
+  // [from, to) window covering the selected month
+  const monthRange = (month) => {
+    const [year, monthIndex] = month.split('-').map(Number);
+    const next = new Date(Date.UTC(year, monthIndex, 1)).toISOString().slice(0, 10);
+    return { from: `${month}-01`, to: next };
+  };
 
   const loadData = async () => {
     try {
-      const [ordersRes, internalRes, employeesRes, servicesRes, customersRes, pricingRes] = await Promise.all([
-        getWorkOrders(),
-        getInternalOrders(),
-        getEmployees(),
-        getServices(),
-        getCustomers(),
-        getSupplierPricing()
-      ]);
-      setWorkOrders(ordersRes.data);
-      setInternalOrders(internalRes.data);
-      setEmployees(employeesRes.data);
-      setServices(servicesRes.data);
-      setCustomers(customersRes.data);
-      setSupplierPricing(pricingRes.data);
+      // Customers are only needed to resolve the service type of each order;
+      // orders are filtered to the selected month by the server
+      const { data } = (await getBootstrap('results', {
+        fields: 'customers:id,typenr,tjeneste_nr',
+        ...monthRange(selectedMonth)
+      })).data;
+      setWorkOrders(data.workorders);
+      setInternalOrders(data.internalorders);
+      setEmployees(data.employees);
+      setServices(data.services);
+      setCustomers(data.customers);
+      setSupplierPricing(data.supplier_pricing);
     } catch (error) {
       console.error('Failed to load data:', error);
     } finally {
@@ -40,14 +45,6 @@ const Results = () => {
     }
   };
 
-  // Filter orders by selected month
-  const filterByMonth = (orders, dateField = 'date') => {
-    return orders.filter(order => {
-      const orderDate = new Date(order[dateField]).toISOString().slice(0, 7);
-      return orderDate === selectedMonth;
-    });
-  };
-
   // Get supplier pricing for a specific service (via produsent_id)
   const getSupplierRatesForService = (service) => {
     if (!service || !service.produsent_id) {
@@ -105,7 +102,7 @@ const Results = () => {
       };
     });
 
-    const monthInternalOrders = filterByMonth(internalOrders);
+    const monthInternalOrders = internalOrders;
     monthInternalOrders.forEach(order => {
       if (results[order.employee_id]) {
         const employee = employees.find(e => e.id === order.employee_id);
@@ -147,7 +144,7 @@ const Results = () => {
       };
     });
 
-    const monthWorkOrders = filterByMonth(workOrders);
+    const monthWorkOrders = workOrders;
     monthWorkOrders.forEach(order => {
       if (order.status === 'fullført' && results[order.employee_id]) {
         const employee = employees.find(e => e.id === order.employee_id);
@@ -210,7 +207,7 @@ const Results = () => {
       by_produsent: {}
     };
 
-    const monthWorkOrders = filterByMonth(workOrders);
+    const monthWorkOrders = workOrders;
     monthWorkOrders.forEach(order => {
       if (order.status !== 'fullført') return;
 
@@ -37,14 +37,20 @@ export const updateEmployee = (id, data) =>
 export const deleteEmployee = (id) => 
   axios.delete(`${API}/employees/${id}`, { headers: getAuthHeaders() });
 
+export const getEmployeeAvailability = (id, params = {}) => 
+  axios.get(`${API}/employees/${id}/availability`, { params, headers: getAuthHeaders() });
+
 // Work Orders
 export const getWorkOrders = (params = {}) => {
   const query = new URLSearchParams(params).toString();
   return axios.get(`${API}/workorders${query ? `?${query}` : ''}`, { headers: getAuthHeaders() });
 };
 
-export const createWorkOrder = (data) => 
-  axios.post(`${API}/workorders`, data, { headers: getAuthHeaders() });
+export const createWorkOrder = (data, params = {}) => 
+  axios.post(`${API}/workorders`, data, { params, headers: getAuthHeaders() });
+
+export const createWorkOrdersBulk = (orders, params = {}) => 
+  axios.post(`${API}/workorders/bulk`, orders, { params, headers: getAuthHeaders() });
 
 export const updateWorkOrder = (id, data) => 
   axios.put(`${API}/workorders/${id}`, data, { headers: getAuthHeaders() });
@@ -151,3 +157,24 @@ export const getServicePricingForCustomer = (anleggsnr) =>
 // Dashboard
 export const getDashboardStats = () => 
   axios.get(`${API}/dashboard/stats`, { headers: getAuthHeaders() });
+
+// Offline sync
+export const getSyncChanges = (since = 0) => 
+  axios.get(`${API}/sync?since=${since}`, { headers: getAuthHeaders() });
+
+export const pushSyncOperations = (operations) => 
+  axios.post(`${API}/sync/push`, { operations }, { headers: getAuthHeaders() });
+
+// Subscription usage
+export const getUsage = () => 
+  axios.get(`${API}/usage`, { headers: getAuthHeaders() });
+
+// Weekly calendar of orders per employee (week as 2026-W02)
+export const getCalendar = (week, params = {}) => 
+  axios.get(`${API}/calendar`, { params: { week, ...params }, headers: getAuthHeaders() });
+
+// Page bootstrap: all datasets a page needs in one request
+export const getBootstrap = (views, params = {}) => {
+  const query = new URLSearchParams({ views, ...params }).toString();
+  return axios.get(`${API}/bootstrap?${query}`, { headers: getAuthHeaders() });
+};
@@ -0,0 +1,135 @@
+"""
+Shared setup for the in-process benchmark suite.
+
+Runs server.py handlers directly against either a real MongoDB (BENCH_MONGO_URL) or a
+mongomock-motor stand-in. The stand-in answers instantly, so every database call is
+delayed by BENCH_SIMULATED_RTT_MS to make round-trip counts visible in the timings.
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent.parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+# server.py reads these at import time
+os.environ.setdefault('MONGO_URL', os.environ.get('BENCH_MONGO_URL', 'mongodb://localhost:27017'))
+os.environ.setdefault('DB_NAME', 'firmanager_bench')
+
+import server  # noqa: E402
+
+# The default app is built on first access and configures server.db; build it now so the
+# database installed by use_database() isn't replaced when a benchmark first touches server.app
+server.app
+
+BENCH_MONGO_URL = os.environ.get('BENCH_MONGO_URL')
+SIMULATED_RTT_MS = float(os.environ.get('BENCH_SIMULATED_RTT_MS', '2'))
+
+
+class LatencyCursor:
+    """Cursor proxy that charges one round trip per fetch"""
+
+    def __init__(self, cursor, delay):
+        self._cursor = cursor
+        self._delay = delay
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name in ('sort', 'skip', 'limit', 'batch_size', 'max_time_ms', 'hint'):
+            def chained(*args, **kwargs):
+                attr(*args, **kwargs)
+                return self
+            return chained
+        return attr
+
+    async def to_list(self, length=None):
+        await asyncio.sleep(self._delay)
+        return await self._cursor.to_list(length)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await asyncio.sleep(self._delay)
+        async for doc in self._cursor:
+            yield doc
+
+
+class LatencyCollection:
+    """Collection proxy that delays every awaited operation by the simulated round trip"""
+
+    def __init__(self, collection, delay):
+        self._collection = collection
+        self._delay = delay
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in ('find', 'aggregate'):
+            return lambda *args, **kwargs: LatencyCursor(attr(*args, **kwargs), self._delay)
+        if not callable(attr):
+            return attr
+
+        async def delayed(*args, **kwargs):
+            await asyncio.sleep(self._delay)
+            return await attr(*args, **kwargs)
+        return delayed
+
+
+class LatencyDatabase:
+    def __init__(self, database, delay):
+        self._database = database
+        self._delay = delay
+
+    def __getitem__(self, name):
+        return LatencyCollection(self._database[name], self._delay)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+
+def make_database(name=None):
+    """A fresh benchmark database; install it with use_database()"""
+    name = name or f"bench_{uuid.uuid4().hex[:8]}"
+    if BENCH_MONGO_URL:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient(BENCH_MONGO_URL)[name]
+    from mongomock_motor import AsyncMongoMockClient
+    return LatencyDatabase(AsyncMongoMockClient()[name], SIMULATED_RTT_MS / 1000)
+
+
+def use_database(database):
+    server.db = database
+    server.reference_cache = server.ReferenceDataCache()
+    server.license_cache = server.LicenseCache()
+    server.schedule_index = server.ScheduleIndex()
+    server.request_coalescer.invalidate(None)
+
+
+def summarize(samples):
+    """Latency percentiles in milliseconds for a list of durations in seconds"""
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 3)
+
+    return {
+        "runs": len(samples),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "mean_ms": round(statistics.mean(samples) * 1000, 3),
+    }
+
+
+async def time_async(func, runs=20):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
@@ -0,0 +1,263 @@
+"""
+In-process load test: drives server.app through httpx's ASGI transport with concurrent
+scenarios and reports latency percentiles and throughput per endpoint.
+
+Scale and concurrency come from the environment (or the command line flags):
+    BENCH_TENANTS                 organizations to seed (default 2)
+    BENCH_CUSTOMERS_PER_TENANT    default 1000
+    BENCH_WORKORDERS_PER_TENANT   default 5000
+    BENCH_CONCURRENCY             virtual users per scenario (default 10)
+    BENCH_RESULTS_PATH            where to write the JSON results (optional)
+
+Run with: python -m tests.benchmarks.load --out bench.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+
+import httpx
+import pandas as pd
+
+from tests.benchmarks.harness import server, make_database, use_database, summarize, BENCH_MONGO_URL, SIMULATED_RTT_MS
+import seed_data  # noqa: E402  (backend/ is on sys.path once the harness is imported)
+
+SEED = 20240601
+BATCH_SIZE = 1000
+PASSWORD = "bench"
+# Characters typed into the customer search box, one request per keystroke
+SEARCH_TERMS = ["Oslo Borettslag", "Bergen", "Trondheim", "5003"]
+POSTSTEDER = [("0150", "Oslo"), ("5003", "Bergen"), ("7010", "Trondheim"), ("4010", "Stavanger"), ("9008", "Tromsø")]
+
+
+def scale_from_env():
+    return {
+        "tenants": int(os.environ.get('BENCH_TENANTS', '2')),
+        "customers": int(os.environ.get('BENCH_CUSTOMERS_PER_TENANT', '1000')),
+        "workorders": int(os.environ.get('BENCH_WORKORDERS_PER_TENANT', '5000')),
+        "concurrency": int(os.environ.get('BENCH_CONCURRENCY', '10')),
+    }
+
+
+class Recorder:
+    """Collects (endpoint, duration, status) for one scenario"""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    async def request(self, client, label, method, url, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.samples.setdefault(label, []).append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[label] = self.errors.get(label, 0) + 1
+        return response
+
+    def report(self, wall_seconds):
+        endpoints = {}
+        for label, samples in sorted(self.samples.items()):
+            endpoints[label] = {
+                **summarize(samples),
+                "throughput_rps": round(len(samples) / wall_seconds, 2) if wall_seconds else None,
+                "errors": self.errors.get(label, 0),
+            }
+        return {"wall_s": round(wall_seconds, 3), "endpoints": endpoints}
+
+
+def customer_rows(rng, count):
+    rows = []
+    for i in range(count):
+        postnr, poststed = rng.choice(POSTSTEDER)
+        rows.append({
+            "anleggsnr": str(100000 + i),
+            "kundennr": str(5000 + i),
+            "kundnavn": f"Kunde {i}",
+            "typenr": rng.choice(["T001", "T002", "T003"]),
+            "kommune": poststed,
+            "adresse": f"Gate {rng.randint(1, 200)}",
+            "postnr": postnr,
+            "poststed": poststed,
+            "uke": str(rng.randint(1, 52)),
+        })
+    return rows
+
+
+async def seed_tenant(client, index, scale, rng):
+    """Register an organization through the API and bulk insert generated data (see seed_data.py)"""
+    email = f"bench{index}-{uuid.uuid4().hex[:6]}@bench.no"
+    response = await client.post("/api/auth/register", json={
+        "email": email, "password": PASSWORD, "name": f"Bench {index}", "organization_name": f"Bench Org {index}"
+    })
+    response.raise_for_status()
+    org_id = response.json()["organization"]["id"]
+    anleggsnr = await seed_data.seed_volume_organization(
+        server.db, org_id, f"Bench{index}", customers=scale["customers"], workorders=scale["workorders"],
+        years=2, seed=rng.randrange(2 ** 32), batch_size=BATCH_SIZE
+    )
+    await server.reconcile_usage(org_id)
+    return {"email": email, "organization_id": org_id, "anleggsnr": anleggsnr}
+
+
+async def login(client, tenant):
+    response = await client.post("/api/auth/login", json={"email": tenant["email"], "password": PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+# ---------- scenarios: (client, tenants, headers, recorder, concurrency, rng) ----------
+
+async def login_burst(client, tenants, headers, recorder, concurrency, rng):
+    """Everyone logs in at 08:00"""
+    await asyncio.gather(*(
+        recorder.request(client, "POST /api/auth/login", "POST", "/api/auth/login",
+                         json={"email": tenants[i % len(tenants)]["email"], "password": PASSWORD})
+        for i in range(concurrency)
+    ))
+
+
+async def customer_search(client, tenants, headers, recorder, concurrency, rng):
+    """Each user types a search term, one request per keystroke"""
+    async def user(i):
+        term = SEARCH_TERMS[i % len(SEARCH_TERMS)]
+        for length in range(1, len(term) + 1):
+            await recorder.request(client, "GET /api/customers", "GET", "/api/customers",
+                                   params={"search": term[:length]}, headers=headers[i % len(headers)])
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+
+
+async def results_month(client, tenants, headers, recorder, concurrency, rng):
+    """Results page opened on a random month of the last year"""
+    async def user(i):
+        first = (datetime.now(timezone.utc).replace(day=1) - timedelta(days=31 * rng.randint(0, 11))).replace(day=1)
+        following = (first + timedelta(days=32)).replace(day=1)
+        await recorder.request(client, "GET /api/bootstrap?views=results", "GET", "/api/bootstrap", params={
+            "views": "results", "fields": "customers:id,typenr,tjeneste_nr",
+            "from": first.date().isoformat(), "to": following.date().isoformat()
+        }, headers=headers[i % len(headers)])
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+
+
+async def route_creation(client, tenants, headers, recorder, concurrency, rng):
+    """Planners build routes from 20 random installations"""
+    async def user(i):
+        tenant = tenants[i % len(tenants)]
+        await recorder.request(client, "POST /api/routes", "POST", "/api/routes", json={
+            "date": datetime.now(timezone.utc).isoformat(),
+            "anleggsnr_list": rng.sample(tenant["anleggsnr"], min(20, len(tenant["anleggsnr"])))
+        }, headers=headers[i % len(headers)])
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+
+
+async def bulk_import(client, tenants, headers, recorder, concurrency, rng):
+    """Every tenant re-imports its customer register from Excel (runs last: it replaces customers)"""
+    async def tenant_import(i, tenant):
+        frame = pd.DataFrame([
+            {"An.nr.": row["anleggsnr"], "Knr": row["kundennr"], "Kunde": row["kundnavn"], "Type nr.": row["typenr"],
+             "Kommune": row["kommune"], "Adresse": row["adresse"], "Postnr": row["postnr"], "Sted": row["poststed"],
+             "Uke": row["uke"]}
+            for row in customer_rows(rng, len(tenant["anleggsnr"]))
+        ])
+        buffer = BytesIO()
+        frame.to_excel(buffer, index=False)
+        files = {"file": ("kunder.xlsx", buffer.getvalue(),
+                          "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")}
+        await recorder.request(client, "POST /api/customers/import", "POST", "/api/customers/import",
+                               files=files, headers=headers[i])
+    await asyncio.gather(*(tenant_import(i, tenant) for i, tenant in enumerate(tenants)))
+
+
+SCENARIOS = {
+    "login_burst": login_burst,
+    "customer_search": customer_search,
+    "results_month": results_month,
+    "route_creation": route_creation,
+    "bulk_import": bulk_import,
+}
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_load(scale=None, scenarios=None):
+    """Seed a fresh database, run the scenarios in order and return the results document"""
+    scale = scale or scale_from_env()
+    scenarios = scenarios or list(SCENARIOS)
+    rng = random.Random(SEED)
+    logging.getLogger("firmanager.requests").setLevel(logging.WARNING)
+
+    use_database(make_database())
+    if BENCH_MONGO_URL:
+        await server.ensure_indexes()
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        tenants = [await seed_tenant(client, i, scale, rng) for i in range(scale["tenants"])]
+        headers = [await login(client, tenant) for tenant in tenants]
+
+        results = {}
+        for name in scenarios:
+            recorder = Recorder()
+            start = time.perf_counter()
+            await SCENARIOS[name](client, tenants, headers, recorder, scale["concurrency"], rng)
+            results[name] = recorder.report(time.perf_counter() - start)
+
+    return {
+        "meta": {
+            "commit": current_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "database": "mongodb" if BENCH_MONGO_URL else "mongomock",
+            "simulated_rtt_ms": None if BENCH_MONGO_URL else SIMULATED_RTT_MS,
+            "scale": scale,
+        },
+        "scenarios": results,
+    }
+
+
+def write_results(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def print_results(results):
+    for name, scenario in results["scenarios"].items():
+        print(f"\n{name} ({scenario['wall_s']} s)")
+        for label, stats in scenario["endpoints"].items():
+            print(f"  {label:40} p50 {stats['p50_ms']:>9} ms  p95 {stats['p95_ms']:>9} ms  "
+                  f"p99 {stats['p99_ms']:>9} ms  {stats['throughput_rps']:>8} req/s  errors {stats['errors']}")
+
+
+def main():
+    defaults = scale_from_env()
+    parser = argparse.ArgumentParser(description="In-process load test for the FirManager API")
+    parser.add_argument("--tenants", type=int, default=defaults["tenants"])
+    parser.add_argument("--customers", type=int, default=defaults["customers"])
+    parser.add_argument("--workorders", type=int, default=defaults["workorders"])
+    parser.add_argument("--concurrency", type=int, default=defaults["concurrency"])
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="Run only these (repeatable)")
+    parser.add_argument("--out", default=os.environ.get('BENCH_RESULTS_PATH'), help="Write JSON results here")
+    args = parser.parse_args()
+
+    scale = {"tenants": args.tenants, "customers": args.customers, "workorders": args.workorders,
+             "concurrency": args.concurrency}
+    results = asyncio.run(run_load(scale, args.scenario))
+    print_results(results)
+    if args.out:
+        write_results(results, args.out)
+        print(f"\nResults written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
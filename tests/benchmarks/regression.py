@@ -0,0 +1,232 @@
+"""
+Performance regression gate: a fixed set of micro and macro benchmarks, each timed as the
+median of N runs and compared with the stored baseline (tests/benchmarks/baseline.json).
+
+    BENCH_REPEATS      runs per benchmark, the median is kept (default 7)
+    BENCH_TOLERANCE    allowed slowdown as a fraction of the baseline (default 0.25)
+
+Run the gate with:        BENCH_REGRESSION=1 pytest tests/benchmarks/test_regression.py -s
+Refresh the baseline with: python -m tests.benchmarks.regression --update
+
+Baselines are only comparable on the same kind of machine and database; a baseline recorded
+against mongomock is not used for a run against BENCH_MONGO_URL and vice versa.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+from pathlib import Path
+
+import httpx
+import pandas as pd
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+from tests.benchmarks.harness import server, make_database, use_database, BENCH_MONGO_URL, SIMULATED_RTT_MS
+from tests.benchmarks.load import seed_tenant, login, customer_rows, current_commit
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+SEED = 20240611
+SCALE = {"customers": 2000, "workorders": 5000}
+ROUTE_STOPS = 200
+
+
+def repeats_from_env():
+    return int(os.environ.get('BENCH_REPEATS', '7'))
+
+
+def tolerance_from_env():
+    return float(os.environ.get('BENCH_TOLERANCE', '0.25'))
+
+
+async def median_ms(func, repeats):
+    """Median wall time of `repeats` calls after one warm-up call"""
+    await func()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - start)
+    return round(statistics.median(samples) * 1000, 3)
+
+
+class Fixture:
+    """One seeded tenant plus an Excel register to import; shared by all benchmarks"""
+
+    def __init__(self, client, tenant, headers, rng):
+        self.client = client
+        self.tenant = tenant
+        self.headers = headers
+        self.rng = rng
+        frame = pd.DataFrame([
+            {"An.nr.": row["anleggsnr"], "Knr": row["kundennr"], "Kunde": row["kundnavn"], "Type nr.": row["typenr"],
+             "Kommune": row["kommune"], "Adresse": row["adresse"], "Postnr": row["postnr"], "Sted": row["poststed"],
+             "Uke": row["uke"]}
+            for row in customer_rows(rng, SCALE["customers"])
+        ])
+        buffer = BytesIO()
+        frame.to_excel(buffer, index=False)
+        self.register = buffer.getvalue()
+
+    async def request(self, method, url, **kwargs):
+        response = await self.client.request(method, url, headers=self.headers, **kwargs)
+        response.raise_for_status()
+        return response
+
+
+# ---------- benchmarks: async (fixture) -> None ----------
+
+async def import_parsing(fixture):
+    """Excel register upload: parse, replace and insert 2000 customers"""
+    files = {"file": ("kunder.xlsx", fixture.register,
+                      "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")}
+    await fixture.request("POST", "/api/customers/import", files=files)
+
+
+async def customer_search(fixture):
+    await fixture.request("GET", "/api/customers", params={"search": "Oslo"})
+
+
+async def dashboard_stats(fixture):
+    # Measure the computation, not the coalescing memo
+    server.request_coalescer.invalidate(fixture.tenant["organization_id"])
+    await fixture.request("GET", "/api/dashboard/stats")
+
+
+async def serialize_customers(fixture):
+    """Response model validation and JSON rendering of a full customer list, without the query"""
+    if not hasattr(fixture, "customers"):
+        fixture.customers = await server.db.customers.find(
+            {"organization_id": fixture.tenant["organization_id"]}, {"_id": 0}
+        ).to_list(SCALE["customers"])
+        fixture.customer_field = next(
+            route.response_field for route in server.app.routes if getattr(route, "path", None) == "/api/customers"
+            and "GET" in route.methods
+        )
+    content = await serialize_response(field=fixture.customer_field, response_content=fixture.customers,
+                                       is_coroutine=True)
+    JSONResponse(content)
+
+
+async def route_optimization(fixture):
+    await fixture.request("POST", "/api/routes", json={
+        "date": datetime.now(timezone.utc).isoformat(),
+        "anleggsnr_list": fixture.rng.sample(fixture.tenant["anleggsnr"], ROUTE_STOPS)
+    })
+
+
+# Import runs first: it replaces the seeded customers with the register, which the
+# others then read, so every benchmark sees the same data set on every run
+BENCHMARKS = {
+    "import_parsing": import_parsing,
+    "customer_search": customer_search,
+    "dashboard_stats": dashboard_stats,
+    "serialize_customers": serialize_customers,
+    "route_optimization": route_optimization,
+}
+
+
+def database_kind():
+    return "mongodb" if BENCH_MONGO_URL else "mongomock"
+
+
+async def run_benchmarks(repeats=None, names=None):
+    repeats = repeats or repeats_from_env()
+    names = names or list(BENCHMARKS)
+    rng = random.Random(SEED)
+    use_database(make_database())
+    if BENCH_MONGO_URL:
+        await server.ensure_indexes()
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        tenant = await seed_tenant(client, 0, {**SCALE, "tenants": 1}, rng)
+        fixture = Fixture(client, tenant, await login(client, tenant), rng)
+        metrics = {name: {"median_ms": await median_ms(lambda: BENCHMARKS[name](fixture), repeats)} for name in names}
+
+    return {
+        "meta": {
+            "commit": current_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "database": database_kind(),
+            "simulated_rtt_ms": None if BENCH_MONGO_URL else SIMULATED_RTT_MS,
+            "repeats": repeats,
+            "scale": SCALE,
+        },
+        "metrics": metrics,
+    }
+
+
+def load_baseline(path=BASELINE_PATH):
+    if not Path(path).exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_baseline(results, path=BASELINE_PATH):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(results, baseline, tolerance=None):
+    """Regressed metrics as (name, baseline_ms, current_ms, allowed_ms).
+
+    A metric may carry its own "tolerance" in the baseline file for benchmarks known to be noisy.
+    Metrics missing from the baseline are new and never fail.
+    """
+    tolerance = tolerance_from_env() if tolerance is None else tolerance
+    regressions = []
+    for name, metric in results["metrics"].items():
+        reference = baseline["metrics"].get(name)
+        if reference is None:
+            continue
+        allowed = reference["median_ms"] * (1 + reference.get("tolerance", tolerance))
+        if metric["median_ms"] > allowed:
+            regressions.append((name, reference["median_ms"], metric["median_ms"], round(allowed, 3)))
+    return regressions
+
+
+def print_comparison(results, baseline):
+    for name, metric in results["metrics"].items():
+        reference = (baseline or {}).get("metrics", {}).get(name)
+        if reference:
+            change = (metric["median_ms"] / reference["median_ms"] - 1) * 100 if reference["median_ms"] else 0.0
+            print(f"  {name:24} {metric['median_ms']:>10} ms  baseline {reference['median_ms']:>10} ms  {change:+6.1f}%")
+        else:
+            print(f"  {name:24} {metric['median_ms']:>10} ms  (no baseline)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FirManager performance regression gate")
+    parser.add_argument("--repeats", type=int, default=repeats_from_env(), help="Runs per benchmark (median kept)")
+    parser.add_argument("--tolerance", type=float, default=tolerance_from_env())
+    parser.add_argument("--benchmark", action="append", choices=list(BENCHMARKS), help="Run only these (repeatable)")
+    parser.add_argument("--update", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmarks(args.repeats, args.benchmark))
+    baseline = load_baseline(args.baseline)
+    print_comparison(results, baseline)
+    if args.update:
+        if baseline and args.benchmark:
+            results["metrics"] = {**baseline["metrics"], **results["metrics"]}
+        write_baseline(results, args.baseline)
+        print(f"\nBaseline written to {args.baseline}")
+        return
+    if baseline and baseline["meta"]["database"] == results["meta"]["database"]:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, reference, current, allowed in regressions:
+            print(f"REGRESSION {name}: {current} ms (baseline {reference} ms, allowed {allowed} ms)")
+        raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Cold-start benchmark: imports server.py in fresh interpreters with -X importtime and reports
+the total and the self time per top-level package, so heavy imports show up by name.
+
+Run with: python -m tests.benchmarks.startup --runs 5 [--out startup.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent.parent.parent / "backend"
+
+
+def import_profile(module="server"):
+    """One fresh-interpreter import: {"total_ms", "packages": {package: self_ms}, "modules": [...]}"""
+    env = dict(os.environ)
+    env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    env.setdefault("DB_NAME", "firmanager_bench")
+    code = f"import sys, {module}; print(','.join(sorted(sys.modules)))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+
+    packages = {}
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+        if name == module:
+            total_us = int(cumulative_us)
+    return {
+        "total_ms": round(total_us / 1000, 1),
+        "packages": {name: round(us / 1000, 1) for name, us in packages.items()},
+        "modules": result.stdout.strip().split(","),
+    }
+
+
+def measure(runs=5, module="server"):
+    """Median over `runs` imports; per-package times are medians too"""
+    profiles = [import_profile(module) for _ in range(runs)]
+    names = set().union(*(profile["packages"] for profile in profiles))
+    return {
+        "runs": runs,
+        "total_ms": round(statistics.median(profile["total_ms"] for profile in profiles), 1),
+        "packages": {
+            name: round(statistics.median(profile["packages"].get(name, 0.0) for profile in profiles), 1)
+            for name in sorted(names)
+        },
+        "modules": profiles[-1]["modules"],
+    }
+
+
+def print_report(report, top=15):
+    print(f"\nimport server: {report['total_ms']} ms (median of {report['runs']})")
+    for name, ms in sorted(report["packages"].items(), key=lambda item: -item[1])[:top]:
+        print(f"  {name:32} {ms:>8} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time per package for a cold server start")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Packages to list")
+    parser.add_argument("--out", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    report = measure(args.runs)
+    print_report(report, args.top)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({k: v for k, v in report.items() if k != "modules"}, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
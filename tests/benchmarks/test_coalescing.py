@@ -0,0 +1,65 @@
+"""
+Concurrent identical dashboard requests share one computation
+Run with: pytest tests/benchmarks -s
+"""
+import asyncio
+import time
+import uuid
+
+import pytest
+from pymongo import _csot
+
+from tests.benchmarks.harness import server, make_database, use_database, BENCH_MONGO_URL
+from tests.benchmarks.test_query_fanout import seed_organization
+
+if not BENCH_MONGO_URL:
+    pytest.importorskip("mongomock_motor")
+
+TECHNICIANS = 50
+
+
+class TestCoalescing:
+    """The 07:30 burst: every technician opens the dashboard at once"""
+
+    def test_dashboard_burst_computes_once(self):
+        """Test that a burst of identical requests costs about one computation"""
+        async def run():
+            use_database(make_database())
+            org_id = str(uuid.uuid4())
+            await seed_organization(org_id)
+            user = server.User(email="bench@test.no", name="Bench", organization_id=org_id)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(server.compute_dashboard_stats(org_id) for _ in range(TECHNICIANS)))
+            independent = time.perf_counter() - start
+
+            counts_before = dict(server.request_coalescer.counts)
+            start = time.perf_counter()
+            results = await asyncio.gather(*(server.get_dashboard_stats(user) for _ in range(TECHNICIANS)))
+            coalesced = time.perf_counter() - start
+            computed = server.request_coalescer.counts.get(("dashboard_stats", "computed"), 0) \
+                - counts_before.get(("dashboard_stats", "computed"), 0)
+            return independent, coalesced, computed, results
+
+        independent, coalesced, computed, results = asyncio.run(run())
+        print(f"\n{TECHNICIANS} dashboard requests: independent {independent * 1000:.1f} ms, "
+              f"coalesced {coalesced * 1000:.1f} ms ({computed} computation)")
+        assert computed == 1
+        assert all(result is results[0] for result in results)
+        assert coalesced < independent
+
+    def test_shared_computation_has_its_own_context(self):
+        """Test that the shared task doesn't run in the first caller's request context or deadline"""
+        async def compute():
+            await asyncio.sleep(0.01)
+            return server.request_stats.get(), _csot.get_timeout()
+
+        async def caller():
+            server.request_stats.set(server.RequestStats())
+            with server.pymongo.timeout(0.5):
+                return await server.request_coalescer.run((str(uuid.uuid4()), "context_test"), compute, ttl=0,
+                                                          deadline=30)
+
+        stats, deadline = asyncio.run(caller())
+        assert stats is None
+        assert deadline == pytest.approx(30, abs=1)
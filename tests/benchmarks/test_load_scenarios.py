@@ -0,0 +1,34 @@
+"""
+Small-scale run of the load scenarios, so they keep working as the API changes
+Run with: pytest tests/benchmarks -s (set BENCH_RESULTS_PATH to keep the JSON)
+"""
+import asyncio
+import os
+
+import pytest
+
+from tests.benchmarks.harness import BENCH_MONGO_URL
+from tests.benchmarks.load import run_load, print_results, write_results, SCENARIOS
+
+if not BENCH_MONGO_URL:
+    pytest.importorskip("mongomock_motor")
+
+SMOKE_SCALE = {"tenants": 1, "customers": 200, "workorders": 1000, "concurrency": 5}
+
+
+class TestLoadScenarios:
+    """Every scenario runs without errors and reports per-endpoint percentiles"""
+
+    def test_scenarios_run_clean(self):
+        """Test that all scenarios complete without error responses"""
+        results = asyncio.run(run_load(SMOKE_SCALE))
+        print_results(results)
+        if os.environ.get('BENCH_RESULTS_PATH'):
+            write_results(results, os.environ['BENCH_RESULTS_PATH'])
+
+        assert set(results["scenarios"]) == set(SCENARIOS)
+        for name, scenario in results["scenarios"].items():
+            assert scenario["endpoints"], f"{name} made no requests"
+            for label, stats in scenario["endpoints"].items():
+                assert stats["errors"] == 0, f"{name}: {label} returned errors"
+                assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
@@ -0,0 +1,61 @@
+"""
+Latency comparison for handlers that fan independent queries out with gather_bounded
+Run with: pytest tests/benchmarks -s
+"""
+import asyncio
+import uuid
+
+import pytest
+
+from tests.benchmarks.harness import server, make_database, use_database, time_async, BENCH_MONGO_URL
+
+if not BENCH_MONGO_URL:
+    pytest.importorskip("mongomock_motor")
+
+
+async def seed_organization(org_id, customers=200, workorders=500):
+    await server.db.customers.insert_many([
+        {"id": str(uuid.uuid4()), "organization_id": org_id, "anleggsnr": str(i), "kundnavn": f"Kunde {i}"}
+        for i in range(customers)
+    ])
+    await server.db.workorders.insert_many([
+        {
+            "id": str(uuid.uuid4()), "organization_id": org_id, "order_type": ["service", "extra", "montering"][i % 3],
+            "status": ["planlagt", "fullført"][i % 2], "arbeidstid": 1.5, "kjoretid": 0.5, "kjorte_km": 12.0
+        }
+        for i in range(workorders)
+    ])
+    await server.db.products.insert_many([
+        {"id": str(uuid.uuid4()), "organization_id": org_id, "produktnr": f"P{i}"} for i in range(50)
+    ])
+
+
+async def sequential_dashboard_stats(org_id):
+    """The pre-gather implementation: five awaits in a row"""
+    db = server.db
+    org_filter = {"organization_id": org_id}
+    await db.customers.count_documents(org_filter)
+    await db.workorders.count_documents(org_filter)
+    await db.workorders.count_documents({**org_filter, "status": "planlagt"})
+    await db.products.count_documents(org_filter)
+    await db.workorders.find(org_filter, {"_id": 0, "order_type": 1, "arbeidstid": 1, "kjoretid": 1, "kjorte_km": 1}).to_list(1000)
+
+
+class TestQueryFanout:
+    """Sequential awaits vs gather_bounded"""
+
+    def test_dashboard_stats_gather_vs_sequential(self):
+        """Test that the gathered dashboard handler beats the sequential version"""
+        async def run():
+            use_database(make_database())
+            org_id = str(uuid.uuid4())
+            await seed_organization(org_id)
+
+            sequential = await time_async(lambda: sequential_dashboard_stats(org_id))
+            gathered = await time_async(lambda: server.compute_dashboard_stats(org_id))
+            return sequential, gathered
+
+        sequential, gathered = asyncio.run(run())
+        print(f"\ndashboard stats sequential: {sequential}")
+        print(f"dashboard stats gathered:   {gathered}")
+        assert gathered["p50_ms"] < sequential["p50_ms"]
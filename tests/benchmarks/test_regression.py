@@ -0,0 +1,44 @@
+"""
+Performance regression gate against tests/benchmarks/baseline.json
+The gate itself is opt-in, since timings only compare on similar hardware:
+    BENCH_REGRESSION=1 pytest tests/benchmarks/test_regression.py -s
+"""
+import asyncio
+import os
+
+import pytest
+
+from tests.benchmarks.harness import BENCH_MONGO_URL
+from tests.benchmarks.regression import run_benchmarks, load_baseline, compare, print_comparison, tolerance_from_env
+
+if not BENCH_MONGO_URL:
+    pytest.importorskip("mongomock_motor")
+
+
+class TestRegression:
+    """No benchmark is slower than its baseline median beyond the tolerance"""
+
+    @pytest.mark.skipif(not os.environ.get('BENCH_REGRESSION'),
+                        reason="set BENCH_REGRESSION=1 to run the performance regression gate")
+    def test_no_regressions(self):
+        """Test that every benchmark median stays within tolerance of the baseline"""
+        baseline = load_baseline()
+        if baseline is None:
+            pytest.skip("no baseline; record one with python -m tests.benchmarks.regression --update")
+        results = asyncio.run(run_benchmarks())
+        print_comparison(results, baseline)
+        if baseline["meta"]["database"] != results["meta"]["database"]:
+            pytest.skip(f"baseline was recorded against {baseline['meta']['database']}")
+
+        regressions = compare(results, baseline)
+        assert not regressions, "\n".join(
+            f"{name}: {current} ms, baseline {reference} ms (tolerance {tolerance_from_env():.0%})"
+            for name, reference, current, allowed in regressions
+        )
+
+    def test_compare_flags_slowdowns(self):
+        """Test that compare() applies the global and per-metric tolerances"""
+        baseline = {"metrics": {"fast": {"median_ms": 10.0}, "noisy": {"median_ms": 10.0, "tolerance": 1.0}}}
+        results = {"metrics": {"fast": {"median_ms": 13.0}, "noisy": {"median_ms": 19.0}, "new": {"median_ms": 99.0}}}
+        assert compare(results, baseline, tolerance=0.25) == [("fast", 10.0, 13.0, 12.5)]
+        assert compare(results, baseline, tolerance=0.5) == []
@@ -0,0 +1,19 @@
+"""
+Cold-start import time of server.py
+Run with: pytest tests/benchmarks/test_startup.py -s
+"""
+from tests.benchmarks.startup import measure, print_report
+
+# Loaded on first use or by the warm-up task, never by `import server` (server.HEAVY_MODULES)
+LAZY_MODULES = ["pandas", "numpy", "openpyxl", "pyinstrument"]
+
+
+class TestStartup:
+    """server.py imports stay lean"""
+
+    def test_heavy_modules_load_lazily(self):
+        """Test that importing server does not import pandas, numpy or openpyxl"""
+        report = measure(runs=3)
+        print_report(report)
+        imported = set(report["modules"])
+        assert not imported & set(LAZY_MODULES), f"imported at startup: {sorted(imported & set(LAZY_MODULES))}"
@@ -0,0 +1,113 @@
+"""
+Per-organization admission control: token buckets, bulkheads and the 429 response
+"""
+import asyncio
+
+import pytest
+
+from tests.benchmarks.harness import server
+
+
+def pools(**overrides):
+    settings = {"concurrency": 1, "rate_per_second": 1.0, "burst": 2, "queue_timeout_seconds": 0.05, "max_queue": 0}
+    settings.update(overrides)
+    return {name: server.AdmissionPool(name, **settings) for name in ("default", "expensive")}
+
+
+class TestTokenBucket:
+    """TokenBucket.reserve"""
+
+    def test_burst_then_wait(self):
+        """Test that the burst is free, the next token is queued and one too far away is refused"""
+        bucket = server.TokenBucket(rate_per_second=1.0, burst=2)
+        assert bucket.reserve(max_wait=0) == (True, 0.0)
+        assert bucket.reserve(max_wait=0) == (True, 0.0)
+        admitted, wait = bucket.reserve(max_wait=2)
+        assert admitted and wait == pytest.approx(1.0, abs=0.05)
+        admitted, retry_after = bucket.reserve(max_wait=1)
+        assert not admitted and retry_after == pytest.approx(2.0, abs=0.05)
+
+    def test_refund_is_capped_at_burst(self):
+        """Test that refunding never gives a bucket more than its burst"""
+        bucket = server.TokenBucket(rate_per_second=1.0, burst=2)
+        bucket.refund()
+        assert bucket.tokens == 2
+
+
+class TestBulkhead:
+    """Bulkhead.acquire"""
+
+    def test_queue_full(self):
+        """Test that a request is refused at once when the queue is full"""
+        async def run():
+            bulkhead = server.Bulkhead(limit=1, max_queue=0)
+            assert await bulkhead.acquire(timeout=1)
+            return await bulkhead.acquire(timeout=1), bulkhead.waiting
+        assert asyncio.run(run()) == (False, 0)
+
+    def test_queue_timeout(self):
+        """Test that a queued request gives up after its timeout and leaves the queue"""
+        async def run():
+            bulkhead = server.Bulkhead(limit=1, max_queue=1)
+            assert await bulkhead.acquire(timeout=1)
+            admitted = await bulkhead.acquire(timeout=0.05)
+            return admitted, bulkhead.waiting, bulkhead.active
+        assert asyncio.run(run()) == (False, 0, 1)
+
+    def test_queued_request_admitted_on_release(self):
+        """Test that a waiter gets the slot when the active request finishes"""
+        async def run():
+            bulkhead = server.Bulkhead(limit=1, max_queue=1)
+            await bulkhead.acquire(timeout=1)
+            waiter = asyncio.create_task(bulkhead.acquire(timeout=1))
+            await asyncio.sleep(0)
+            bulkhead.release()
+            return await waiter
+        assert asyncio.run(run()) is True
+
+
+class TestAdmissionController:
+    """AdmissionController.admit and the middleware's 429"""
+
+    def test_concurrency_rejection_refunds_token(self):
+        """Test that a request turned away by the bulkhead doesn't use up the rate budget"""
+        async def run():
+            controller = server.AdmissionController(pools())
+            pool = controller.pools["default"]
+            bulkhead, _ = await controller.admit("org:a", pool)
+            rejected, rejection = await controller.admit("org:a", pool)
+            return bulkhead, rejected, rejection, controller._buckets[("org:a", "default")].tokens
+        bulkhead, rejected, rejection, tokens = asyncio.run(run())
+        assert bulkhead is not None and rejected is None
+        assert rejection[0] == "concurrency"
+        assert tokens == pytest.approx(1.0, abs=0.05)
+
+    def test_rate_limited_request_gets_retry_after(self, monkeypatch):
+        """Test that the 429 for a rate limit carries Retry-After rounded up to whole seconds"""
+        monkeypatch.setattr(server, "admission_controller",
+                            server.AdmissionController(pools(concurrency=5, rate_per_second=0.4, burst=1)))
+        token = server.create_access_token({"sub": "user", "org": "org"})
+        scope = {"type": "http", "method": "GET", "path": "/api/customers", "query_string": b"",
+                 "headers": [(b"authorization", f"Bearer {token}".encode())]}
+
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        async def request():
+            messages = []
+
+            async def receive():
+                return {"type": "http.request", "body": b""}
+
+            async def send(message):
+                messages.append(message)
+            await server.AdmissionControlMiddleware(app)(scope, receive, send)
+            return messages[0]
+
+        async def run():
+            return await request(), await request()
+        first, second = asyncio.run(run())
+        assert first["status"] == 200
+        assert second["status"] == 429
+        assert dict(second["headers"])[b"retry-after"] == b"3"
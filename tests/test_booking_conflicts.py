@@ -0,0 +1,42 @@
+"""
+Concurrent bookings for the same employee and day are checked one at a time
+Run with: pytest tests/test_booking_conflicts.py
+"""
+import asyncio
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from tests.benchmarks.harness import server, make_database, use_database, BENCH_MONGO_URL
+
+if not BENCH_MONGO_URL:
+    pytest.importorskip("mongomock_motor")
+
+CONCURRENT_BOOKINGS = 5
+
+
+class TestBookingConflicts:
+    """check_conflicts=true holds while another booking for the slot is being written"""
+
+    def test_concurrent_creates_book_once(self):
+        """Test that only one of several simultaneous overlapping bookings is accepted"""
+        async def run():
+            use_database(make_database())
+            user = server.User(email="booking@test.no", name="Booking", organization_id=str(uuid.uuid4()))
+            workorder = server.WorkOrderCreate(
+                customer_id="c", employee_id="e", date=datetime(2026, 1, 5, 8, tzinfo=timezone.utc),
+                order_type="service", arbeidstid=2
+            )
+            single = [server.create_workorder(workorder, True, user) for _ in range(CONCURRENT_BOOKINGS)]
+            bulk = server.create_workorders_bulk([workorder], True, user)
+            return await asyncio.gather(*single, bulk, return_exceptions=True)
+
+        outcomes = asyncio.run(run())
+        accepted = [outcome for outcome in outcomes if not isinstance(outcome, Exception)]
+        rejected = [outcome for outcome in outcomes if isinstance(outcome, HTTPException)]
+        assert len(accepted) == 1
+        assert len(rejected) == CONCURRENT_BOOKINGS
+        assert all(outcome.status_code == 409 for outcome in rejected)
+        assert server.booking_locks._locks == {}
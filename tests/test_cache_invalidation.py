@@ -0,0 +1,134 @@
+"""
+Cross-worker cache invalidation tests
+Starts two app instances against the same local MongoDB and checks that a write on one
+evicts the cached reference data on the other.
+
+Requires a local single-node replica set for the change stream path, e.g.
+    mongod --replSet rs0 --dbpath /tmp/rs0 && mongosh --eval "rs.initiate()"
+    INVALIDATION_TEST_MONGO_URL="mongodb://localhost:27017/?replicaSet=rs0" pytest tests/test_cache_invalidation.py
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import pytest
+import requests
+
+MONGO_URL = os.environ.get('INVALIDATION_TEST_MONGO_URL')
+BACKEND_DIR = Path(__file__).parent.parent / "backend"
+POLL_SECONDS = 0.5
+# Longest time a stale read is tolerated on the other instance
+MAX_STALENESS_SECONDS = 5
+
+pytestmark = pytest.mark.skipif(not MONGO_URL, reason="INVALIDATION_TEST_MONGO_URL not set")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_instance(db_name, mode):
+    port = free_port()
+    env = {
+        **os.environ,
+        "MONGO_URL": MONGO_URL,
+        "DB_NAME": db_name,
+        "CACHE_INVALIDATION_MODE": mode,
+        "CACHE_INVALIDATION_POLL_SECONDS": str(POLL_SECONDS),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return process, base_url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"App instance on port {port} did not start")
+
+
+@pytest.fixture(scope="module", params=["auto", "polling"])
+def instances(request):
+    """Two app instances sharing one database, in change stream (auto) or polling mode"""
+    db_name = f"invalidation_test_{uuid.uuid4().hex[:8]}"
+    started = [start_instance(db_name, request.param) for _ in range(2)]
+    yield [base_url for _, base_url in started]
+    for process, _ in started:
+        process.terminate()
+        process.wait(timeout=10)
+    from pymongo import MongoClient
+    MongoClient(MONGO_URL).drop_database(db_name)
+
+
+@pytest.fixture(scope="module")
+def auth_headers(instances):
+    """Register an admin on the first instance"""
+    response = requests.post(f"{instances[0]}/api/auth/register", json={
+        "email": f"cache-{uuid.uuid4().hex[:8]}@test.no",
+        "password": "test",
+        "name": "Cache Test",
+        "organization_name": "Cache Test Org"
+    })
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def wait_until(check):
+    deadline = time.time() + MAX_STALENESS_SECONDS
+    while time.time() < deadline:
+        if check():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+class TestCrossWorkerInvalidation:
+    """Writes on instance A become visible on instance B within the staleness bound"""
+
+    def test_employee_create_evicts_other_instance(self, instances, auth_headers):
+        """Test that B's cached employee list is refreshed after A creates an employee"""
+        a, b = instances
+        # Warm B's cache
+        assert requests.get(f"{b}/api/employees", headers=auth_headers).json() == []
+
+        response = requests.post(f"{a}/api/employees", json={
+            "initialer": "CT",
+            "navn": "Cache Test",
+            "stilling": "Tekniker"
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        employee_id = response.json()["id"]
+
+        assert wait_until(lambda: employee_id in [
+            e["id"] for e in requests.get(f"{b}/api/employees", headers=auth_headers).json()
+        ])
+
+    def test_service_update_evicts_pricing_lookup(self, instances, auth_headers):
+        """Test that B's service pricing lookup sees a price change made through A"""
+        a, b = instances
+        requests.post(f"{a}/api/customers", json={
+            "anleggsnr": "CT-1", "kundennr": "1", "kundnavn": "Cache Kunde", "typenr": "CT-T1",
+            "kommune": "Oslo", "adresse": "Gate 1", "postnr": "0150", "poststed": "Oslo"
+        }, headers=auth_headers)
+        service = requests.post(f"{a}/api/economy/services", json={
+            "tjenestenr": "CT-T1", "tjeneste_navn": "Cache Service", "pris": 100.0
+        }, headers=auth_headers).json()
+
+        pricing_url = f"{b}/api/customers/CT-1/service-pricing"
+        assert wait_until(lambda: (requests.get(pricing_url, headers=auth_headers).json()["service"] or {}).get("pris") == 100.0)
+
+        requests.put(f"{a}/api/economy/services/{service['id']}", json={
+            "tjenestenr": "CT-T1", "tjeneste_navn": "Cache Service", "pris": 250.0
+        }, headers=auth_headers)
+        assert wait_until(lambda: requests.get(pricing_url, headers=auth_headers).json()["service"]["pris"] == 250.0)
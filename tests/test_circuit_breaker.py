@@ -0,0 +1,150 @@
+"""
+Database circuit breaker: state transitions, which failures count against the database, the
+503/504 mapping and the stale reads served while the breaker is open
+"""
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import AutoReconnect, ExecutionTimeout, ServerSelectionTimeoutError
+
+from tests.benchmarks.harness import server, make_database, use_database, BENCH_MONGO_URL
+
+if not BENCH_MONGO_URL:
+    pytest.importorskip("mongomock_motor")
+
+
+def breaker(**overrides):
+    settings = {"window_seconds": 60, "min_calls": 4, "failure_rate": 0.5, "open_seconds": 0.05}
+    settings.update(overrides)
+    return server.CircuitBreaker(**settings)
+
+
+def trip(circuit, source=None):
+    for _ in range(circuit.min_calls):
+        circuit.record(False, source)
+
+
+class TestCircuitBreaker:
+    """CircuitBreaker state transitions"""
+
+    def test_opens_at_failure_rate(self):
+        """Test that the breaker waits for min_calls and then opens at the failure rate"""
+        circuit = breaker()
+        circuit.record(True)
+        circuit.record(False)
+        circuit.record(True)
+        assert circuit.state == circuit.CLOSED
+        circuit.record(False)
+        assert circuit.state == circuit.OPEN and circuit.rejecting()
+        assert circuit.retry_after() == 1
+
+    def test_half_open_success_closes(self):
+        """Test that after open_seconds one good outcome closes the breaker"""
+        circuit = breaker()
+        trip(circuit)
+        time.sleep(0.06)
+        assert not circuit.rejecting() and circuit.state == circuit.HALF_OPEN
+        circuit.record(True)
+        assert circuit.state == circuit.CLOSED
+
+    def test_half_open_failure_reopens(self):
+        """Test that a bad outcome while half-open opens the breaker again"""
+        circuit = breaker()
+        trip(circuit)
+        time.sleep(0.06)
+        circuit.record(False)
+        assert circuit.state == circuit.OPEN and circuit.opened == 2
+
+    def test_ignores_outcomes_while_open(self):
+        """Test that stragglers finishing after the breaker opened don't touch it"""
+        circuit = breaker(open_seconds=60)
+        trip(circuit)
+        circuit.record(True)
+        assert circuit.state == circuit.OPEN
+
+    def test_one_organization_cannot_trip_it_for_everyone(self):
+        """Test that bad outcomes from a single organization don't open the breaker while others are fine"""
+        circuit = breaker()
+        for _ in range(10):
+            circuit.record(False, "org-a")
+            circuit.record(True, "org-b")
+        assert circuit.state == circuit.CLOSED
+        circuit.record(False, "org-b")
+        circuit.record(False, "org-b")
+        assert circuit.state == circuit.OPEN
+
+    def test_single_organization_can_trip_it(self):
+        """Test that the breaker still opens when only one organization is using the database"""
+        circuit = breaker()
+        trip(circuit, "org-a")
+        assert circuit.state == circuit.OPEN
+
+    @pytest.mark.parametrize("failure,fault", [
+        ({"code": 50, "codeName": "MaxTimeMSExpired", "errmsg": "operation exceeded time limit"}, False),
+        ({"code": 11000, "errmsg": "E11000 duplicate key error"}, False),
+        ({"code": 91, "codeName": "ShutdownInProgress"}, True),
+        ({"errmsg": "connection closed", "errtype": "AutoReconnect"}, True),
+    ])
+    def test_database_faults(self, failure, fault):
+        """Test that only failures pointing at the database count against it"""
+        assert server.is_database_fault(failure) is fault
+
+
+class TestDatabaseErrorHandler:
+    """database_error_handler status codes"""
+
+    def handle(self, exc):
+        return asyncio.run(server.database_error_handler(None, exc))
+
+    def test_deadline_is_504(self, monkeypatch):
+        """Test that an expired query deadline is a 504 and leaves the breaker alone"""
+        monkeypatch.setattr(server, "db_breaker", breaker())
+        response = self.handle(ExecutionTimeout("operation exceeded time limit", 50))
+        assert response.status_code == 504
+        assert server.db_breaker.stats()["opened"] == 0 and not server.db_breaker._outcomes
+
+    def test_lost_connection_is_503(self, monkeypatch):
+        """Test that a lost connection is a 503 with Retry-After"""
+        monkeypatch.setattr(server, "db_breaker", breaker())
+        response = self.handle(AutoReconnect("connection closed"))
+        assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+
+    def test_server_selection_timeout_is_503(self, monkeypatch):
+        """Test that an unreachable database is a 503, not a 504, and counts against the breaker"""
+        monkeypatch.setattr(server, "db_breaker", breaker())
+        response = self.handle(ServerSelectionTimeoutError("no servers"))
+        assert response.status_code == 503
+        assert json.loads(response.body)["detail"].startswith("Database temporarily unavailable")
+        assert len(server.db_breaker._outcomes) == 1
+
+
+class TestStaleReads:
+    """Reference data served from the last snapshot while the breaker is open"""
+
+    def test_reference_cache_serves_last_snapshot(self, monkeypatch):
+        """Test that an invalidated snapshot is still served while the breaker is open"""
+        async def scenario():
+            await server.db.services.insert_one({"id": "s1", "organization_id": "org-a", "tjenestenr": "100"})
+            await server.reference_cache.get("org-a", "services")
+            server.reference_cache.bump("org-a", "services")
+            trip(server.db_breaker)
+            return await server.reference_cache.get("org-a", "services")
+
+        use_database(make_database())
+        monkeypatch.setattr(server, "db_breaker", breaker(open_seconds=60))
+        snapshot = asyncio.run(scenario())
+        assert [doc["id"] for doc in snapshot.docs] == ["s1"]
+        assert server.reference_cache.stale_hits == 1
+
+    def test_reference_cache_without_snapshot_is_503(self, monkeypatch):
+        """Test that an organization never loaded gets a 503 instead of waiting on the database"""
+        use_database(make_database())
+        monkeypatch.setattr(server, "db_breaker", breaker(open_seconds=60))
+        trip(server.db_breaker)
+        with pytest.raises(HTTPException) as raised:
+            asyncio.run(server.reference_cache.get("org-a", "services"))
+        assert raised.value.status_code == 503 and "Retry-After" in raised.value.headers
+        assert server.db_breaker.rejections == 1
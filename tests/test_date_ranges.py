@@ -0,0 +1,70 @@
+"""
+from/to windows on stored dates: writes are normalized to UTC strings, and older documents are
+rewritten at startup so they don't drop out of ranged lists
+Run with: pytest tests/test_date_ranges.py
+"""
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from tests.benchmarks.harness import server, make_database, use_database, BENCH_MONGO_URL
+
+if not BENCH_MONGO_URL:
+    pytest.importorskip("mongomock_motor")
+
+JANUARY = (datetime(2026, 1, 1, tzinfo=timezone.utc), datetime(2026, 2, 1, tzinfo=timezone.utc))
+
+
+def internal_order(organization_id, date):
+    return {"id": str(uuid.uuid4()), "organization_id": organization_id, "avdeling": "Service", "date": date,
+            "employee_id": "e", "beskrivelse": "Kontor", "created_at": datetime.now(timezone.utc).isoformat()}
+
+
+class TestDateRanges:
+    """date_range_filter against what is actually stored"""
+
+    def test_legacy_dates_are_normalized(self):
+        """Test that datetime-typed and offset dates are rewritten and found by the month window"""
+        async def run():
+            use_database(make_database())
+            org_id = str(uuid.uuid4())
+            user = server.User(email="dates@test.no", name="Dates", organization_id=org_id)
+            await server.db.internalorders.insert_many([
+                # Saved by the old PUT /internalorders, which stored a BSON datetime
+                internal_order(org_id, datetime(2026, 1, 15, 8)),
+                # 00:30 in Oslo on 1 February is still January in UTC
+                internal_order(org_id, "2026-02-01T00:30:00+01:00"),
+                internal_order(org_id, "2026-01-20T08:00:00+00:00"),
+            ])
+            before = await server.get_internalorders(None, *JANUARY, user)
+            fixed = await server.normalize_stored_dates()
+            after = await server.get_internalorders(None, *JANUARY, user)
+            stored = await server.db.internalorders.find({}, {"_id": 0, "date": 1}).to_list(None)
+            return len(before), fixed, after, sorted(doc['date'] for doc in stored)
+
+        before, fixed, after, stored = asyncio.run(run())
+        assert before == 1
+        assert fixed == 2
+        assert len(after) == 3
+        assert stored == ["2026-01-15T08:00:00+00:00", "2026-01-20T08:00:00+00:00", "2026-01-31T23:30:00+00:00"]
+
+    def test_writes_store_utc(self):
+        """Test that a date sent with an offset is stored in UTC on create and update"""
+        async def run():
+            use_database(make_database())
+            user = server.User(email="dates@test.no", name="Dates", organization_id=str(uuid.uuid4()))
+            oslo = timezone(timedelta(hours=1))
+            order = server.InternalOrderCreate(avdeling="Service", date=datetime(2026, 1, 5, 9, tzinfo=oslo),
+                                               employee_id="e", beskrivelse="Kontor")
+            created = await server.create_internalorder(order, user)
+            on_create = (await server.db.internalorders.find_one({"id": created.id}))['date']
+            order.date = datetime(2026, 1, 6, 9)
+            await server.update_internalorder(created.id, order, user)
+            on_update = (await server.db.internalorders.find_one({"id": created.id}))['date']
+            return on_create, on_update
+
+        on_create, on_update = asyncio.run(run())
+        assert on_create == "2026-01-05T08:00:00+00:00"
+        assert on_update == "2026-01-06T09:00:00+00:00"
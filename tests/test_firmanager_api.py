@@ -5,6 +5,8 @@ Tests for Products, Routes, Economy (Produsent), and Results endpoints
 import pytest
 import requests
 import os
+import base64
+import hashlib
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://firmanager.preview.emergentagent.com')
 
@@ -108,6 +110,33 @@ class TestProducts:
         assert data["image_url"] == "https://via.placeholder.com/300"
         print(f"Updated product {product_id} with new image URL")
 
+    def test_upload_image_is_content_addressed(self, auth_headers):
+        """Test that uploading the same image twice stores it once and serves the requested size"""
+        # 1x1 transparent PNG
+        png = base64.b64decode(
+            "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+        )
+        image_urls = []
+        for produktnr in ("TEST-API-IMG-1", "TEST-API-IMG-2"):
+            create_response = requests.post(f"{BASE_URL}/api/products", json={
+                "produktnr": produktnr, "navn": "Image Test Product", "kundepris": 100, "pa_lager": 1
+            }, headers=auth_headers)
+            assert create_response.status_code == 200
+            product_id = create_response.json()["id"]
+            response = requests.post(f"{BASE_URL}/api/products/{product_id}/upload-image",
+                                     files={"file": ("bilde.png", png, "image/png")}, headers=auth_headers)
+            assert response.status_code == 200
+            image_urls.append(response.json()["image_url"])
+            requests.delete(f"{BASE_URL}/api/products/{product_id}", headers=auth_headers)
+
+        assert image_urls[0] == image_urls[1]
+        assert image_urls[0] == f"/api/images/products/{hashlib.sha256(png).hexdigest()}.png"
+        response = requests.get(f"{BASE_URL}{image_urls[0]}?size=thumb")
+        assert response.status_code == 200
+        assert response.headers["content-type"] in ("image/png", "image/webp")
+        assert "immutable" in response.headers["cache-control"]
+        assert requests.get(f"{BASE_URL}{image_urls[0]}?size=huge").status_code == 400
+
 
 class TestRoutes:
     """Route planner tests with anleggsnr paste functionality"""
@@ -227,6 +256,26 @@ class TestEconomyProdusent:
         assert data["name"] == "Updated Produsent Name"
         assert data["arbeidstid_rate"] == 800.0
         print(f"Updated Produsent {produsent_id}")
+    
+    def test_list_reflects_update_immediately(self, auth_headers):
+        """Test that the cached Produsent list is refreshed after a write"""
+        requests.get(f"{BASE_URL}/api/economy/supplier-pricing", headers=auth_headers)
+        create_data = {
+            "name": "Cache Test Produsent",
+            "arbeidstid_rate": 100.0,
+            "kjoretid_rate": 50.0,
+            "km_rate": 1.0
+        }
+        create_response = requests.post(f"{BASE_URL}/api/economy/supplier-pricing", json=create_data, headers=auth_headers)
+        assert create_response.status_code == 200
+        produsent_id = create_response.json()["id"]
+        
+        response = requests.get(f"{BASE_URL}/api/economy/supplier-pricing", headers=auth_headers)
+        assert produsent_id in [p["id"] for p in response.json()]
+        
+        requests.delete(f"{BASE_URL}/api/economy/supplier-pricing/{produsent_id}", headers=auth_headers)
+        response = requests.get(f"{BASE_URL}/api/economy/supplier-pricing", headers=auth_headers)
+        assert produsent_id not in [p["id"] for p in response.json()]
 
 
 class TestServices:
@@ -301,6 +350,75 @@ class TestResults:
         assert isinstance(data, list)
         print(f"Found {len(data)} work orders")
     
+    def test_get_work_orders_expanded(self, auth_headers):
+        """Test that expand embeds customer and employee summaries"""
+        response = requests.get(f"{BASE_URL}/api/workorders?expand=customer,employee", headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        for order in data:
+            if order["customer"]:
+                assert order["customer"]["id"] == order["customer_id"]
+                assert "kundnavn" in order["customer"]
+                assert "adresse" not in order["customer"]
+            if order["employee"]:
+                assert order["employee"]["id"] == order["employee_id"]
+                assert "initialer" in order["employee"]
+        print(f"Expanded {len(data)} work orders")
+
+    def test_expand_ignores_other_organizations_customer(self, auth_headers):
+        """Test that a work order pointing at another organization's customer expands to null"""
+        import uuid
+        register_response = requests.post(f"{BASE_URL}/api/auth/register", json={
+            "email": f"test-api-{uuid.uuid4().hex[:8]}@test.no",
+            "password": "test",
+            "name": "TEST-API Other Org",
+            "organization_name": "TEST-API Other Org"
+        })
+        assert register_response.status_code == 200
+        other_headers = {"Authorization": f"Bearer {register_response.json()['access_token']}"}
+        customer_response = requests.post(f"{BASE_URL}/api/customers", json={
+            "anleggsnr": "TEST-API-FOREIGN", "kundennr": "1", "kundnavn": "Foreign Customer",
+            "kommune": "Oslo", "adresse": "Gate 1", "postnr": "0150", "poststed": "Oslo"
+        }, headers=other_headers)
+        assert customer_response.status_code == 200
+        foreign_customer_id = customer_response.json()["id"]
+
+        create_response = requests.post(f"{BASE_URL}/api/workorders", json={
+            "customer_id": foreign_customer_id,
+            "employee_id": "TEST-API-EMPLOYEE",
+            "date": "2026-01-07T08:00:00Z",
+            "order_type": "service"
+        }, headers=auth_headers)
+        assert create_response.status_code == 200
+        workorder_id = create_response.json()["id"]
+
+        response = requests.get(f"{BASE_URL}/api/workorders?expand=customer&from=2026-01-07&to=2026-01-08", headers=auth_headers)
+        assert response.status_code == 200
+        order = next(order for order in response.json() if order["id"] == workorder_id)
+        assert order["customer"] is None
+        requests.delete(f"{BASE_URL}/api/workorders/{workorder_id}", headers=auth_headers)
+
+    def test_get_work_orders_date_range(self, auth_headers):
+        """Test that from/to limits work orders to a [from, to) window"""
+        response = requests.get(f"{BASE_URL}/api/workorders?from=2026-01-01&to=2026-02-01", headers=auth_headers)
+        assert response.status_code == 200
+        for order in response.json():
+            assert "2026-01-01" <= order["date"][:10] < "2026-02-01"
+    
+    def test_get_calendar(self, auth_headers):
+        """Test the weekly calendar grouped by employee and day"""
+        response = requests.get(f"{BASE_URL}/api/calendar?week=2026-W02", headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["week"] == "2026-W02"
+        assert data["days"][0] == "2026-01-05"
+        assert len(data["days"]) == 7
+        for employee in data["employees"]:
+            assert set(employee["days"]) <= set(data["days"])
+        
+        response = requests.get(f"{BASE_URL}/api/calendar?week=not-a-week", headers=auth_headers)
+        assert response.status_code == 400
+    
     def test_get_employees(self, auth_headers):
         """Test getting employees for results calculation"""
         response = requests.get(f"{BASE_URL}/api/employees", headers=auth_headers)
@@ -318,6 +436,337 @@ class TestResults:
         print(f"Found {len(data)} internal orders")
 
 
+class TestSync:
+    """Delta sync tests for offline clients"""
+    
+    @pytest.fixture(scope="class")
+    def auth_headers(self):
+        """Get auth headers"""
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": "test@test.com",
+            "password": "test"
+        })
+        token = response.json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+    
+    def test_initial_sync_requests_full_resync(self, auth_headers):
+        """Test that a client without a sequence number is told to do a full load"""
+        response = requests.get(f"{BASE_URL}/api/sync", headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["full_resync"] == True
+        assert "seq" in data
+    
+    def test_sync_returns_changed_products(self, auth_headers):
+        """Test that created and deleted products show up as changes since the last seq"""
+        # since=0 always asks for a full resync, so make sure the org has logged a change
+        seed_response = requests.post(f"{BASE_URL}/api/products", json={
+            "produktnr": "TEST-API-SYNC-SEED", "navn": "Sync Seed Product", "kundepris": 1, "pa_lager": 0
+        }, headers=auth_headers)
+        assert seed_response.status_code == 200
+        requests.delete(f"{BASE_URL}/api/products/{seed_response.json()['id']}", headers=auth_headers)
+        seq = requests.get(f"{BASE_URL}/api/sync", headers=auth_headers).json()["seq"]
+        assert seq > 0
+        
+        product_data = {
+            "produktnr": "TEST-API-SYNC",
+            "navn": "Sync Test Product",
+            "kundepris": 100,
+            "pa_lager": 1
+        }
+        create_response = requests.post(f"{BASE_URL}/api/products", json=product_data, headers=auth_headers)
+        assert create_response.status_code == 200
+        product_id = create_response.json()["id"]
+        
+        response = requests.get(f"{BASE_URL}/api/sync?since={seq}", headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["seq"] > seq
+        upserted_ids = [p["id"] for p in data["changes"]["products"]["upserted"]]
+        assert product_id in upserted_ids
+        
+        requests.delete(f"{BASE_URL}/api/products/{product_id}", headers=auth_headers)
+        response = requests.get(f"{BASE_URL}/api/sync?since={data['seq']}", headers=auth_headers)
+        assert product_id in response.json()["changes"]["products"]["deleted"]
+        print(f"Sync seq advanced from {seq} to {response.json()['seq']}")
+    
+    def test_push_is_idempotent(self, auth_headers):
+        """Test that replaying a queued offline batch does not create duplicates"""
+        import uuid
+        key = f"TEST-API-{uuid.uuid4()}"
+        operations = [{
+            "idempotency_key": key,
+            "collection": "hms_incidents",
+            "op": "create",
+            "data": {"dato": "2026-01-06T00:00:00Z", "beskrivelse": "TEST-API offline incident"}
+        }]
+        first = requests.post(f"{BASE_URL}/api/sync/push", json={"operations": operations}, headers=auth_headers)
+        assert first.status_code == 200
+        first_result = first.json()["results"][0]
+        assert first_result["status"] == "created"
+        assert first_result["duplicate"] == False
+        
+        replay = requests.post(f"{BASE_URL}/api/sync/push", json={"operations": operations}, headers=auth_headers)
+        assert replay.status_code == 200
+        replay_result = replay.json()["results"][0]
+        assert replay_result["duplicate"] == True
+        assert replay_result["id"] == first_result["id"]
+        print(f"Replayed key {key} returned stored result for {first_result['id']}")
+
+    def test_push_rejects_existing_create_id(self, auth_headers):
+        """Test that a create reusing an existing document id is rejected, not inserted twice"""
+        import uuid
+        incident_id = str(uuid.uuid4())
+        data = {"dato": "2026-01-06T00:00:00Z", "beskrivelse": "TEST-API offline incident"}
+        operations = [
+            {"idempotency_key": f"TEST-API-{uuid.uuid4()}", "collection": "hms_incidents", "op": "create", "id": incident_id, "data": data},
+            {"idempotency_key": f"TEST-API-{uuid.uuid4()}", "collection": "hms_incidents", "op": "create", "id": incident_id, "data": data},
+        ]
+        response = requests.post(f"{BASE_URL}/api/sync/push", json={"operations": operations}, headers=auth_headers)
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert results[0]["status"] == "created"
+        assert results[1]["status"] == "error"
+        assert results[1]["id"] == incident_id
+
+
+class TestUsage:
+    """Subscription usage counter tests"""
+    
+    @pytest.fixture(scope="class")
+    def auth_headers(self):
+        """Get auth headers"""
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": "test@test.com",
+            "password": "test"
+        })
+        token = response.json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+    
+    def test_get_usage(self, auth_headers):
+        """Test that usage reports a count and limit for each limited collection"""
+        response = requests.get(f"{BASE_URL}/api/usage", headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        for collection in ["customers", "routes", "products"]:
+            assert "count" in data[collection]
+            assert "limit" in data[collection]
+        print(f"Usage: {data}")
+    
+    def test_product_create_and_delete_update_counter(self, auth_headers):
+        """Test that creating and deleting a product moves the product counter"""
+        before = requests.get(f"{BASE_URL}/api/usage", headers=auth_headers).json()["products"]["count"]
+        create_response = requests.post(f"{BASE_URL}/api/products", json={
+            "produktnr": "TEST-API-USAGE",
+            "navn": "Usage Test Product"
+        }, headers=auth_headers)
+        assert create_response.status_code == 200
+        assert requests.get(f"{BASE_URL}/api/usage", headers=auth_headers).json()["products"]["count"] == before + 1
+        
+        requests.delete(f"{BASE_URL}/api/products/{create_response.json()['id']}", headers=auth_headers)
+        assert requests.get(f"{BASE_URL}/api/usage", headers=auth_headers).json()["products"]["count"] == before
+
+
+class TestBootstrap:
+    """Page bootstrap endpoint tests"""
+    
+    @pytest.fixture(scope="class")
+    def auth_headers(self):
+        """Get auth headers"""
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": "test@test.com",
+            "password": "test"
+        })
+        token = response.json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+    
+    def test_bootstrap_results_view(self, auth_headers):
+        """Test that the results view returns every dataset the Results page loads"""
+        response = requests.get(f"{BASE_URL}/api/bootstrap?views=results", headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()["data"]
+        for dataset in ["workorders", "internalorders", "employees", "services", "customers", "supplier_pricing"]:
+            assert isinstance(data[dataset], list)
+        print(f"Bootstrap returned {sum(len(v) for v in data.values())} documents")
+    
+    def test_bootstrap_projection(self, auth_headers):
+        """Test that per-dataset field projections are honoured"""
+        response = requests.get(
+            f"{BASE_URL}/api/bootstrap?views=invoicing&fields=customers:id,kundnavn",
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+        for customer in response.json()["data"]["customers"]:
+            assert set(customer) <= {"id", "kundnavn"}
+    
+    def test_bootstrap_unknown_view(self, auth_headers):
+        """Test that an unknown view is rejected"""
+        response = requests.get(f"{BASE_URL}/api/bootstrap?views=nonexistent", headers=auth_headers)
+        assert response.status_code == 400
+
+
+class TestSchedule:
+    """Employee availability and booking conflict tests"""
+    
+    @pytest.fixture(scope="class")
+    def auth_headers(self):
+        """Get auth headers"""
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": "test@test.com",
+            "password": "test"
+        })
+        token = response.json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+    
+    @pytest.fixture(scope="class")
+    def employee_id(self, auth_headers):
+        """Create a throwaway employee so existing bookings don't interfere"""
+        response = requests.post(f"{BASE_URL}/api/employees", json={
+            "initialer": "TAPI",
+            "navn": "TEST-API Schedule",
+            "stilling": "Tekniker"
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        employee_id = response.json()["id"]
+        yield employee_id
+        orders = requests.get(f"{BASE_URL}/api/workorders?employee_id={employee_id}", headers=auth_headers).json()
+        for order in orders:
+            requests.delete(f"{BASE_URL}/api/workorders/{order['id']}", headers=auth_headers)
+        requests.delete(f"{BASE_URL}/api/employees/{employee_id}", headers=auth_headers)
+    
+    def work_order(self, employee_id, date, hours):
+        return {
+            "customer_id": "TEST-API-customer",
+            "employee_id": employee_id,
+            "date": date,
+            "order_type": "service",
+            "arbeidstid": hours
+        }
+    
+    def test_conflicting_work_order_rejected(self, auth_headers, employee_id):
+        """Test that check_conflicts rejects an overlapping booking with 409"""
+        response = requests.post(f"{BASE_URL}/api/workorders?check_conflicts=true",
+                                 json=self.work_order(employee_id, "2026-03-02T08:00:00Z", 3), headers=auth_headers)
+        assert response.status_code == 200
+        
+        response = requests.post(f"{BASE_URL}/api/workorders?check_conflicts=true",
+                                 json=self.work_order(employee_id, "2026-03-02T10:00:00Z", 1), headers=auth_headers)
+        assert response.status_code == 409
+        assert len(response.json()["detail"]["conflicts"]) == 1
+    
+    def test_bulk_conflict_within_batch(self, auth_headers, employee_id):
+        """Test that overlapping orders in one bulk request are rejected together"""
+        response = requests.post(f"{BASE_URL}/api/workorders/bulk?check_conflicts=true", json=[
+            self.work_order(employee_id, "2026-03-03T08:00:00Z", 2),
+            self.work_order(employee_id, "2026-03-03T09:00:00Z", 2)
+        ], headers=auth_headers)
+        assert response.status_code == 409
+        assert response.json()["detail"]["orders"][0]["index"] == 1
+    
+    def test_employee_availability(self, auth_headers, employee_id):
+        """Test that availability reports booked and free hours per day"""
+        response = requests.get(f"{BASE_URL}/api/employees/{employee_id}/availability?from=2026-03-02&to=2026-03-04",
+                                headers=auth_headers)
+        assert response.status_code == 200
+        days = response.json()["days"]
+        assert [day["date"] for day in days] == ["2026-03-02", "2026-03-03"]
+        assert days[0]["booked_hours"] == 3.0
+        assert days[1]["booked_hours"] == 0.0
+
+
+class TestMetrics:
+    """Prometheus metrics endpoint tests"""
+    
+    def test_metrics_exposes_route_and_db_timings(self):
+        """Test that /metrics reports request latency per route template and Mongo command latency"""
+        requests.get(f"{BASE_URL}/health")
+        response = requests.get(f"{BASE_URL}/metrics")
+        assert response.status_code == 200
+        assert "text/plain" in response.headers["content-type"]
+        assert 'http_request_duration_seconds_count{method="GET",route="/health",status="200"}' in response.text
+        assert "mongodb_command_duration_seconds" in response.text
+        assert "event_loop_lag_seconds" in response.text
+    
+    def test_server_timing_header(self):
+        """Test that API responses break down their time in a Server-Timing header"""
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": "test@test.com",
+            "password": "test"
+        })
+        auth_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        response = requests.get(f"{BASE_URL}/api/customers", headers=auth_headers)
+        assert response.status_code == 200
+        timing = response.headers["Server-Timing"]
+        for name in ["db", "auth", "handler", "serialize", "total"]:
+            assert f"{name};dur=" in timing
+        print(f"Server-Timing: {timing}")
+    
+    def test_profile_worker(self):
+        """Test that admins get a collapsed-stack profile of the worker"""
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": "test@test.com",
+            "password": "test"
+        })
+        auth_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        response = requests.post(f"{BASE_URL}/api/admin/profile?seconds=1", headers=auth_headers)
+        assert response.status_code == 200
+        for line in response.text.strip().splitlines():
+            stack, count = line.rsplit(" ", 1)
+            assert count.isdigit()
+        print(f"Profile has {len(response.text.splitlines())} stacks")
+    
+    def test_coalescing_metrics(self):
+        """Test that repeated dashboard requests are coalesced and counted in /metrics"""
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": "test@test.com",
+            "password": "test"
+        })
+        auth_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        first = requests.get(f"{BASE_URL}/api/dashboard/stats", headers=auth_headers)
+        second = requests.get(f"{BASE_URL}/api/dashboard/stats", headers=auth_headers)
+        assert first.status_code == 200 and second.status_code == 200
+        assert first.json() == second.json()
+        response = requests.get(f"{BASE_URL}/metrics")
+        assert 'coalesced_requests_total{endpoint="dashboard_stats"' in response.text
+    
+    def test_slow_query_log(self):
+        """Test that admins can read the slow query log"""
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": "test@test.com",
+            "password": "test"
+        })
+        auth_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        response = requests.get(f"{BASE_URL}/api/admin/slow-queries?limit=10", headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["entries"]) <= 10
+        for entry in data["entries"]:
+            assert {"collection", "command", "filter", "duration_ms", "flags"} <= set(entry)
+
+
+class TestHealth:
+    """Liveness and readiness endpoint tests"""
+    
+    def test_health_live(self):
+        """Test that /health answers without depending on the database"""
+        response = requests.get(f"{BASE_URL}/health")
+        assert response.status_code == 200
+        assert response.json()["status"] == "healthy"
+    
+    def test_health_ready(self):
+        """Test that readiness pings the database and reports pool, event loop and cache state"""
+        response = requests.get(f"{BASE_URL}/health/ready")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "ready"
+        assert data["failing"] == []
+        assert data["checks"]["database"]["ping_ms"] is not None
+        assert {"max_size", "open", "checked_out", "checkout_wait_ms"} <= set(data["checks"]["pool"])
+        assert "lag_ms" in data["checks"]["event_loop"]
+        assert "warm" in data["checks"]["caches"]
+        print(f"Readiness: {data['checks']}")
+
+
 # Cleanup test data
 class TestCleanup:
     """Cleanup test-created data"""
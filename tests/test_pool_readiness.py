@@ -0,0 +1,49 @@
+"""
+Connection pool readiness: only time spent waiting for the pool counts, and the check looks
+at a percentile of recent checkouts rather than the single slowest one
+"""
+import asyncio
+import time
+
+import pytest
+
+from tests.benchmarks.harness import server, make_database, use_database, BENCH_MONGO_URL
+
+if not BENCH_MONGO_URL:
+    pytest.importorskip("mongomock_motor")
+
+
+def checkout(listener, seconds, creates_connection=False):
+    listener.connection_check_out_started(None)
+    listener._local.checkout_started -= seconds
+    if creates_connection:
+        listener.connection_created(None)
+    listener.connection_checked_out(None)
+
+
+class TestPoolReadiness:
+    """PoolMetricsListener waits and the readiness pool check"""
+
+    def test_connection_creation_is_not_a_pool_wait(self):
+        """Test that a checkout which opened a new connection isn't recorded as a wait"""
+        listener = server.PoolMetricsListener()
+        checkout(listener, 2.0, creates_connection=True)
+        checkout(listener, 0.01)
+        waits = listener.checkout_waits(60)
+        assert len(waits) == 1 and waits[0] == pytest.approx(0.01, abs=0.005)
+        assert listener.open == 1
+
+    @pytest.mark.parametrize("waits,ok", [
+        ([2.0], True),                     # too few samples to judge
+        ([0.01] * 19 + [2.0], True),       # one outlier above the 95th percentile
+        ([0.01] * 10 + [2.0] * 10, False),
+    ])
+    def test_pool_check_uses_percentile(self, monkeypatch, waits, ok):
+        """Test that the pool check tolerates a lone slow checkout but not sustained waits"""
+        listener = server.PoolMetricsListener()
+        now = time.perf_counter()
+        listener.recent_waits.extend((now, wait) for wait in waits)
+        monkeypatch.setattr(server, "pool_listener", listener)
+        use_database(make_database())
+        result = asyncio.run(server.ReadinessProbe()._run(server.app))
+        assert result["checks"]["pool"]["ok"] is ok
@@ -0,0 +1,102 @@
+"""
+Product image uploads: the stored format comes from the bytes, and files no product uses any
+more are deleted
+Run with: pytest tests/test_product_images.py
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import Headers, UploadFile
+
+from tests.benchmarks.harness import server, make_database, use_database, BENCH_MONGO_URL
+
+if not BENCH_MONGO_URL:
+    pytest.importorskip("mongomock_motor")
+
+# 1x1 transparent PNG and 1x1 GIF
+PNG = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==")
+GIF = base64.b64decode("R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7")
+
+
+def upload(data, content_type):
+    return UploadFile(io.BytesIO(data), filename="bilde", headers=Headers({"content-type": content_type}))
+
+
+@pytest.fixture
+def images(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "PRODUCT_IMAGES_DIR", tmp_path)
+    use_database(make_database())
+    yield tmp_path
+    server.shutdown_image_pool()
+
+
+class TestProductImages:
+    """upload_product_image and the unused image cleanup"""
+
+    async def create_products(self, user, count):
+        products = [server.Product(organization_id=user.organization_id, produktnr=f"P{i}", navn="Bilde")
+                    for i in range(count)]
+        await server.db.products.insert_many([{**p.model_dump(), "created_at": p.created_at.isoformat()} for p in products])
+        return [p.id for p in products]
+
+    def test_extension_follows_content(self, images):
+        """Test that a PNG sent as image/jpeg is stored and served as a PNG"""
+        async def run():
+            user = server.User(email="img@test.no", name="Img", organization_id=str(uuid.uuid4()))
+            product_id, = await self.create_products(user, 1)
+            return await server.upload_product_image(product_id, upload(PNG, "image/jpeg"), user)
+
+        result = asyncio.run(run())
+        assert result["image_url"] == f"/api/images/products/{hashlib.sha256(PNG).hexdigest()}.png"
+        assert (images / f"{hashlib.sha256(PNG).hexdigest()}.png").exists()
+
+    def test_rejects_bytes_that_are_not_an_image(self, images):
+        """Test that text sent as image/png is refused and nothing is left on disk"""
+        async def run():
+            user = server.User(email="img@test.no", name="Img", organization_id=str(uuid.uuid4()))
+            product_id, = await self.create_products(user, 1)
+            await server.upload_product_image(product_id, upload(b"hello world", "image/png"), user)
+
+        with pytest.raises(HTTPException) as raised:
+            asyncio.run(run())
+        assert raised.value.status_code == 400
+        assert list(images.iterdir()) == []
+
+    def test_unused_images_are_deleted(self, images, monkeypatch):
+        """Test that replacing or deleting an image removes its files unless another product uses them"""
+        monkeypatch.setattr(server, "IMAGE_GC_GRACE_SECONDS", 0)
+        png_digest = hashlib.sha256(PNG).hexdigest()
+
+        async def run():
+            user = server.User(email="img@test.no", name="Img", organization_id=str(uuid.uuid4()))
+            first, second = await self.create_products(user, 2)
+            await server.upload_product_image(first, upload(PNG, "image/png"), user)
+            await server.upload_product_image(second, upload(PNG, "image/png"), user)
+            await server.upload_product_image(first, upload(GIF, "image/gif"), user)
+            shared = sorted(path.name for path in images.glob(f"{png_digest}*"))
+            await server.delete_product(second, user)
+            return shared
+
+        shared = asyncio.run(run())
+        assert f"{png_digest}.png" in shared
+        # The original plus its WebP and two sizes in both formats
+        assert len(shared) == (1 + 1 + 2 * len(server.IMAGE_SIZES) if server.IMAGE_VARIANTS_ENABLED else 1)
+        assert not list(images.glob(f"{png_digest}*"))
+        assert (images / f"{hashlib.sha256(GIF).hexdigest()}.gif").exists()
+
+    def test_recent_upload_is_kept(self, images):
+        """Test that an unreferenced image inside the grace period survives the sweep"""
+        async def run():
+            user = server.User(email="img@test.no", name="Img", organization_id=str(uuid.uuid4()))
+            product_id, = await self.create_products(user, 1)
+            await server.upload_product_image(product_id, upload(PNG, "image/png"), user)
+            await server.delete_product(product_id, user)
+            return await server.purge_product_images()
+
+        assert asyncio.run(run()) == 0
+        assert (images / f"{hashlib.sha256(PNG).hexdigest()}.png").exists()
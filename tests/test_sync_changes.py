@@ -0,0 +1,33 @@
+"""
+Delta sync ordering: entries are only handed out up to the first sequence number that is
+still being written, so a client never skips past a change that lands late
+"""
+from datetime import datetime, timedelta, timezone
+
+from tests.benchmarks.harness import server
+
+
+def entry(seq, age_seconds=0):
+    ts = datetime.now(timezone.utc) - timedelta(seconds=age_seconds)
+    return {"seq": seq, "collection": "products", "doc_id": str(seq), "op": "upsert", "ts": ts.isoformat()}
+
+
+class TestContiguousChanges:
+    """contiguous_changes() stops at in-flight gaps and skips abandoned ones"""
+
+    def test_without_gaps_returns_everything(self):
+        """Test that a contiguous run is returned as is"""
+        entries = [entry(6), entry(7), entry(8)]
+        assert server.contiguous_changes(entries, 5) == entries
+
+    def test_stops_before_recent_gap(self):
+        """Test that seq 7 is held back while seq 6 may still be inserted"""
+        entries = [entry(5), entry(7), entry(8)]
+        assert server.contiguous_changes(entries, 4) == entries[:1]
+        assert server.contiguous_changes(entries[1:], 5) == []
+
+    def test_skips_abandoned_gap(self):
+        """Test that a gap older than the grace period no longer blocks the entries after it"""
+        old = server.SYNC_GAP_GRACE_SECONDS + 5
+        entries = [entry(5, old), entry(7, old), entry(8)]
+        assert server.contiguous_changes(entries, 4) == entries
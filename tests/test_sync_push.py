@@ -0,0 +1,76 @@
+"""
+Offline push: a client-chosen id is refused by the unique id index even when two pushes with
+different idempotency keys race to create it
+Run with: pytest tests/test_sync_push.py
+"""
+import asyncio
+import uuid
+
+import pytest
+from pymongo import InsertOne
+
+from tests.benchmarks.harness import server, make_database, use_database, BENCH_MONGO_URL
+
+if not BENCH_MONGO_URL:
+    pytest.importorskip("mongomock_motor")
+
+INCIDENT = {"dato": "2026-01-06T00:00:00Z", "beskrivelse": "Offline incident"}
+
+
+def create(incident_id):
+    return server.SyncOperation(idempotency_key=str(uuid.uuid4()), collection="hms_incidents", id=incident_id,
+                                data=INCIDENT)
+
+
+class TestSyncPush:
+    """Unique ids for collections that accept offline creates"""
+
+    def test_unique_index_renames_existing_duplicates(self):
+        """Test that duplicates left by the old index are renamed before the unique index is built"""
+        async def run():
+            use_database(make_database())
+            await server.db.hms_incidents.create_index("id")
+            await server.db.hms_incidents.insert_many([
+                {"id": "same", "organization_id": "org-a", "n": 1},
+                {"id": "same", "organization_id": "org-b", "n": 2},
+            ])
+            await server.ensure_unique_id_index("hms_incidents")
+            docs = await server.db.hms_incidents.find({}, {"_id": 0}).sort("n", 1).to_list(None)
+            return docs, await server.db.hms_incidents.index_information()
+
+        docs, indexes = asyncio.run(run())
+        assert docs[0]["id"] == "same" and docs[1]["id"] != "same"
+        assert indexes["id_1"].get("unique")
+
+    def test_duplicate_key_becomes_operation_error(self):
+        """Test that an insert refused by the index rejects that id and still applies the rest"""
+        async def run():
+            use_database(make_database())
+            await server.ensure_unique_id_index("hms_incidents")
+            await server.db.hms_incidents.insert_one({"id": "taken", "organization_id": "org-b"})
+            writes = [InsertOne({"id": "taken", "organization_id": "org-a"}),
+                      InsertOne({"id": "free", "organization_id": "org-a"})]
+            pending = [(None, {"status": "created", "id": "taken"}), (None, {"status": "created", "id": "free"})]
+            failures = await server.apply_push_writes("hms_incidents", writes, pending)
+            return failures, await server.db.hms_incidents.count_documents({"organization_id": "org-a"})
+
+        failures, applied = asyncio.run(run())
+        assert failures == {0: {"id": "taken", "detail": "A document with this id already exists"}}
+        assert applied == 1
+
+    def test_concurrent_pushes_create_once(self):
+        """Test that two pushes with different keys creating the same id insert it once"""
+        async def run():
+            use_database(make_database())
+            await server.ensure_unique_id_index("hms_incidents")
+            user = server.User(email="sync@test.no", name="Sync", organization_id=str(uuid.uuid4()))
+            incident_id = str(uuid.uuid4())
+            responses = await asyncio.gather(*(
+                server.sync_push(server.SyncPushRequest(operations=[create(incident_id)]), user) for _ in range(2)
+            ))
+            return [response["results"][0] for response in responses], \
+                await server.db.hms_incidents.count_documents({"id": incident_id})
+
+        results, stored = asyncio.run(run())
+        assert stored == 1
+        assert sorted(result["status"] for result in results) == ["created", "error"]
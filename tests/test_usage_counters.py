@@ -0,0 +1,50 @@
+"""
+Usage counters stay complete when an organization's first counted write is an import
+Run with: pytest tests/test_usage_counters.py
+"""
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from tests.benchmarks.harness import server, make_database, use_database, BENCH_MONGO_URL
+
+if not BENCH_MONGO_URL:
+    pytest.importorskip("mongomock_motor")
+
+LIMITED = {"max_customers": 50, "max_routes": 20, "max_products": 100}
+UNLIMITED = {"max_customers": -1, "max_routes": -1, "max_products": -1}
+
+
+async def import_then_create_product(monkeypatch, features, existing_products=0):
+    """Import 5 customers, then create one product; returns the organization's counter"""
+    use_database(make_database())
+
+    async def get_active(organization_id):
+        return SimpleNamespace(features=features)
+    monkeypatch.setattr(server.license_cache, "get_active", get_active)
+
+    org_id = str(uuid.uuid4())
+    await server.db.customers.insert_many([{"id": str(uuid.uuid4()), "organization_id": org_id} for _ in range(5)])
+    if existing_products:
+        await server.db.products.insert_many([
+            {"id": str(uuid.uuid4()), "organization_id": org_id} for _ in range(existing_products)
+        ])
+    await server.set_usage(org_id, "customers", 5)
+    await server.reserve_usage(org_id, "products")
+    return await server.db.usage_counters.find_one({"organization_id": org_id}, {"_id": 0, "organization_id": 0})
+
+
+class TestUsageCounters:
+    """Counters created by set_usage carry every limited collection"""
+
+    def test_product_create_after_customer_import_on_limited_tier(self, monkeypatch):
+        """Test that importing customers first doesn't turn the next product create into a 403"""
+        counts = asyncio.run(import_then_create_product(monkeypatch, LIMITED))
+        assert counts == {"customers": 5, "routes": 0, "products": 1}
+
+    def test_product_create_after_customer_import_on_unlimited_tier(self, monkeypatch):
+        """Test that the product count starts from the existing products, not from zero"""
+        counts = asyncio.run(import_then_create_product(monkeypatch, UNLIMITED, existing_products=3))
+        assert counts == {"customers": 5, "routes": 0, "products": 4}